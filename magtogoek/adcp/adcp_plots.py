@@ -74,7 +74,8 @@ def make_adcp_figure(dataset: xr.Dataset,
 
     Returns
     -------
-
+    figures_paths :
+        Paths of the figures written to file.
     """
 
     figs, figs_names = [], []
@@ -118,6 +119,7 @@ def make_adcp_figure(dataset: xr.Dataset,
         figs.append(plot_test_fields(dataset))
         figs_names.append('test_fields')
 
+    figures_paths = []
     if save_path is not None:
         stem = ''
         if Path(save_path).is_dir():
@@ -126,7 +128,8 @@ def make_adcp_figure(dataset: xr.Dataset,
             path = Path(save_path).parent
             stem = str(Path(save_path).stem) + '_'
         for name, fig in zip(figs_names, figs):
-            fig.savefig(path.joinpath(stem + f'{name}.png'))
+            figures_paths.append(path.joinpath(stem + f'{name}.png'))
+            fig.savefig(figures_paths[-1])
 
     if show_fig is True:
         if single is True:
@@ -141,6 +144,8 @@ def make_adcp_figure(dataset: xr.Dataset,
 
     plt.close('all')
 
+    return figures_paths
+
 
 def plot_velocity_polar_hist(dataset: xr.Dataset, nrows: int = 3, ncols: int = 3,
                              uv: List[str] = ("u", "v"),  flag_thres: int = 2):
@@ -241,7 +246,8 @@ def plot_test_fields(dataset: xr.Dataset):
     """
     """
     extent = get_extent(dataset)
-    fig, axes = plt.subplots(figsize=(12, 8), nrows=3, ncols=3, sharex=True, sharey=True)
+    nrows = int(np.ceil(len(dataset.attrs["binary_mask_tests"]) / 3))
+    fig, axes = plt.subplots(figsize=(12, 8 * nrows / 3), nrows=nrows, ncols=3, sharex=True, sharey=True)
     axes = axes.flatten()
     for index, test_name in enumerate(dataset.attrs["binary_mask_tests"]):
         value = dataset.attrs["binary_mask_tests_values"][index]
@@ -252,11 +258,11 @@ def plot_test_fields(dataset: xr.Dataset):
             axes[index].set_title(test_name + f": {value}", fontdict=FONT)
         axes[index].tick_params(labelleft=False, labelbottom=False)
 
-    axes[3].set_ylabel("depth [m]", fontdict=FONT)
-    axes[3].tick_params(labelleft=True)
-    axes[7].tick_params(labelbottom=True)
-    axes[7].set_xlabel("time", fontdict=FONT)
-    axes[7].tick_params(axis="x", rotation=-30)
+    axes[3 * ((nrows - 1) // 2)].set_ylabel("depth [m]", fontdict=FONT)
+    axes[3 * ((nrows - 1) // 2)].tick_params(labelleft=True)
+    axes[3 * (nrows - 1) + 1].tick_params(labelbottom=True)
+    axes[3 * (nrows - 1) + 1].set_xlabel("time", fontdict=FONT)
+    axes[3 * (nrows - 1) + 1].tick_params(axis="x", rotation=-30)
 
     cbar_axe = fig.add_axes([0.15, 0.08, 0.2, 0.005])
     cbar = clb.ColorbarBase(
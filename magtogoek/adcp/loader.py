@@ -12,11 +12,18 @@ reader supports .000, .ENX, .ENS, .LTA and .STA binary files.
 - sonar: 'wh', 'sv', 'os'.
 - Sentinel V encoding is not fully supported by pycurrents.
 
+RDI data can also be read with the Magtogoek pd0_reader (`pd0_reader="magtogoek"`), a numpy
+PD0 decoder returning the same Bunch layout as Multiread.
+
 RTI data re read using Magtogoek rti_reader built from rti_python tools by RoweTech.
 - sonar: 'sw'
 - Rowetech files can also be exporter directly to Teledyne `PD0` formats and read by pycurrents
 using 'sw_pd0' for sonar.
 
+With `chunk_size`, the readers only read the time series and the file level values. The [depth, time]
+variables are dask arrays whose chunks are decoded from the raw files when they are computed, so the
+full profiles arrays are never held in memory (RTI and Magtogoek pd0_reader only).
+
 Notes
 -----
 - Orientation is taken from the first profile of the first file if not no value is pass.
@@ -29,12 +36,15 @@ file will be processed but a warning will be raised. The cause was not investiga
 See Also
 --------
    * pycurrents.adcp.rdiraw.Multiread
+   * magtogoek.adcp.pd0_reader
    * rti_python
 
 """
+import functools
 import logging
 import sys
 import typing as tp
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 
 import numpy as np
@@ -43,12 +53,17 @@ import xarray as xr
 
 import gsw
 
+from magtogoek.adcp.pd0_index import load_pd0_index, read_pd0_sys_cfg, read_pd0_time
+from magtogoek.adcp.pd0_reader import Pd0Reader, read_pd0_file
+from magtogoek.adcp.rti_index import load_ens_index, read_ens_time
+from magtogoek.adcp.rti_reader import BATCH_SIZE as RTI_BATCH_SIZE
 from magtogoek.adcp.rti_reader import RtiReader
 from magtogoek.adcp.rti_reader import l as rti_log
-from magtogoek.adcp.tools import dday_to_datetime64
-from magtogoek.utils import Logger, get_files_from_expression
-from pycurrents.adcp import rdiraw, transform
-from pycurrents.adcp.rdiraw import Bunch, Multiread, rawfile
+from magtogoek.adcp.tools import dday_to_datetime64, get_time_window_trims
+from magtogoek.adcp.transform import transform_to_earth
+from magtogoek.utils import Logger, ensure_list_format, get_files_from_expression
+from pycurrents.adcp import rdiraw
+from pycurrents.adcp.rdiraw import Bunch, Multiread
 
 # This is to prevent pycurrents from printing warnings.
 logging.getLogger(rdiraw.__name__).setLevel("CRITICAL")
@@ -57,6 +72,11 @@ RDI_SONAR = ["wh", "sv", "os", "sw_pd0"]
 RTI_SONAR = ["sw"]
 
 VEL_FILL_VALUE = -32768.0
+PROFILE_DATA = ["vel", "cor", "amp", "pg", "vbvel", "VBCorrelation", "VBIntensity", "VBPercentGood"]
+FLOAT32_DATA = [
+    "vel", "bt_vel", "vbvel", "pg", "pg4", "VBCorrelation", "VBIntensity", "VBPercentGood",
+    *(f"{var}{i}" for var in ["cor", "amp"] for i in range(1, 5)),
+]
 
 l = Logger(level=0)
 
@@ -76,11 +96,19 @@ def load_adcp_binary(
     orientation: str = None,
     leading_index: int = None,
     trailing_index: int = None,
+    leading_time: pd.Timestamp = None,
+    trailing_time: pd.Timestamp = None,
     sensor_depth: float = None,
     bad_pressure: bool = False,
     start_time: str = None,
     time_step: float = None,
     magnetic_declination_preset: float = None,
+    batch_size: int = RTI_BATCH_SIZE,
+    variables: tp.Iterable[str] = None,
+    pd0_reader: str = "pycurrents",
+    chunk_size: int = None,
+    float32: bool = False,
+    save_index: bool = True,
 ) -> xr.Dataset:
     """Load RDI and RTI adcp data.
 
@@ -106,6 +134,15 @@ def load_adcp_binary(
         Number of ensemble to cut from the start.
     trailing_index:
         Number of ensemble to cut from the end.
+    leading_time:
+        Ensembles before `leading_time` are not read. The ensembles times are binary
+        searched in the files so only the ensembles inside the time window are decoded.
+        The time window is not applied if it is outside the files time span.
+        With the `pycurrents` pd0_reader, the trims found with the ensembles index are passed
+        to Multiread which counts the ensembles with its own validation rules. A warning is
+        logged if the number of ensembles read does not match the index.
+    trailing_time:
+        Ensembles after `trailing_time` are not read.
     sensor_depth:
         If provided, the adcp depth (meter) will be adjusted so that its median equal `sensor_depth`.
     bad_pressure:
@@ -122,6 +159,28 @@ def load_adcp_binary(
         program before deployment, so the value read is always null. Overwrite
         this (e.g., with the value from the program commands) by setting this
         parameter.
+    batch_size :
+        (RTI only) Number of ensembles decoded at once. The data arrays are
+        filled batch by batch which bounds the memory used for decoding.
+    variables :
+        (RTI only) Optional variables to load. Any of `amp`, `cor`, `pg`, `bt` and `nav`.
+        All are loaded if None. The data of the others are not decoded.
+    pd0_reader :
+        (RDI only) Reader used for the PD0 files. Either `pycurrents` (Multiread) or
+        `magtogoek` (magtogoek.adcp.pd0_reader.Pd0Reader).
+    chunk_size :
+        If provided, the [depth, time] variables are returned as dask arrays chunked along
+        time by `chunk_size` ensembles so that the following processing steps are carried
+        out chunk by chunk. The chunks are read from the raw files when they are computed
+        (RTI and `magtogoek` pd0_reader). With the `pycurrents` pd0_reader, the data are
+        read in memory before being chunked. Requires dask.
+    float32 :
+        If True, the velocities, amplitudes, correlations and percent good are loaded
+        as float32 instead of float64.
+    save_index :
+        If True, the ensembles index of the files are saved as sidecar files (`.idx`) next
+        to the raw files so that later reads do not need to scan them again. Set to False
+        for read-only archives.
 
     Returns
     -------
@@ -145,11 +204,24 @@ def load_adcp_binary(
     # ------------------------ #
     # Reading the data file(s) #
     # ------------------------ #
+    # With `chunk_size`, only the time series are read here. The profiles are read chunk by chunk
+    # from the files read index with `read_segments` (see _read_chunked_profiles).
+    read_profiles = chunk_size is None
+    read_segments, files_read_index = None, None
     if sonar in RTI_SONAR:
         l.log(_print_filenames("RTI ENS", filenames))
-        data = RtiReader(filenames=filenames).read(
-            start_index=leading_index, stop_index=trailing_index
+        reader = RtiReader(filenames=filenames, variables=variables, save_index=save_index)
+        data = reader.read(
+            start_index=leading_index,
+            stop_index=trailing_index,
+            batch_size=batch_size,
+            start_time=leading_time,
+            stop_time=trailing_time,
+            profiles=read_profiles,
         )
+        if read_profiles is False:
+            files_read_index = reader.get_files_read_index()
+            read_segments = functools.partial(RtiReader.read_segments, skip=reader.skip)
         if magnetic_declination_preset is not None:
             data.FL['EV'] = magnetic_declination_preset * 100
         l.logbook += rti_log.logbook
@@ -160,18 +232,47 @@ def load_adcp_binary(
         else:
             l.log(_print_filenames("RDI pd0", filenames))
 
-        if trailing_index:
-            trailing_index *= -1
+        # The ensembles index of the files are only loaded up front if they are used by the time
+        # window or the magtogoek reader. They are then reused by the FixedLeader check.
+        files_index = {}
+        time_window = leading_time is not None or trailing_time is not None
+        if time_window or pd0_reader == "magtogoek":
+            files_index = {filename: load_pd0_index(filename, save=save_index) for filename in filenames}
+
+        if time_window:
+            leading, trailing = _get_pd0_time_window_trims(files_index, yearbase, leading_time, trailing_time)
+            leading_index = max(leading_index or 0, leading) or None
+            trailing_index = max(trailing_index or 0, trailing) or None
+            l.log(f"Time window: {leading} leading and {trailing} trailing ensembles were not read.")
 
         try:
-            data = Multiread(fnames=filenames, sonar=sonar, yearbase=yearbase).read(
-                start=leading_index, stop=trailing_index
-            )
+            if pd0_reader == "magtogoek":
+                reader = Pd0Reader(
+                    filenames=filenames, sonar=sonar, yearbase=yearbase, files_index=files_index, save_index=save_index
+                )
+                data = reader.read(start_index=leading_index, stop_index=trailing_index, profiles=read_profiles)
+                if read_profiles is False:
+                    files_read_index = reader.files_read_index
+                    read_segments = functools.partial(_read_pd0_segments, yearbase=yearbase)
+            elif pd0_reader == "pycurrents":
+                data = Multiread(fnames=filenames, sonar=sonar, yearbase=yearbase).read(
+                    start=leading_index, stop=-trailing_index if trailing_index else None
+                )
+                if data and files_index:
+                    _check_multiread_count(data, files_index, leading_index, trailing_index)
+                if read_profiles is False:
+                    l.warning(
+                        "The pycurrents reader does not read by batches, the data are read in memory before being "
+                        "chunked. Use `pd0_reader = magtogoek` to read the data chunk by chunk."
+                    )
+            else:
+                raise ValueError(f"Invalid pd0_reader: {pd0_reader}. Valid pd0_reader: `pycurrents`, `magtogoek`.")
             if not data:
                 raise ValueError(
                     "The sum of the trim values is greater than the number of ensemble."
                 )
-            data.vel = np.asarray(data.vel)
+            if "vel" in data:
+                data.vel = np.asarray(data.vel)
             if "vbvel" in data:
                 data.vbvel = np.asarray(data.vbvel)
             if "bt_vel" in data:
@@ -181,6 +282,8 @@ def load_adcp_binary(
                 f"ERROR: The input_files are not in a RDI pd0 format. RDI sonar : {RDI_SONAR}"
             )
             sys.exit()
+        if trailing_index:
+            trailing_index *= -1
         if leading_index is not None or trailing_index is not None:
             l.log(f"Time index cut: leading={0 if leading_index is None else leading_index}, "
                   f"trailing={0 if trailing_index is None else trailing_index}")
@@ -188,10 +291,10 @@ def load_adcp_binary(
         # noinspection PyTupleAssignmentBalance
         data.sysconfig["up"], invalid_config_count = check_pd0_fixed_leader(
             filenames=filenames,
-            sonar=sonar,
-            yearbase=yearbase,
             leading_index=leading_index,
             trailing_index=trailing_index,
+            files_index=files_index,
+            save_index=save_index,
         )
 
         if invalid_config_count:
@@ -222,7 +325,7 @@ def load_adcp_binary(
     # Convert `dday` to datetime64 #
     # ---------------------------- #
 
-    time, time_string, bad_dday = _get_time(data.dday, yearbase, start_time, time_step)
+    time, bad_dday = _get_time(data.dday, yearbase, start_time, time_step)
 
     # ----------------------------------------------------------- #
     # Convert depth relative to the ADCP to depth below surface   #
@@ -278,14 +381,19 @@ def load_adcp_binary(
     # --------------------- #
     dataset = xr.Dataset(coords={"depth": depth, "time": time})
 
+    if float32 is True:
+        _data_to_float32(data)
+        l.log("Velocities and beam data loaded as float32.")
+
     # --------------------------------------- #
     # Dealing with the coordinates system     #
     # --------------------------------------- #
     original_coordsystem = data.trans["coordsystem"]
+    transform_parameters = None
     if original_coordsystem != "earth":
         l.log(f"The velocity data are in {data.trans['coordsystem']} coordinate")
 
-        coordsystem2earth(data=data, orientation=orientation)
+        transform_parameters = coordsystem2earth(data=data, orientation=orientation)
 
         if data.trans["coordsystem"] == "xyz":
             l.warning("Roll, Pitch or Heading seems to be missing from the data file.")
@@ -294,21 +402,29 @@ def load_adcp_binary(
     # --------------------------- #
     # Loading the transducer data #
     # --------------------------- #
-    data.vel[data.vel == VEL_FILL_VALUE] = np.nan
+    if files_read_index is not None:
+        profiles = _read_chunked_profiles(
+            read_segments=read_segments,
+            files_read_index=files_read_index,
+            chunk_size=chunk_size,
+            data=data,
+            sonar=sonar,
+            original_coordsystem=original_coordsystem,
+            transform_parameters=transform_parameters,
+            float32=float32,
+        )
+    else:
+        profiles = _get_profiles(data, sonar, original_coordsystem)
+
     # WATER VELOCITIES
-    dataset["u"] = (["depth", "time"], data.vel[:, :, 0].T)
-    dataset["v"] = (["depth", "time"], data.vel[:, :, 1].T)
-    dataset["w"] = (["depth", "time"], data.vel[:, :, 2].T)
-    dataset["e"] = (["depth", "time"], data.vel[:, :, 3].T)
+    for name in ["u", "v", "w", "e"]:
+        dataset[name] = (["depth", "time"], profiles.pop(name))
     l.log("Velocity data loaded")
 
     if sonar == "sv":
-        data.vbvel[data.vbvel == VEL_FILL_VALUE] = np.nan
-        dataset["vb_vel"] = (["depth", "time"], data.vbvel.T)
-        dataset["vb_corr"] = (["depth", "time"], np.asarray(data.VBCorrelation.T))
-        dataset["vb_amp"] = (["depth", "time"], np.asarray(data.VBIntensity.T))
-        if "VBPercentGood" in data:
-            dataset["vb_pg"] = (["depth", "time"], np.asarray(data.VBPercentGood.T))
+        for name in ["vb_vel", "vb_corr", "vb_amp", "vb_pg"]:
+            if name in profiles:
+                dataset[name] = (["depth", "time"], profiles.pop(name))
         l.log("Data from the Sentinel V fifth beam loaded.")
 
     # BOTTOM VELOCITIES
@@ -336,7 +452,7 @@ def load_adcp_binary(
             l.log(
                 "Bottom depth values were all `0`, therefore they were dropped from the output."
             )
-        elif not np.isfinite(data.bt_depth).all():
+        elif np.isnan(np.ma.filled(data.bt_depth, np.nan)).all():
             l.log(
                 "Bottom depth values were all `nan`, therefore they were dropped from the output."
             )
@@ -352,7 +468,7 @@ def load_adcp_binary(
                     "velocity. "
                 )
                 l.log(
-                    f"The averaged xducer_depth computed from the bottom tracking is {np.median(data.bt_depth)}."
+                    f"The averaged xducer_depth computed from the bottom tracking is {np.nanmedian(data.bt_depth)}."
                 )
             elif sensor_depth:
                 if abs(depth_difference) > 0 and sonar == "os":
@@ -363,23 +479,17 @@ def load_adcp_binary(
             l.log("Bottom depth  data loaded")
 
     # QUALITY
-    if "pg" in data:
+    if "pg" in profiles:
         if original_coordsystem == "beam":
-            dataset["pg"] = (["depth", "time"], np.asarray(np.mean(data.pg, axis=2).T))
             l.log(
                 "Percent good was computed by averaging each beam PercentGood. The raw data were in beam coordinate."
             )
-        else:
-            dataset["pg"] = (["depth", "time"], np.asarray(data.pg4.T))
-    else:
+    elif variables is None or "pg" in variables or sonar not in RTI_SONAR:
         l.warning("Percent good was not retrieve from the dataset.")
 
-    if "cor1" in data:
-        for i in range(1, 5):
-            dataset[f"corr{i}"] = (["depth", "time"], np.asarray(data[f"cor{i}"].T))
-    if "amp1" in data:
-        for i in range(1, 5):
-            dataset[f"amp{i}"] = (["depth", "time"], np.asarray(data[f"amp{i}"].T))
+    # Percent good, correlations and amplitudes.
+    for name, values in profiles.items():
+        dataset[name] = (["depth", "time"], values)
 
     # ------------------ #
     # Loading depth data #
@@ -438,17 +548,20 @@ def load_adcp_binary(
         else:
             dataset["temperature"] = (["time"], np.asarray(data.temperature))
 
-    # ------------------------------- #
-    # Load time string or dday if bad #
-    # ------------------------------- #
+    # ---------------- #
+    # Load dday if bad #
+    # ---------------- #
     if bad_dday:
         dataset["dday"] = (["time"], np.asarray(data.dday))
-    else:
-        dataset["time_string"] = (["time"], time_string)
 
     if orientation == "up":
         dataset = dataset.sortby("depth")
 
+    if chunk_size is not None:
+        if files_read_index is None:
+            _chunk_dataset(dataset, chunk_size)
+        l.log(f"Data loaded as dask arrays chunked along time by {chunk_size} ensembles.")
+
     # -------------- #
     # Add attributes #
     # -------------- #
@@ -502,15 +615,262 @@ def load_adcp_binary(
     return dataset
 
 
-def coordsystem2earth(data: Bunch, orientation: str):
+def _data_to_float32(data: Bunch):
+    """Cast (in place) the velocity and beam data arrays of `data` to float32."""
+    for key in FLOAT32_DATA:
+        if key in data:
+            data[key] = np.asarray(data[key], dtype=np.float32)
+
+
+def _get_profiles(data: Bunch, sonar: str, original_coordsystem: str) -> tp.Dict[str, np.ndarray]:
+    """Return the [depth, time] variables of `data`: {variable_name: values}.
+
+    The velocities fill values are replaced (in place) by NaN. The percent good are the beams
+    average if the raw data were in beam coordinate or the 4th beam percent good otherwise.
+    """
+    profiles = dict()
+    data.vel[data.vel == VEL_FILL_VALUE] = np.nan
+    for i, name in enumerate(["u", "v", "w", "e"]):
+        profiles[name] = data.vel[:, :, i].T
+
+    if sonar == "sv":
+        data.vbvel[data.vbvel == VEL_FILL_VALUE] = np.nan
+        profiles["vb_vel"] = data.vbvel.T
+        profiles["vb_corr"] = np.asarray(data.VBCorrelation.T)
+        profiles["vb_amp"] = np.asarray(data.VBIntensity.T)
+        if "VBPercentGood" in data:
+            profiles["vb_pg"] = np.asarray(data.VBPercentGood.T)
+
+    if "pg" in data:
+        if original_coordsystem == "beam":
+            profiles["pg"] = np.asarray(np.mean(data.pg, axis=2).T)
+        else:
+            profiles["pg"] = np.asarray(data.pg4.T)
+
+    if "cor1" in data:
+        for i in range(1, 5):
+            profiles[f"corr{i}"] = np.asarray(data[f"cor{i}"].T)
+    if "amp1" in data:
+        for i in range(1, 5):
+            profiles[f"amp{i}"] = np.asarray(data[f"amp{i}"].T)
+
+    return profiles
+
+
+def _read_chunked_profiles(
+    read_segments: tp.Callable[[tp.List[tp.Tuple[str, np.ndarray]]], tp.List[Bunch]],
+    files_read_index: tp.Dict[str, np.ndarray],
+    chunk_size: int,
+    data: Bunch,
+    sonar: str,
+    original_coordsystem: str,
+    transform_parameters: tp.Optional[dict],
+    float32: bool,
+) -> tp.Dict[str, "dask.array.Array"]:
+    """Return the [depth, time] variables as dask arrays read chunk by chunk from the raw files.
+
+    The ensembles of `files_read_index` are split in chunks of `chunk_size` ensembles. A chunk
+    is decoded with `read_segments`, transformed to earth coordinates and formatted (see
+    `_get_profiles`) by a dask task when it is computed. The first chunk is read here to
+    get the variables and their dtypes.
+
+    Parameters
+    ----------
+    read_segments :
+        Function decoding a list of (filename, index entries) segments into a Bunch per segment.
+    files_read_index :
+        Index entries of the ensembles read from each file.
+    data :
+        Time series read from the files. The heading, pitch and roll of each chunk are taken from it.
+    transform_parameters :
+        Parameters used by `coordsystem2earth` to transform the velocities of `data` (None if the
+        velocities are in earth coordinate).
+    """
+    import dask
+    import dask.array as da
+
+    chunks = _split_files_read_index(files_read_index, chunk_size)
+
+    arrays, layout, position = dict(), None, 0
+    for segments in chunks:
+        count = sum(len(index) for _, index in segments)
+        parameters = None
+        if transform_parameters is not None:
+            parameters = {
+                k: v[position: position + count] if k in ["heading", "pitch", "roll"] and v is not None else v
+                for k, v in transform_parameters.items()
+            }
+        arguments = (read_segments, segments, sonar, original_coordsystem, parameters, float32)
+        if layout is None:
+            profiles = _load_profiles_chunk(*arguments)
+            layout = {name: (values.shape[0], values.dtype) for name, values in profiles.items()}
+            for name, values in profiles.items():
+                arrays[name] = [da.from_array(values, chunks=values.shape)]
+        else:
+            task = dask.delayed(_load_profiles_chunk)(*arguments, layout=layout)
+            for name, (depth_count, dtype) in layout.items():
+                arrays[name].append(da.from_delayed(task[name], shape=(depth_count, count), dtype=dtype))
+        position += count
+
+    return {name: da.concatenate(values, axis=1) for name, values in arrays.items()}
+
+
+def _load_profiles_chunk(
+    read_segments: tp.Callable[[tp.List[tp.Tuple[str, np.ndarray]]], tp.List[Bunch]],
+    segments: tp.List[tp.Tuple[str, np.ndarray]],
+    sonar: str,
+    original_coordsystem: str,
+    transform_parameters: tp.Optional[dict],
+    float32: bool,
+    layout: tp.Dict[str, tp.Tuple[int, np.dtype]] = None,
+) -> tp.Dict[str, np.ndarray]:
+    """Decode the segments of a chunk and return its [depth, time] variables (see `_get_profiles`).
+
+    If `layout` ({variable_name: (depth_count, dtype)}) is given, the variables missing from
+    the chunk are filled with NaN (0 for integers) and the others not in `layout` are dropped.
+    """
+    bunches = read_segments(segments)
+    counts = [len(index) for _, index in segments]
+
+    chunk = Bunch()
+    for k in PROFILE_DATA:
+        arrays = [b[k] for b in bunches if k in b]
+        if len(arrays) == 0:
+            continue
+        template = arrays[0]
+        fill_value = VEL_FILL_VALUE if k in ["vel", "vbvel"] else np.nan if template.dtype.kind == "f" else 0
+        chunk[k] = np.concatenate([
+            b[k] if k in b else np.full((count,) + template.shape[1:], fill_value, dtype=template.dtype)
+            for b, count in zip(bunches, counts)
+        ])
+        if chunk[k].ndim == 3:
+            chunk.split(k)
+
+    if float32 is True:
+        _data_to_float32(chunk)
+    if transform_parameters is not None:
+        transform_to_earth(chunk.vel, **transform_parameters)
+
+    profiles = _get_profiles(chunk, sonar, original_coordsystem)
+
+    if layout is not None:
+        profiles = {
+            name: np.asarray(profiles[name], dtype=dtype) if name in profiles
+            else np.full((depth_count, sum(counts)), np.nan if dtype.kind == "f" else 0, dtype=dtype)
+            for name, (depth_count, dtype) in layout.items()
+        }
+    return profiles
+
+
+def _split_files_read_index(
+    files_read_index: tp.Dict[str, np.ndarray], chunk_size: int
+) -> tp.List[tp.List[tp.Tuple[str, np.ndarray]]]:
+    """Split the index entries of the files in chunks of `chunk_size` ensembles.
+
+    A chunk is a list of (filename, index entries) segments and can span over files.
+    """
+    chunks, segments, segments_count = [], [], 0
+    for filename, index in files_read_index.items():
+        position = 0
+        while position < len(index):
+            segment = index[position: position + chunk_size - segments_count]
+            segments.append((filename, segment))
+            position += len(segment)
+            segments_count += len(segment)
+            if segments_count == chunk_size:
+                chunks.append(segments)
+                segments, segments_count = [], 0
+    if segments:
+        chunks.append(segments)
+    return chunks
+
+
+def _read_pd0_segments(segments: tp.List[tp.Tuple[str, np.ndarray]], yearbase: int) -> tp.List[Bunch]:
+    """Decode the ensembles of the PD0 files segments (filename, index entries)."""
+    return [read_pd0_file(filename, index, yearbase) for filename, index in segments]
+
+
+def _chunk_dataset(dataset: xr.Dataset, chunk_size: int):
+    """Chunk (in place) the [depth, time] variables along time. The time series are not chunked."""
+    for var in dataset.data_vars:
+        if dataset[var].dims == ("depth", "time"):
+            dataset[var] = dataset[var].chunk({"depth": -1, "time": chunk_size})
+
+
+def _check_multiread_count(
+    data: Bunch, files_index: tp.Dict[str, np.ndarray], leading_index: int = None, trailing_index: int = None
+):
+    """Warn if Multiread did not read the number of ensembles expected from the ensembles index.
+
+    The time window trims are counted in ensembles of the index (checksum-validated ensembles),
+    but Multiread counts the ensembles with its own validation rules. If an ensemble is accepted
+    by one and rejected by the other, the trims applied by Multiread are shifted.
+    """
+    expected_count = sum(len(index) for index in files_index.values()) - (leading_index or 0) - (trailing_index or 0)
+    if len(data.dday) != expected_count:
+        l.warning(
+            f"pycurrents read {len(data.dday)} ensembles but {expected_count} were expected from the ensembles index. "
+            f"The time window may be shifted by {abs(len(data.dday) - expected_count)} ensembles. "
+            f"Use `pd0_reader = magtogoek` to apply the time window exactly."
+        )
+
+
+def _get_pd0_time_window_trims(
+    files_index: tp.Dict[str, np.ndarray],
+    yearbase: int,
+    start_time: pd.Timestamp = None,
+    end_time: pd.Timestamp = None,
+) -> tp.Tuple[int, int]:
+    """Return the number of leading and trailing ensembles outside [start_time, end_time].
+
+    The ensembles times are binary searched with the ensembles index of each file, only
+    the Variable Leaders of the ensembles probed are read. See magtogoek.adcp.pd0_index.
+    """
+    filenames = [filename for filename, index in files_index.items() if len(index) > 0]
+    files_index = [files_index[filename] for filename in filenames]
+    if len(files_index) == 0:
+        return 0, 0
+
+    def get_time(file_number: int, ens_number: int) -> np.datetime64:
+        return read_pd0_time(filenames[file_number], files_index[file_number][ens_number], yearbase)
+
+    return get_time_window_trims([len(index) for index in files_index], get_time, start_time, end_time)
+
+
+def get_last_ensemble_time(
+    filenames: tp.Union[str, tp.List[str]], sonar: str, yearbase: int, save_index: bool = True
+) -> np.datetime64:
+    """Return the time of the last ensemble of the files without decoding them.
+
+    Only the ensembles index of the last non-empty file is read (see magtogoek.adcp.rti_index
+    and magtogoek.adcp.pd0_index). Returns NaT if the files have no ensemble.
+    """
+    filenames = get_files_from_expression(filenames)
+    for filename in reversed(filenames):
+        if sonar in RTI_SONAR:
+            index = load_ens_index(filename, save=save_index)
+            index = index[index["checksum_ok"]]
+            if len(index) > 0:
+                return read_ens_time(filename, index[-1])
+        elif sonar in RDI_SONAR:
+            index = load_pd0_index(filename, save=save_index)
+            if len(index) > 0:
+                return read_pd0_time(filename, index[-1], yearbase)
+        else:
+            raise InvalidSonarError(f"{sonar} is not a valid. Valid sonar: `os`, `wh`, `sv`, `sw`, `sw_pd0` ")
+    return np.datetime64("NaT")
+
+
+def coordsystem2earth(data: Bunch, orientation: str) -> dict:
     """Transforms beam and xyz coordinates to enu coordinates
 
     NOTE: not properly tested. But it should work.
 
     Replace the values of data.vel, data.bt_vel with East, North and Up velocities
-    and the velocity error for 4 beams ADCP. UHDAS transform functions are used to
-    transform for beam coordinates and xyz to east-north-up (enu). These function
-    can use a three-beam solution by faking a fourth beam.
+    and the velocity error for 4 beams ADCP. The beam to xyz and xyz to east-north-up (enu)
+    transformations are fused into per-ensemble matrices and applied in place, by chunks
+    of ensembles, with `magtogoek.adcp.transform.transform_to_earth`. A three-beam solution
+    is used for the cells with a single bad beam.
 
     Also change the values of of `coordinates` in data.trans.
 
@@ -526,6 +886,13 @@ def coordsystem2earth(data: Bunch, orientation: str):
 
     orientation:
         adcp orientation. Either `up` or `down`.
+
+    Returns
+    -------
+    transform_parameters :
+        Parameters of `transform_to_earth` used for the velocities (attitude, beam angle, etc.)
+        so that other velocities of the same ensembles can be transformed the same way.
+
     Notes
     -----
     Move the prints outside
@@ -536,64 +903,60 @@ def coordsystem2earth(data: Bunch, orientation: str):
             f"Coordsystem value of {data.sysconfig.coordsystem} not recognized. Conversion to enu not available."
         )
 
-    beam_pattern = "convex" if data.sysconfig["convex"] else "concave"
-
-    xyze, bt_xyze = data.vel, data.bt_vel
-
+    beam_angle = None
     if data.trans.coordsystem == "beam":
         if data.sysconfig.angle:
-            trans = transform.Transform(
-                angle=data.sysconfig.angle, geometry=beam_pattern
-            )
-            xyze = trans.beam_to_xyz(data.vel)
-            bt_xyze = trans.beam_to_xyz(data.bt_vel)
+            beam_angle = data.sysconfig.angle
         else:
             l.log("Beam angle missing. Could not convert from beam coordinate.")
 
+    attitude = dict(heading=data.heading, pitch=data.pitch, roll=data.roll)
     if (data.heading == 0).all() or (data.roll == 0).all() or (data.pitch == 0).all():
         data.trans["coordsystem"] = "xyz"
-
-        for i in range(4):
-            data.vel[:, :, i] = np.round(xyze[:, :, i], decimals=3)
-            data.bt_vel[:, i] = np.round(bt_xyze[:, i], decimals=3)
+        attitude = dict(heading=None, pitch=None, roll=None)
     else:
-        enu = transform.rdi_xyz_enu(
-            xyze, data.heading, data.pitch, data.roll, orientation=orientation,
-        )
-        bt_enu = transform.rdi_xyz_enu(
-            bt_xyze, data.heading, data.pitch, data.roll, orientation=orientation,
-        )
         data.trans["coordsystem"] = "earth"
 
-        for i in range(4):
-            data.vel[:, :, i] = np.round(enu[:, :, i], decimals=3)
-            data.bt_vel[:, i] = np.round(bt_enu[:, i], decimals=3)
+    transform_parameters = dict(
+        **attitude,
+        beam_angle=beam_angle,
+        convex=bool(data.sysconfig["convex"]),
+        orientation=orientation,
+        fill_value=VEL_FILL_VALUE,
+    )
+    for vel in ["vel", "bt_vel"]:
+        if vel in data:
+            transform_to_earth(data[vel], **transform_parameters)
+
+    return transform_parameters
 
 
 def check_pd0_fixed_leader(
     filenames: tp.Union[str, tp.List[str]],
-    sonar: str,
-    yearbase: int,
     leading_index: int = None,
     trailing_index: int = None,
+    files_index: tp.Dict[str, np.ndarray] = None,
+    save_index: bool = True,
 ) -> tp.Tuple[bool, int]:
-    """Read Teledyne RDI binary FixedLeader.
+    """Read Teledyne RDI binary FixedLeader SysCfg.
     Returns the most common orientation and flag for an invalid config.
 
     Invalid config -> msb=`11111111` and lsb=`11111111`
-    Using: rawfile().read() to get the FixedLeader for all  pings.
+    Using: pd0_index.read_pd0_sys_cfg() to read the SysCfg of all pings at
+    the ensembles index entries. Multiple files are read in parallel. The
+    SysCfg of the ensembles without a FixedLeader are masked and not counted.
 
     Parameters
     ----------
     filenames :
         File(s) to read.
-    sonar :
-        sonar type passed to pycurrents.Multiread.
-        ('nb', 'bb', 'wh', 'sv', or 'os')
-    yearbase :
-        start year of the sampling.
     leading_index :
     trailing_index :
+    files_index :
+        Ensembles index of each file (see pd0_index.load_pd0_index). The index
+        of the files not in `files_index` are loaded.
+    save_index :
+        Write the sidecar index files of the loaded index.
 
     Returns
     -------
@@ -609,30 +972,25 @@ def check_pd0_fixed_leader(
     of change in the fixed_leader of some ping. A check up of some
     the fixed_leader parameters is done in the  processing.
     """
-    # uses rawfile() to get the FixedLeader.
-    if isinstance(filenames, list):
-        fixed_leader = np.concatenate(
-            [
-                rawfile(fname=fname, sonar=sonar, yearbase=yearbase)
-                .read(varlist=["FixedLeader"])
-                .raw.FixedLeader
-                for fname in filenames
-            ]
-        )
+    filenames = ensure_list_format(filenames)
+    files_index = files_index or {}
+    arguments = [(filename, files_index.get(filename), save_index) for filename in filenames]
+    if len(filenames) > 1:
+        with Pool(min(len(filenames), cpu_count())) as pool:
+            sys_cfg = np.ma.concatenate(pool.starmap(read_pd0_sys_cfg, arguments))
     else:
-        fixed_leader = (
-            rawfile(fname=filenames, sonar=sonar, yearbase=yearbase)
-            .read(varlist=["FixedLeader"])
-            .raw.FixedLeader
-        )
+        sys_cfg = read_pd0_sys_cfg(*arguments[0])
+
     bad_config_value = 2 ** 16 - 1
     _up = int('10000000', 2)
 
-    orientations = fixed_leader["SysCfg"][leading_index:trailing_index] & _up
+    sys_cfg = sys_cfg[leading_index:trailing_index].compressed()
+
+    orientations = sys_cfg & _up
     upward_looking = np.mean(orientations) > 63
 
     invalid_config_count = np.sum(
-        (fixed_leader["SysCfg"][leading_index:trailing_index] == bad_config_value)
+        (sys_cfg == bad_config_value)
     )
 
     return upward_looking, invalid_config_count
@@ -656,7 +1014,7 @@ def _print_filenames(file_type: str, filenames: tp.List) -> str:
 
 def _get_time(
     dday: np.ndarray, yearbase: int, start_time: str = None, time_step: float = None
-) -> tp.Union[np.ndarray, np.ndarray, bool]:
+) -> tp.Tuple[np.ndarray, bool]:
     """
     Parameters
     ----------
@@ -681,24 +1039,24 @@ def _get_time(
             )
         if bad_dday is True:
             l.log('`dday` values were added to the dataset.')
-            start_time = str(dday_to_datetime64(dday[0], yearbase)[1])
+            start_time = str(dday_to_datetime64(dday[0], yearbase))
             time_step = _get_time_step(dday)
-            time, time_string = _make_time(start_time, len(dday), time_step)
+            time = _make_time(start_time, len(dday), time_step)
         else:
-            time, time_string = dday_to_datetime64(dday, yearbase)
+            time = dday_to_datetime64(dday, yearbase)
     else:
         if time_step is None:
             time_step = _get_time_step(dday)
         else:
             time_step = pd.Timedelta(time_step,'seconds')
-        time, time_string = _make_time(start_time, len(dday), time_step)
+        time = _make_time(start_time, len(dday), time_step)
 
-    return time, time_string, bad_dday
+    return time, bad_dday
 
 
 def _make_time(
     start_time: str, length: int, time_step: pd.Timedelta
-) -> tp.Union[np.ndarray, np.ndarray]:
+) -> pd.DatetimeIndex:
     """
     Parameters
     ----------
@@ -713,7 +1071,7 @@ def _make_time(
         f"Time vector was replace with a time series starting at {start_time} with {time_step.seconds} seconds time step."
     )
     time = pd.date_range(pd.Timestamp(start_time), periods=length, freq=time_step)
-    return time, time.astype(str)
+    return time
 
 
 def _get_time_step(dday: np.ndarray) -> pd.Timedelta:
@@ -0,0 +1,217 @@
+"""
+Byte-offset ensemble index for RDI PD0 files.
+
+The PD0 files are scanned once with `mmap` to find the ensembles headers (0x7F7F). For each
+ensemble with a valid checksum, the byte offset and the ensemble length (checksum included)
+are stored in a numpy structured array. Only the ensembles headers and the checksums are
+read, the data types are not decoded. The scan jumps from one valid ensemble to the next
+with the ensembles byte counts and only looks for a header ID after an invalid ensemble.
+
+The same index (and thus the same ensembles) is used to read the SysCfg words, to
+binary search the ensembles times and by the PD0 reader. The index can be saved as a
+sidecar file (`path/to/file.000.idx`) next to the PD0 file so that later reads do not
+need to scan the file again.
+
+Usage:
+index = load_pd0_index(filename)
+time = read_pd0_time(filename, index[0], yearbase=2021)
+sys_cfg = read_pd0_sys_cfg(filename, index)
+
+Notes
+-----
+The PD0 ensemble structure is:
+    Header: 0x7F7F, ensemble length (uint16, checksum excluded), spare byte,
+            number of data types (uint8) and the data types offsets (uint16).
+    Data types: Fixed Leader (ID 0x0000), Variable Leader (ID 0x0080), Velocity, etc.
+    Checksum: sum of the ensemble bytes modulo 65536 (uint16).
+
+The sidecar file is only used if the size and the modification time of the PD0 file
+did not change since the index was made. Otherwise, the file is scanned again and the
+sidecar is overwritten.
+"""
+import mmap
+import struct
+from pathlib import Path
+
+import numpy as np
+
+HEADER_ID = b"\x7f\x7f"
+HEADER_SIZE = 6  # Header ID, ensemble length, spare byte, number of data types.
+CHECKSUM_SIZE = 2
+MAX_DATA_TYPES = 32
+FIXED_LEADER_ID = 0x0000
+VARIABLE_LEADER_ID = 0x0080
+SYS_CFG_OFFSET = 4  # Fixed Leader ID, CPU firmware version and revision.
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+PD0_INDEX_DTYPE = np.dtype([("offset", "i8"), ("length", "i8")])
+
+
+def build_pd0_index(filename: str) -> np.ndarray:
+    """Scan a PD0 file in a single pass and return its ensemble index.
+
+    Header IDs (0x7F7F) found in the data are only kept if the ensemble
+    checksum is valid. The scan then resumes after the ensemble.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.000
+
+    Returns
+    -------
+    index :
+        Structured array with fields `offset`, `length`.
+    """
+    entries = []
+    file_size = Path(filename).stat().st_size
+    if file_size == 0:
+        return np.array(entries, dtype=PD0_INDEX_DTYPE)
+
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = mm.find(HEADER_ID)
+        while offset != -1:
+            length = _check_ensemble(mm, offset, file_size)
+            if length:
+                entries.append((offset, length))
+                offset = mm.find(HEADER_ID, offset + length)
+            else:
+                offset = mm.find(HEADER_ID, offset + 1)
+
+    return np.array(entries, dtype=PD0_INDEX_DTYPE)
+
+
+def _check_ensemble(mm: mmap.mmap, offset: int, file_size: int) -> int:
+    """Return the length (checksum included) of the ensemble at `offset` or 0 if it is invalid."""
+    if offset + HEADER_SIZE > file_size:
+        return 0
+    ens_length, _, data_types_count = struct.unpack_from("<HBB", mm, offset + 2)
+    if not (0 < data_types_count <= MAX_DATA_TYPES) or ens_length < HEADER_SIZE + 2 * data_types_count:
+        return 0
+    if offset + ens_length + CHECKSUM_SIZE > file_size:
+        return 0
+
+    checksum = struct.unpack_from("<H", mm, offset + ens_length)[0]
+    ens_sum = int(np.frombuffer(mm, dtype=np.uint8, count=ens_length, offset=offset).sum(dtype=np.uint64))
+    if checksum != ens_sum % 65536:
+        return 0
+    return ens_length + CHECKSUM_SIZE
+
+
+def load_pd0_index(filename: str, save: bool = True) -> np.ndarray:
+    """Return the ensemble index of `filename`.
+
+    The sidecar index file is used if it is up to date. Otherwise, the PD0 file
+    is scanned and, if `save` is True, the sidecar file is (re)written.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.000
+    save :
+        Write the sidecar index file next to the PD0 file.
+    """
+    signature = _file_signature(filename)
+    index_path = get_index_path(filename)
+
+    if index_path.is_file():
+        try:
+            with np.load(index_path) as sidecar:
+                if np.array_equal(sidecar["signature"], signature):
+                    return sidecar["index"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_pd0_index(filename)
+
+    if save is True:
+        try:
+            with open(index_path, "wb") as f:
+                np.savez(f, index=index, signature=signature)
+        except OSError:
+            pass
+
+    return index
+
+
+def get_index_path(filename: str) -> Path:
+    """Return the path of the sidecar index file: path/to/file.000.idx"""
+    return Path(str(filename) + INDEX_SUFFIX)
+
+
+def _file_signature(filename: str) -> np.ndarray:
+    """File size, modification time (ns) and index version."""
+    stat = Path(filename).stat()
+    return np.array([stat.st_size, stat.st_mtime_ns, INDEX_VERSION], dtype="i8")
+
+
+def read_pd0_chunk(filename: str, entry: np.void) -> bytes:
+    """Read the bytes of the ensemble pointed by an index entry."""
+    with open(filename, "rb") as f:
+        f.seek(int(entry["offset"]))
+        return f.read(int(entry["length"]))
+
+
+def get_data_type_offsets(chunk: bytes) -> dict:
+    """Return the offsets of the data types of an ensemble: {data_type_id: offset}"""
+    data_types_count = chunk[5]
+    offsets = struct.unpack_from(f"<{data_types_count}H", chunk, HEADER_SIZE)
+    return {struct.unpack_from("<H", chunk, offset)[0]: offset for offset in offsets}
+
+
+def read_pd0_time(filename: str, entry: np.void, yearbase: int) -> np.datetime64:
+    """Read the date and time of the ensemble pointed by an index entry.
+
+    The time is read from the Variable Leader real time clock (RTC). The 2-digits year
+    of the RTC is completed with the century of `yearbase`. Returns NaT if the Variable
+    Leader is not found.
+    """
+    chunk = read_pd0_chunk(filename, entry)
+    offset = get_data_type_offsets(chunk).get(VARIABLE_LEADER_ID)
+    if offset is None:
+        return np.datetime64("NaT")
+    year, month, day, hour, minute, second, hsec = struct.unpack_from("<7B", chunk, offset + 4)
+    year += yearbase // 100 * 100
+    time = np.datetime64(f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}")
+    return time + np.timedelta64(hsec * 10, "ms")
+
+
+def read_pd0_sys_cfg(filename: str, index: np.ndarray = None, save: bool = True) -> np.ma.MaskedArray:
+    """Read the Fixed Leader SysCfg of the ensembles of a PD0 file.
+
+    Only the SysCfg words of the ensembles of the index are read, the data types are not
+    decoded. The SysCfg of the ensembles without a Fixed Leader are masked so that the
+    returned array stays aligned with the index (and the reader) ensembles.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.000
+    index :
+        Ensemble index of the file (see `load_pd0_index`). It is loaded if None.
+    save :
+        Write the sidecar index file if the index is loaded.
+
+    Returns
+    -------
+    sys_cfg :
+        uint16 masked array of the SysCfg words, one per index entry.
+    """
+    if index is None:
+        index = load_pd0_index(filename, save=save)
+    sys_cfg = np.zeros(len(index), dtype=np.uint16)
+    missing = np.ones(len(index), dtype=bool)
+    if len(index) == 0:
+        return np.ma.masked_array(sys_cfg, mask=missing)
+
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i, (offset, length) in enumerate(zip(index["offset"].tolist(), index["length"].tolist())):
+            first_data_type = struct.unpack_from("<H", mm, offset + HEADER_SIZE)[0]
+            if first_data_type + SYS_CFG_OFFSET + 2 <= length and \
+                    struct.unpack_from("<H", mm, offset + first_data_type)[0] == FIXED_LEADER_ID:
+                sys_cfg[i] = struct.unpack_from("<H", mm, offset + first_data_type + SYS_CFG_OFFSET)[0]
+                missing[i] = False
+
+    return np.ma.masked_array(sys_cfg, mask=missing)
@@ -0,0 +1,498 @@
+"""
+Native NumPy reader for Teledyne RDI PD0 files. Alternative to pycurrents Multiread.
+
+The data are loaded in the same `Bunch` layout as pycurrents Multiread so that the same
+loader is used for both readers.
+
+Usage:
+data = Pd0Reader(filenames, sonar="wh", yearbase=2021).read()
+filenames: path/to/filename or list(path/to/filenames) or path/to/regex.
+
+The ensembles positions are found with a single pass scan, or read from the sidecar index
+files (see magtogoek.adcp.pd0_index).
+The files are memory mapped and the data types blocks are gathered for all the ensembles
+at once with numpy indexing over the mapped bytes (`np.frombuffer`), `batch_size` ensembles
+at a time. Ensembles with the same data types offsets are decoded together, thus the
+ensembles are not decoded one by one. Multiple files are decoded in parallel.
+
+`Pd0Reader.iter_batches` yields the decoded ensembles by batches so that the memory usage
+is bounded by the batch size:
+for batch in Pd0Reader(filenames, sonar="wh", yearbase=2021).iter_batches(batch_size=1000):
+    ...
+
+Decoded data types:
+    Fixed Leader (0x0000), Variable Leader (0x0080), Velocity (0x0100), Correlation (0x0200),
+    Echo Intensity (0x0300), Percent Good (0x0400), Bottom Track (0x0600) and the Sentinel V
+    vertical beam Velocity (0x0A00), Correlation (0x0B00), Amplitude (0x0C00) and
+    Percent Good (0x0D00).
+
+Notes
+-----
+The Ocean Surveyor navigation data and narrowband pings are not decoded, use pycurrents
+Multiread for those. The velocities are in m/s with -32768 for bad values (like Multiread).
+"""
+import mmap
+import typing as tp
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+
+import numpy as np
+from numpy.lib import recfunctions
+
+from magtogoek.adcp.pd0_index import (CHECKSUM_SIZE, FIXED_LEADER_ID, HEADER_SIZE, VARIABLE_LEADER_ID,
+                                      get_data_type_offsets, load_pd0_index)
+from magtogoek.adcp.rti_reader import BinDepMismatch, Bunch
+from magtogoek.adcp.tools import datetime_to_dday
+from magtogoek.utils import Logger, get_files_from_expression
+
+BATCH_SIZE = 10000  # Default number of ensembles decoded at once.
+
+VEL_FILL_VALUE = -32768
+NBEAMS_BT = 4
+
+FIXED_LEADER_FIELDS = [  # (name, format, offset)
+    ("FWV", "u1", 2), ("FWR", "u1", 3), ("SysCfg", "<u2", 4), ("RealSim", "u1", 6), ("LagLength", "u1", 7),
+    ("NBeams", "u1", 8), ("NCells", "u1", 9), ("NPings", "<u2", 10), ("CellSize", "<u2", 12),
+    ("Blank", "<u2", 14), ("WM", "u1", 16), ("LowCorrThresh", "u1", 17), ("NCodeReps", "u1", 18),
+    ("PGMin", "u1", 19), ("EVMax", "<u2", 20), ("TPP_min", "u1", 22), ("TPP_sec", "u1", 23),
+    ("TPP_hun", "u1", 24), ("CoordXform", "u1", 25), ("EA", "<i2", 26), ("EV", "<i2", 28), ("EZ", "u1", 30),
+    ("SA", "u1", 31), ("Bin1Dist", "<u2", 32), ("Pulse", "<u2", 34), ("RL0", "u1", 36), ("RL1", "u1", 37),
+    ("WA", "u1", 38), ("TransLag", "<u2", 40), ("CPUSN", "u1", 42, (8,)), ("WB", "<u2", 50), ("CQ", "u1", 52),
+    ("SN", "<u4", 54), ("BeamAngle", "u1", 58),
+]
+
+VARIABLE_LEADER_FIELDS = [  # (name, format, offset)
+    ("EnsNum", "<u2", 2), ("Year", "u1", 4), ("Month", "u1", 5), ("Day", "u1", 6), ("Hour", "u1", 7),
+    ("Minute", "u1", 8), ("Second", "u1", 9), ("Hundredths", "u1", 10), ("EnsNumMSB", "u1", 11),
+    ("BIT", "<u2", 12), ("SoundSpeed", "<u2", 14), ("XducerDepth", "<u2", 16), ("Heading", "<u2", 18),
+    ("Pitch", "<i2", 20), ("Roll", "<i2", 22), ("Salinity", "<u2", 24), ("Temperature", "<i2", 26),
+    ("MPT_min", "u1", 28), ("MPT_sec", "u1", 29), ("MPT_hun", "u1", 30), ("Hdg_SD", "u1", 31),
+    ("Pitch_SD", "u1", 32), ("Roll_SD", "u1", 33), ("ADC", "u1", 34, (8,)), ("ESW", "<u4", 42),
+    ("Pressure", "<u4", 48), ("PressVar", "<u4", 52), ("RTC_Century", "u1", 57), ("RTC_Year", "u1", 58),
+    ("RTC_Month", "u1", 59), ("RTC_Day", "u1", 60), ("RTC_Hour", "u1", 61), ("RTC_Minute", "u1", 62),
+    ("RTC_Second", "u1", 63), ("RTC_Hundredths", "u1", 64),
+]
+
+FREQUENCIES = {0b000: 75, 0b001: 150, 0b010: 300, 0b011: 600, 0b100: 1200, 0b101: 2400, 0b110: 38}  # kHz
+BEAM_ANGLES = {0b00: 15, 0b01: 20, 0b10: 30}
+COORDSYSTEMS = {0b00: "beam", 0b01: "xyz", 0b10: "ship", 0b11: "earth"}
+
+BEAM_VARIABLES = ("vel", "cor", "amp", "pg")
+# Velocity, Correlation, Echo Intensity, Percent Good and the Sentinel V vertical beam data types.
+PROFILE_DATA_TYPES = (0x0100, 0x0200, 0x0300, 0x0400, 0x0A00, 0x0B00, 0x0C00, 0x0D00)
+
+l = Logger(level=0)
+
+
+class FilesFormatError(Exception):
+    pass
+
+
+class Pd0Reader:
+    """Class to read RDI PD0 files (.000, .ENX, .LTA, .STA, etc).
+
+    Parameters
+    ----------
+    filenames
+        path/to/filename or list(path/to/filenames) or path/to/regex
+    sonar
+        Type of sonar (`os`, `wh`, `sv`).
+    yearbase
+        Year that the sampling begun. Used to complete the 2-digits years and to compute `dday`.
+    files_index
+        Ensemble index of each file (see magtogoek.adcp.pd0_index.load_pd0_index). The index
+        of the files not in `files_index` are loaded.
+    save_index
+        Write the sidecar index files of the loaded index next to the PD0 files.
+
+    Attributes
+    ----------
+    files_read_index
+        Index entries of the ensembles read from each file by the last `read` call.
+
+    Methods
+    -------
+    read(start_index, stop_index, batch_size, profiles) :
+        Return a Bunch object with the read data of all the files.
+
+    iter_batches(batch_size, start_index, stop_index) :
+        Yield Bunch objects of at most `batch_size` decoded ensembles.
+    """
+
+    def __init__(
+            self,
+            filenames: tp.Union[str, tp.List[str]],
+            sonar: str,
+            yearbase: int,
+            files_index: tp.Dict[str, np.ndarray] = None,
+            save_index: bool = True,
+    ):
+        self.filenames = get_files_from_expression(filenames)
+        self.sonar = sonar
+        self.yearbase = yearbase
+        self.files_index = files_index or {}
+        self.save_index = save_index
+        self.files_read_index = None
+
+    def read(
+            self, start_index: int = None, stop_index: int = None, batch_size: int = BATCH_SIZE, profiles: bool = True
+    ) -> Bunch:
+        """Return a Bunch object with the read data.
+
+        An empty Bunch is returned if there is no ensemble left to read.
+
+        Parameters
+        -----------
+        start_index :
+           Trim leading ensembles by start_index.
+
+        stop_index :
+           Trim trailing ensembles by stop_index.
+
+        batch_size :
+           Number of ensembles decoded at once.
+
+        profiles :
+           If False, the profile data types (velocities, correlations, echo intensities and
+           percent good) are not decoded. Only the time series and the file level values are read.
+        """
+        files_index = self.get_files_read_index(start_index, stop_index)
+        self.files_read_index = files_index
+        if len(files_index) == 0:
+            return Bunch()
+
+        arguments = [
+            (filename, index, self.yearbase, batch_size, profiles) for filename, index in files_index.items()
+        ]
+        if len(arguments) > 1:
+            with Pool(min(len(arguments), cpu_count())) as pool:
+                bunches = pool.starmap(read_pd0_file, arguments)
+        else:
+            bunches = [read_pd0_file(*arguments[0])]
+
+        data = concatenate_files_bunch(bunches)
+        data.sonar = self.sonar
+        data.yearbase = self.yearbase
+        for var in BEAM_VARIABLES:
+            if var in data:
+                data.split(var)
+
+        return data
+
+    def iter_batches(
+            self, batch_size: int = BATCH_SIZE, start_index: int = None, stop_index: int = None
+    ) -> tp.Iterator[Bunch]:
+        """Yield the decoded ensembles by batches of at most `batch_size` ensembles.
+
+        A batch never spans over two files. The beam data are not split (e.g. vel -> vel1,...,vel4).
+        The name of the file the ensembles are from is added to the batches (`filename`).
+        """
+        for filename, index in self.get_files_read_index(start_index, stop_index).items():
+            for position in range(0, len(index), batch_size):
+                yield read_pd0_file(filename, index[position: position + batch_size], self.yearbase, batch_size)
+
+    def get_files_read_index(self, start_index: int = None, stop_index: int = None) -> tp.Dict[str, np.ndarray]:
+        """Return the index entries of the ensembles to read for each file.
+
+        The trims are applied to the ensembles of all the files. Files without ensemble
+        to read are dropped.
+        """
+        files_index = {
+            filename: (
+                self.files_index[filename] if filename in self.files_index
+                else load_pd0_index(filename, save=self.save_index)
+            )
+            for filename in self.filenames
+        }
+        total_count = sum(len(index) for index in files_index.values())
+        start, stop = start_index or 0, total_count - (stop_index or 0)
+
+        files_read_index, position = {}, 0
+        for filename, index in files_index.items():
+            read_index = index[max(start - position, 0): max(stop - position, 0)]
+            position += len(index)
+            if len(read_index) > 0:
+                files_read_index[filename] = read_index
+            else:
+                l.warning(f"No ensemble read from {Path(filename).name}.")
+        return files_read_index
+
+
+def read_pd0_file(
+        filename: str, index: np.ndarray, yearbase: int, batch_size: int = BATCH_SIZE, profiles: bool = True
+) -> Bunch:
+    """Decode the ensembles of a PD0 file pointed by the index entries.
+
+    The file level values (FL, sysconfig, trans, bin depths, etc.) are taken from the first
+    ensemble. Data types missing from an ensemble are left to their fill value.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file
+    index :
+        Index entries (see magtogoek.adcp.pd0_index.load_pd0_index) of the ensembles to read.
+    yearbase :
+        Year that the sampling begun.
+    batch_size :
+        Number of ensembles decoded at once.
+    profiles :
+        If False, the profile data types (PROFILE_DATA_TYPES) are not decoded.
+    """
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            ppd = _decode_file_header(buf, index[0])
+            specs = _data_type_specs(ppd.NCells, ppd.NBeams, ppd.VL_dtype)
+            if profiles is False:
+                specs = {data_type: spec for data_type, spec in specs.items() if data_type not in PROFILE_DATA_TYPES}
+            layouts, inverse = _get_layouts(buf, index)
+
+            data_types = {data_type for layout in layouts for data_type in layout}
+            for data_type in data_types.intersection(specs):
+                for name, dtype, shape, _ in specs[data_type]:
+                    ppd[name] = np.zeros((len(index),) + shape, dtype=dtype)
+                    if dtype == np.dtype("<i2"):  # velocities
+                        ppd[name][:] = VEL_FILL_VALUE
+
+            offsets = index["offset"].astype(np.int64)
+            for group, layout in enumerate(layouts):
+                members = np.flatnonzero(inverse == group)
+                for position in range(0, len(members), batch_size):
+                    batch = members[position: position + batch_size]
+                    _decode_ensembles(ppd, buf, offsets[batch], batch, layout, specs)
+        finally:
+            del buf
+
+    del ppd.VL_dtype
+    ppd.filename = Path(filename).name
+    _compute_values(ppd, yearbase)
+
+    return ppd
+
+
+def _decode_file_header(buf: np.ndarray, entry: np.void) -> Bunch:
+    """Decode the Fixed Leader of the ensemble and compute the file level values."""
+    chunk = buf[int(entry["offset"]): int(entry["offset"] + entry["length"])].tobytes()
+    capacities = _get_capacities(get_data_type_offsets(chunk), len(chunk) - CHECKSUM_SIZE)
+    if FIXED_LEADER_ID not in capacities:
+        raise FilesFormatError("Fixed Leader not found in the first ensemble.")
+    if VARIABLE_LEADER_ID not in capacities:
+        raise FilesFormatError("Variable Leader not found in the first ensemble.")
+
+    fl_offset, fl_capacity = capacities[FIXED_LEADER_ID]
+    fl = np.frombuffer(chunk, dtype=_fields_dtype(FIXED_LEADER_FIELDS, fl_capacity), count=1, offset=fl_offset)[0]
+
+    ppd = Bunch()
+    ppd.FL = {name: fl[name].tolist() for name in fl.dtype.names}
+    ppd.VL_dtype = _fields_dtype(VARIABLE_LEADER_FIELDS, capacities[VARIABLE_LEADER_ID][1])
+
+    ppd.NBeams = ppd.FL["NBeams"]
+    ppd.NCells = ppd.FL["NCells"]
+    ppd.NPings = ppd.FL["NPings"]
+    ppd.CellSize = ppd.FL["CellSize"] / 100  # cm to m
+    ppd.Blank = ppd.FL["Blank"] / 100  # cm to m
+    ppd.Bin1Dist = ppd.FL["Bin1Dist"] / 100  # cm to m
+    ppd.dep = ppd.Bin1Dist + np.arange(ppd.NCells) * ppd.CellSize
+    ppd.pingtype = "bb"
+
+    sys_cfg = ppd.FL["SysCfg"]
+    angle = BEAM_ANGLES.get(sys_cfg >> 8 & 0b11, ppd.FL.get("BeamAngle"))
+    ppd.sysconfig = Bunch(
+        kHz=FREQUENCIES.get(sys_cfg & 0b111),
+        convex=bool(sys_cfg & 0b1000),
+        sensorconfig=(sys_cfg >> 4 & 0b11) + 1,
+        headattached=bool(sys_cfg & 0b1000000),
+        up=bool(sys_cfg & 0b10000000),
+        angle=angle,
+    )
+
+    coord_xform = ppd.FL["CoordXform"]
+    ppd.trans = Bunch(
+        coordsystem=COORDSYSTEMS[coord_xform >> 3 & 0b11],
+        tilts=bool(coord_xform & 0b100),
+        threebeam=bool(coord_xform & 0b10),
+        binmap=bool(coord_xform & 0b1),
+    )
+    return ppd
+
+
+def _data_type_specs(
+        ncells: int, nbeams: int, vl_dtype: np.dtype
+) -> tp.Dict[int, tp.List[tp.Tuple[str, np.dtype, tuple, int]]]:
+    """Variables decoded from each data type: {data_type_id: [(name, dtype, shape, offset), ...]}"""
+    return {
+        VARIABLE_LEADER_ID: [("VL", vl_dtype, (), 0)],
+        0x0100: [("vel", np.dtype("<i2"), (ncells, nbeams), 2)],
+        0x0200: [("cor", np.dtype("u1"), (ncells, nbeams), 2)],
+        0x0300: [("amp", np.dtype("u1"), (ncells, nbeams), 2)],
+        0x0400: [("pg", np.dtype("u1"), (ncells, nbeams), 2)],
+        0x0600: [
+            ("bt_range", np.dtype("<u2"), (NBEAMS_BT,), 16),
+            ("bt_vel", np.dtype("<i2"), (NBEAMS_BT,), 24),
+            ("bt_cor", np.dtype("u1"), (NBEAMS_BT,), 32),
+            ("bt_amp", np.dtype("u1"), (NBEAMS_BT,), 36),
+            ("bt_pg", np.dtype("u1"), (NBEAMS_BT,), 40),
+            ("bt_range_msb", np.dtype("u1"), (NBEAMS_BT,), 77),
+        ],
+        0x0A00: [("vbvel", np.dtype("<i2"), (ncells,), 2)],
+        0x0B00: [("VBCorrelation", np.dtype("u1"), (ncells,), 2)],
+        0x0C00: [("VBIntensity", np.dtype("u1"), (ncells,), 2)],
+        0x0D00: [("VBPercentGood", np.dtype("u1"), (ncells,), 2)],
+    }
+
+
+def _get_layouts(buf: np.ndarray, index: np.ndarray) -> tp.Tuple[tp.List[tp.Dict[int, tp.Tuple[int, int]]], np.ndarray]:
+    """Group the ensembles by data types offsets.
+
+    Returns
+    -------
+    layouts :
+        For each group, {data_type_id: (offset, capacity)}. The capacity is the number of bytes
+        available to the data type (up to the next data type or the end of the ensemble).
+    inverse :
+        Group number of each ensemble.
+    """
+    offsets = index["offset"].astype(np.int64)
+    counts = buf[offsets + 5].astype(np.int64)
+    max_count = int(counts.max())
+    valid = np.arange(max_count) < counts[:, None]
+
+    positions = np.minimum(offsets[:, None] + HEADER_SIZE + np.arange(2 * max_count), buf.size - 1)
+    data_type_offsets = buf[positions].view("<u2").astype(np.int64)
+    data_type_offsets[~valid] = 0
+
+    positions = np.minimum(offsets[:, None] + data_type_offsets, buf.size - 2)
+    data_type_ids = buf[positions].astype(np.int64) | buf[positions + 1].astype(np.int64) << 8
+    data_type_ids[~valid] = -1
+
+    keys, inverse = np.unique(np.hstack([data_type_offsets, data_type_ids]), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    lengths = index["length"].astype(np.int64) - CHECKSUM_SIZE
+    layouts = []
+    for group, key in enumerate(keys):
+        data_types = {int(i): int(o) for o, i in zip(key[:max_count], key[max_count:]) if i != -1}
+        layouts.append(_get_capacities(data_types, int(lengths[inverse == group].min())))
+
+    return layouts, inverse
+
+
+def _get_capacities(data_types: tp.Dict[int, int], ens_length: int) -> tp.Dict[int, tp.Tuple[int, int]]:
+    """Return {data_type_id: (offset, capacity)} from {data_type_id: offset}."""
+    ordered = sorted(data_types.items(), key=lambda item: item[1])
+    ends = [offset for _, offset in ordered[1:]] + [ens_length]
+    return {data_type: (offset, end - offset) for (data_type, offset), end in zip(ordered, ends)}
+
+
+def _decode_ensembles(
+        ppd: Bunch,
+        buf: np.ndarray,
+        offsets: np.ndarray,
+        positions: np.ndarray,
+        layout: tp.Dict[int, tp.Tuple[int, int]],
+        specs: tp.Dict[int, tp.List[tp.Tuple[str, np.dtype, tuple, int]]],
+):
+    """Gather the data types of ensembles with the same layout and write them in the `ppd` arrays.
+
+    Variables not fitting in their data type capacity are skipped.
+    """
+    for data_type, (data_type_offset, capacity) in layout.items():
+        for name, dtype, shape, offset in specs.get(data_type, ()):
+            nbytes = dtype.itemsize * int(np.prod(shape))
+            if offset + nbytes > capacity:
+                continue
+            raw = buf[(offsets + data_type_offset + offset)[:, None] + np.arange(nbytes)]
+            ppd[name][positions] = raw.view(dtype).reshape((len(positions),) + shape)
+
+
+def _compute_values(ppd: Bunch, yearbase: int):
+    """Compute (in place) the physical values from the raw decoded values."""
+    vl = ppd.VL
+    ppd.dday = datetime_to_dday(_get_datetimes(vl, yearbase), yearbase)
+    ppd.XducerDepth = vl["XducerDepth"] / 10  # dm to m
+    ppd.heading = vl["Heading"] / 100
+    ppd.pitch = vl["Pitch"] / 100
+    ppd.roll = vl["Roll"] / 100
+    ppd.temperature = vl["Temperature"] / 100
+
+    for name in ("vel", "bt_vel", "vbvel"):
+        if name in ppd:
+            ppd[name] = _get_velocity(ppd[name])
+
+    if "bt_range" in ppd:
+        bt_range = ppd.pop("bt_range").astype(np.float64)
+        if "bt_range_msb" in ppd:
+            bt_range += ppd.pop("bt_range_msb").astype(np.int64) * 65536
+        bt_range[bt_range == 0] = np.nan
+        ppd.bt_depth = bt_range / 100  # cm to m
+
+
+def _get_datetimes(vl: np.ndarray, yearbase: int) -> np.ndarray:
+    """Datetimes of the Variable Leader real time clock. NaT for missing Variable Leaders.
+
+    The 2-digits year of the RTC is completed with the century of `yearbase`.
+    """
+    years = vl["Year"].astype(np.int64) + yearbase // 100 * 100
+    months = np.maximum(vl["Month"].astype(np.int64), 1)
+    days = np.maximum(vl["Day"].astype(np.int64), 1)
+    milliseconds = (
+            (vl["Hour"].astype(np.int64) * 60 + vl["Minute"]) * 60 + vl["Second"]
+    ) * 1000 + vl["Hundredths"].astype(np.int64) * 10
+
+    datetimes = (years - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (months - 1).astype("timedelta64[M]")
+    datetimes = datetimes.astype("datetime64[D]") + (days - 1).astype("timedelta64[D]")
+    datetimes = datetimes.astype("datetime64[ms]") + milliseconds.astype("timedelta64[ms]")
+    datetimes[vl["Month"] == 0] = np.datetime64("NaT")
+    return datetimes
+
+
+def _get_velocity(raw: np.ndarray) -> np.ndarray:
+    """mm/s to m/s. Bad values are set to -32768."""
+    velocity = raw / 1000
+    velocity[raw == VEL_FILL_VALUE] = VEL_FILL_VALUE
+    return velocity
+
+
+def _fields_dtype(fields: tp.List[tuple], capacity: int) -> np.dtype:
+    """Structured dtype of the fields fitting in `capacity` bytes."""
+    names, formats, offsets = [], [], []
+    for name, fmt, offset, *shape in fields:
+        dtype = np.dtype((fmt, shape[0])) if shape else np.dtype(fmt)
+        if offset + dtype.itemsize <= capacity:
+            names.append(name)
+            formats.append(dtype)
+            offsets.append(offset)
+    return np.dtype(dict(names=names, formats=formats, offsets=offsets, itemsize=capacity))
+
+
+def concatenate_files_bunch(bunches: tp.List[Bunch]) -> Bunch:
+    """Concatenate the files bunches.
+
+    Uses the first file bunch for the file level values (e.g. dep, FL, sysconfig, etc).
+    The Variable Leaders are reduced to the fields common to all the files.
+
+    Raises
+    ------
+    BinDepMismatch :
+        The number of bins changes through files. In that case, files need the be processed individually.
+    """
+    ncells = [b.NCells for b in bunches]
+    if np.diff(ncells).any():
+        raise BinDepMismatch("\n" + "\n".join([f"{b.filename} has {b.NCells} bin" for b in bunches]))
+
+    if len(bunches) == 1:
+        return bunches[0]
+
+    names = [name for name in bunches[0].VL.dtype.names if all(name in b.VL.dtype.names for b in bunches)]
+    for b in bunches:
+        b.VL = recfunctions.repack_fields(b.VL[names])
+
+    ppd = Bunch()
+    b0 = bunches[0]
+    for k in b0:
+        if k == "dep" or not isinstance(b0[k], np.ndarray):
+            ppd[k] = b0[k]
+        else:
+            ppd[k] = np.concatenate([b[k] for b in bunches])
+    return ppd
@@ -50,18 +50,26 @@ FIXME SOURCE : moored adcp ?
 import getpass
 import sys
 import typing as tp
+from copy import deepcopy
 
 import click
 import numpy as np
 import pandas as pd
 import xarray as xr
-from magtogoek.adcp.loader import load_adcp_binary
+from magtogoek.adcp.loader import get_last_ensemble_time, load_adcp_binary
 from magtogoek.adcp.odf_exporter import make_odf
+from magtogoek.adcp.tools import datetime64_to_string
 from magtogoek.adcp.quality_control import (adcp_quality_control,
                                             no_adcp_quality_control)
+from magtogoek.adcp.qc_sweep import threshold_sweep
 from magtogoek.tools import (
-    rotate_2d_vector, regrid_dataset, _prepare_flags_for_regrid, _new_flags_bin_regrid,
-    _new_flags_interp_regrid)
+    rotate_2d_vector, regrid_dataset, _prepare_flags_for_regrid, _new_flags_interp_regrid)
+from magtogoek.batch import Job
+from magtogoek.checkpoint import (CHECKPOINT_SUFFIX, DEFAULT_CHECKPOINT_DIRECTORY, checkpoint_key,
+                                  read_checkpoint, write_checkpoint)
+from magtogoek.manifest import is_up_to_date, write_manifest
+from magtogoek.netcdf_append import append_to_netcdf, get_coordinate, get_last_time
+from magtogoek.profiler import StageProfiler
 from magtogoek.attributes_formatter import (
     compute_global_attrs, format_variables_names_and_attributes, _add_data_min_max_to_var_attrs)
 from magtogoek.navigation import load_navigation
@@ -189,6 +197,30 @@ QC_ENCODING = {"dtype": "int8", "_FillValue": QC_FILL_VALUE}
 DATA_FILL_VALUE = -9999.0
 DATA_ENCODING = {"dtype": "float32", "_FillValue": DATA_FILL_VALUE}
 
+# ProcessConfig options used to load the data. Changing any of them invalidates the checkpoints.
+CHECKPOINT_OPTIONS = [
+    "sonar", "yearbase", "adcp_orientation", "leading_trim", "trailing_trim", "sensor_depth",
+    "depth_range", "bad_pressure", "start_time", "time_step", "magnetic_declination_preset",
+    "pd0_reader", "chunk_size", "float32", "keep_bt", "navigation_file",
+]
+# ProcessConfig thresholds of the tests swept by `sweep_adcp_thresholds`.
+SWEEP_TESTS_OPTIONS = {
+    "amp": "amplitude_threshold",
+    "corr": "correlation_threshold",
+    "pg": "percentgood_threshold",
+    "horizontal_vel": "horizontal_velocity_threshold",
+    "vertical_vel": "vertical_velocity_threshold",
+    "error": "error_velocity_threshold",
+    "roll": "roll_threshold",
+    "pitch": "pitch_threshold",
+}
+# ProcessConfig drop options of the data needed by the swept tests.
+SWEEP_TESTS_DROP_OPTIONS = {"amp": "drop_amplitude", "corr": "drop_correlation", "pg": "drop_percent_good"}
+# ProcessConfig options not changing the outputs.
+MANIFEST_IGNORED_OPTIONS = [
+    "made_by", "last_updated", "headless", "force", "checkpoint", "profile", "profile_report", "save_index",
+]
+
 
 class ProcessConfig:
     sensor_type: str = None
@@ -202,6 +234,11 @@ class ProcessConfig:
     yearbase: int = None
     adcp_orientation: str = None
     sonar: str = None
+    pd0_reader: str = None
+    chunk_size: int = None
+    float32: bool = None
+    save_index: bool = None
+    checkpoint: tp.Union[str, bool] = None
     navigation_file: str = None
     leading_trim: tp.Union[int, str] = None
     trailing_trim: tp.Union[int, str] = None
@@ -224,6 +261,11 @@ class ProcessConfig:
     bottom_depth: float = None
     pitch_threshold: float = None
     roll_threshold: float = None
+    spike_threshold: float = None
+    spike_window: int = None
+    shear_threshold: float = None
+    velocity_correlation_threshold: float = None
+    velocity_correlation_window: int = None
     motion_correction_mode: str = None
     merge_output_files: bool = None
     bodc_name: bool = None
@@ -233,6 +275,9 @@ class ProcessConfig:
     drop_amplitude: bool = None
     make_figures: tp.Union[str,bool] = None
     make_log: bool = None
+    append: bool = None
+    profile: bool = None
+    profile_report: bool = None
     odf_data: str = None
     metadata: dict = None
     platform_metadata: dict = None
@@ -248,6 +293,7 @@ class ProcessConfig:
 
     drop_empty_attrs: bool = False
     headless: bool = False
+    force: bool = False
 
     def __init__(self, config_dict: dict = None):
         self.metadata: dict = {}
@@ -302,7 +348,8 @@ class ProcessConfig:
 
 def process_adcp(config: dict,
                  drop_empty_attrs: bool = False,
-                 headless: bool = False):
+                 headless: bool = False,
+                 force: bool = False):
     """Process adcp data with parameters from a config file.
 
     Parameters
@@ -314,43 +361,116 @@ def process_adcp(config: dict,
         the output.
     headless :
         If true, figures are not displayed.
+    force :
+        If true, the data are processed even if the outputs are up-to-date.
 
     The actual data processing is carried out by _process_adcp_data.
     """
+    for job in get_adcp_jobs(config, drop_empty_attrs=drop_empty_attrs, headless=headless, force=force):
+        job.function(*job.args)
+
+
+def sweep_adcp_thresholds(config: dict, thresholds: tp.Dict[str, tp.Sequence[float]]) -> xr.Dataset:
+    """Sweep the quality control thresholds on the data of a config file.
+
+    The data are loaded (or restored from a checkpoint) as by `process_adcp`. The tests not
+    swept, and the motion correction, are carried out with the config file values.
+
+    Parameters
+    ----------
+    config :
+        Dictionary make from a configfile (see config_handler.load_config).
+    thresholds :
+        Thresholds to sweep for each test. See magtogoek.adcp.qc_sweep.SWEEP_TESTS.
+
+    Returns
+    -------
+    Sweep dataset. See magtogoek.adcp.qc_sweep.threshold_sweep.
+    """
+    pconfig = ProcessConfig(config)
+    # The data of the swept tests are loaded even if dropped from the outputs (new checkpoint key).
+    for name in set(thresholds).intersection(SWEEP_TESTS_DROP_OPTIONS):
+        setattr(pconfig, SWEEP_TESTS_DROP_OPTIONS[name], False)
+    l.reset()
+    dataset = _get_adcp_dataset(pconfig, StageProfiler(profile=False))
+    _set_xducer_depth_as_sensor_depth(dataset)
+
+    qc_pconfig = deepcopy(pconfig)
+    for name in thresholds:
+        setattr(qc_pconfig, SWEEP_TESTS_OPTIONS[name], None)
+    _quality_control(dataset, qc_pconfig)
+
+    return threshold_sweep(dataset, thresholds, fixed_flags=dataset.u_QC.data)
+
+
+def get_adcp_jobs(config: dict,
+                  drop_empty_attrs: bool = False,
+                  headless: bool = False,
+                  force: bool = False,
+                  name: str = "adcp") -> tp.List[Job]:
+    """Split the processing of a config file into independent jobs.
+
+    A single job processes all the input files if `merge_output_files` is True,
+    else there is one job per input file with its own outputs.
+
+    Parameters
+    ----------
+    config :
+        Dictionary make from a configfile (see config_handler.load_config).
+    drop_empty_attrs :
+        If true, all netcdf empty ('') global attributes will be drop from
+        the output.
+    headless :
+        If true, figures are not displayed.
+    force :
+        If true, the data are processed even if the outputs are up-to-date.
+    name :
+        Prefix of the jobs names.
+
+    Returns
+    -------
+    jobs :
+        Jobs running `_process_adcp_data` (see magtogoek.batch.run_jobs).
+    """
     pconfig = ProcessConfig(config)
     pconfig.drop_empty_attrs = drop_empty_attrs
     pconfig.headless = headless
+    pconfig.force = force
+
+    if pconfig.merge_output_files:
+        pconfig.resolve_outputs()
+        return [Job(name, _process_adcp_data, (pconfig,))]
 
     input_files = list(pconfig.input_files)
     odf_output = pconfig.odf_output
     netcdf_output = pconfig.netcdf_output
     event_qualifier1 = pconfig.metadata['event_qualifier1']
 
-    if pconfig.merge_output_files:
-        pconfig.resolve_outputs()
-        _process_adcp_data(pconfig)
-    else:
-        for count, filename in enumerate(input_files):
-            pconfig.input_files = [filename]
-            if isinstance(netcdf_output, str):
-                if not Path(netcdf_output).is_dir():
-                    pconfig.netcdf_output = str(Path(netcdf_output).with_suffix("")) + f"_{count}"
-                else:
-                    pconfig.netcdf_output = netcdf_output
+    jobs = []
+    for count, filename in enumerate(input_files):
+        file_pconfig = deepcopy(pconfig)
+        file_pconfig.input_files = [filename]
+        if isinstance(netcdf_output, str):
+            if not Path(netcdf_output).is_dir():
+                file_pconfig.netcdf_output = str(Path(netcdf_output).with_suffix("")) + f"_{count}"
+            else:
+                file_pconfig.netcdf_output = netcdf_output
 
-            if isinstance(odf_output, str):
-                if not Path(odf_output).is_dir():
-                    pconfig.odf_output = str(Path(odf_output).with_suffix("")) + f"_{count}"
-                else:
-                    pconfig.metadata['event_qualifier1'] = event_qualifier1 + f"_{Path(filename).name}"  # PREVENTS FROM OVERWRITING THE SAME FILE
-                    pconfig.odf_output = odf_output
+        if isinstance(odf_output, str):
+            if not Path(odf_output).is_dir():
+                file_pconfig.odf_output = str(Path(odf_output).with_suffix("")) + f"_{count}"
             else:
-                pconfig.metadata['event_qualifier1'] = event_qualifier1 + f"_{Path(filename).name}" # PREVENTS FROM OVERWRITING THE SAME FILE
-                pconfig.odf_output = odf_output
+                file_pconfig.metadata['event_qualifier1'] = event_qualifier1 + f"_{Path(filename).name}"  # PREVENTS FROM OVERWRITING THE SAME FILE
+                file_pconfig.odf_output = odf_output
+        else:
+            file_pconfig.metadata['event_qualifier1'] = event_qualifier1 + f"_{Path(filename).name}" # PREVENTS FROM OVERWRITING THE SAME FILE
+            file_pconfig.odf_output = odf_output
+
+        file_pconfig.resolve_outputs()
 
-            pconfig.resolve_outputs()
+        jobs.append(Job(f"{name}:{Path(filename).name}", _process_adcp_data, (file_pconfig,)))
 
-            _process_adcp_data(pconfig)
+    return jobs
 
 
 def _process_adcp_data(pconfig: ProcessConfig):
@@ -377,110 +497,133 @@ def _process_adcp_data(pconfig: ProcessConfig):
 
     """
     l.reset()
+    manifest_path = Path(str(Path(pconfig.log_path).with_suffix("")) + "_manifest.json")
+    processing_hash = _get_processing_hash(pconfig)
+    if not pconfig.force and is_up_to_date(manifest_path, processing_hash):
+        l.log(f"Outputs are up-to-date ({manifest_path.resolve()}). Processing skipped, use `--force` to reprocess.")
+        return
+
+    append_path = _get_append_path(pconfig)
+    last_time, append_depth = None, None
+    if append_path is not None:
+        last_time = get_last_time(append_path)
+        if not get_last_ensemble_time(
+                pconfig.input_files, pconfig.sonar, pconfig.yearbase, save_index=pconfig.save_index is not False
+        ) > last_time:
+            l.log(f"No ensembles after the last time of {append_path.resolve()}. Nothing to append.")
+            return
+        l.log(f"Only the ensembles after {np.datetime_as_string(last_time, unit='s')} are processed (append mode).")
+        if pconfig.grid_depth is None:
+            append_depth = get_coordinate(append_path, "depth")
+
+    profiler = StageProfiler(profile=pconfig.profile is True)
+    outputs = []
     # ----------------- #
     # LOADING ADCP DATA #
     # ----------------- #
 
-    dataset = _load_adcp_data(pconfig)
-
-    # ----------------------------------------- #
-    # ADDING THE NAVIGATION DATA TO THE DATASET #
-    # ----------------------------------------- #
-    if pconfig.navigation_file:
-        l.section("Navigation data")
-        dataset = _load_navigation(dataset, pconfig.navigation_file)
+    dataset = _get_adcp_dataset(pconfig, profiler, after_time=last_time, depth=append_depth)
 
     # ----------------------------- #
     # ADDING SOME GLOBAL ATTRIBUTES #
     # ----------------------------- #
 
-    dataset = dataset.assign_attrs(STANDARD_ADCP_GLOBAL_ATTRIBUTES)
+    with profiler.stage("global_attributes"):
+        dataset = dataset.assign_attrs(STANDARD_ADCP_GLOBAL_ATTRIBUTES)
 
-    dataset.attrs["data_type"] = DATA_TYPES[pconfig.platform_type]
-    dataset.attrs["data_subtype"] = DATA_SUBTYPES[pconfig.platform_type]
+        dataset.attrs["data_type"] = DATA_TYPES[pconfig.platform_type]
+        dataset.attrs["data_subtype"] = DATA_SUBTYPES[pconfig.platform_type]
 
-    if pconfig.platform_metadata["platform"]["longitude"]:
-        dataset.attrs["longitude"] = pconfig.platform_metadata["platform"]["longitude"]
-    if pconfig.platform_metadata["platform"]["latitude"]:
-        dataset.attrs["latitude"] = pconfig.platform_metadata["platform"]["latitude"]
+        if pconfig.platform_metadata["platform"]["longitude"]:
+            dataset.attrs["longitude"] = pconfig.platform_metadata["platform"]["longitude"]
+        if pconfig.platform_metadata["platform"]["latitude"]:
+            dataset.attrs["latitude"] = pconfig.platform_metadata["platform"]["latitude"]
 
-    compute_global_attrs(dataset)
+        compute_global_attrs(dataset)
 
-    if pconfig.platform_metadata["platform"]["platform_type"] in ["mooring", "buoy"]:
-        if "bt_depth" in dataset:
-            dataset.attrs["sounding"] = np.round(np.median(dataset.bt_depth.data), 2)
+        if pconfig.platform_metadata["platform"]["platform_type"] in ["mooring", "buoy"]:
+            if "bt_depth" in dataset:
+                dataset.attrs["sounding"] = np.round(np.median(dataset.bt_depth.data), 2)
 
-    _set_xducer_depth_as_sensor_depth(dataset)
+        _set_xducer_depth_as_sensor_depth(dataset)
 
-    _set_platform_metadata(dataset, pconfig)
+        _set_platform_metadata(dataset, pconfig)
 
-    dataset = dataset.assign_attrs(pconfig.metadata)
+        dataset = dataset.assign_attrs(pconfig.metadata)
 
-    if not dataset.attrs["source"]:
-        dataset.attrs["source"] = pconfig.platform_type
+        if not dataset.attrs["source"]:
+            dataset.attrs["source"] = pconfig.platform_type
 
     # --------------- #
     # QUALITY CONTROL #
     # --------------- #
 
-    dataset.attrs["logbook"] += l.logbook
+    with profiler.stage("quality_control"):
+        dataset.attrs["logbook"] += l.logbook
 
-    if pconfig.quality_control:
-        _quality_control(dataset, pconfig)
-    else:
-        no_adcp_quality_control(dataset)
+        if pconfig.quality_control:
+            _quality_control(dataset, pconfig)
+        else:
+            no_adcp_quality_control(dataset)
 
-    l.reset()
+        l.reset()
 
     # ----------------------------------- #
     # CORRECTION FOR MAGNETIC DECLINATION #
     # ----------------------------------- #
 
-    l.section("Data transformation")
+    with profiler.stage("data_transformation"):
+        l.section("Data transformation")
 
-    if dataset.attrs['magnetic_declination'] is not None:
-        l.log(f"Magnetic declination found in the raw file: {dataset.attrs['magnetic_declination']} degree east.")
-    else:
-        l.log(f"No magnetic declination found in the raw file.")
-    if pconfig.magnetic_declination:
-        angle = pconfig.magnetic_declination
-        if dataset.attrs["magnetic_declination"]:
-            angle = round((pconfig.magnetic_declination - dataset.attrs["magnetic_declination"]), 4)
-            l.log(f"An additional correction of {angle} degree east was applied.")
-        _apply_magnetic_correction(dataset, angle)
-        dataset.attrs["magnetic_declination"] = pconfig.magnetic_declination
-        l.log(f"Absolute magnetic declination: {dataset.attrs['magnetic_declination']} degree east.")
-
-    if any(x is True for x in [pconfig.drop_percent_good, pconfig.drop_correlation, pconfig.drop_amplitude]):
-        dataset = _drop_beam_data(dataset, pconfig)
+        if dataset.attrs['magnetic_declination'] is not None:
+            l.log(f"Magnetic declination found in the raw file: {dataset.attrs['magnetic_declination']} degree east.")
+        else:
+            l.log(f"No magnetic declination found in the raw file.")
+        if pconfig.magnetic_declination:
+            angle = pconfig.magnetic_declination
+            if dataset.attrs["magnetic_declination"]:
+                angle = round((pconfig.magnetic_declination - dataset.attrs["magnetic_declination"]), 4)
+                l.log(f"An additional correction of {angle} degree east was applied.")
+            _apply_magnetic_correction(dataset, angle)
+            dataset.attrs["magnetic_declination"] = pconfig.magnetic_declination
+            l.log(f"Absolute magnetic declination: {dataset.attrs['magnetic_declination']} degree east.")
+
+        if any(x is True for x in [pconfig.drop_percent_good, pconfig.drop_correlation, pconfig.drop_amplitude]):
+            dataset = _drop_beam_data(dataset, pconfig)
+
+        if pconfig.netcdf_output is True and "dday" not in dataset:
+            dataset["time_string"] = (["time"], datetime64_to_string(dataset.time.values))
 
     # ------------- #
     # DATA ENCODING #
     # ------------- #
-    _format_data_encoding(dataset)
+    with profiler.stage("encoding"):
+        _format_data_encoding(dataset)
 
     # -------------------- #
     # VARIABLES ATTRIBUTES #
     # -------------------- #
-    dataset.attrs['bodc_name'] = pconfig.bodc_name
-    dataset.attrs["VAR_TO_ADD_SENSOR_TYPE"] = VAR_TO_ADD_SENSOR_TYPE
-    dataset.attrs["P01_CODES"] = {
-        **P01_VEL_CODES[pconfig.platform_type],
-        **P01_CODES,
-    }
-    dataset.attrs["variables_gen_name"] = [var for var in dataset.variables]  # For Odf outputs
-
-    l.section("Variables attributes")
-    dataset = format_variables_names_and_attributes(dataset)
+    with profiler.stage("variables_attributes"):
+        dataset.attrs['bodc_name'] = pconfig.bodc_name
+        dataset.attrs["VAR_TO_ADD_SENSOR_TYPE"] = VAR_TO_ADD_SENSOR_TYPE
+        dataset.attrs["P01_CODES"] = {
+            **P01_VEL_CODES[pconfig.platform_type],
+            **P01_CODES,
+        }
+        dataset.attrs["variables_gen_name"] = [var for var in dataset.variables]  # For Odf outputs
+
+        l.section("Variables attributes")
+        dataset = format_variables_names_and_attributes(dataset)
 
     # ------------ #
     # MAKE FIGURES #
     # ------------ #
     if pconfig.figures_output is True:
-        make_adcp_figure(dataset,
-                         flag_thres=2,
-                         save_path=pconfig.figures_path,
-                         show_fig=not pconfig.headless)
+        with profiler.stage("figures"):
+            outputs += make_adcp_figure(dataset,
+                                        flag_thres=2,
+                                        save_path=pconfig.figures_path,
+                                        show_fig=not pconfig.headless)
 
     dataset["time"].assign_attrs(TIME_ATTRS)
     l.log("Variables attributes added.")
@@ -507,88 +650,243 @@ def _process_adcp_data(pconfig: ProcessConfig):
     # ----------- #
     l.section("Post-processing")
     if pconfig.grid_depth is not None:
-        dataset = _regrid_dataset(dataset, pconfig)
+        with profiler.stage("regridding"):
+            dataset = _regrid_dataset(dataset, pconfig)
 
     # ----------- #
     # ODF OUTPUTS #
     # ----------- #
 
     l.section("Output")
-    if pconfig.odf_output is True:
-        if pconfig.odf_data is None:
-            pconfig.odf_data = 'both'
-        odf_data = {'both': ['VEL', 'ANC'], 'vel': ['VEL'], 'anc': ['ANC']}[pconfig.odf_data]
-        for qualifier in odf_data:
-            _ = make_odf(
-                dataset=dataset,
-                platform_metadata=pconfig.platform_metadata,
-                config_attrs=pconfig.metadata,
-                bodc_name=pconfig.bodc_name,
-                event_qualifier2=qualifier,
-                output_path=pconfig.odf_path,
-            )
+    if pconfig.odf_output is True and last_time is not None:
+        l.warning("ODF files are not made in append mode.")
+    elif pconfig.odf_output is True:
+        with profiler.stage("odf"):
+            if pconfig.odf_data is None:
+                pconfig.odf_data = 'both'
+            odf_data = {'both': ['VEL', 'ANC'], 'vel': ['VEL'], 'anc': ['ANC']}[pconfig.odf_data]
+            for qualifier in odf_data:
+                odf = make_odf(
+                    dataset=dataset,
+                    platform_metadata=pconfig.platform_metadata,
+                    config_attrs=pconfig.metadata,
+                    bodc_name=pconfig.bodc_name,
+                    event_qualifier2=qualifier,
+                    output_path=pconfig.odf_path,
+                )
+                odf_directory = Path(pconfig.odf_path)
+                if not odf_directory.is_dir():
+                    odf_directory = odf_directory.parent
+                outputs.append(odf_directory.joinpath(odf.odf["file_specification"]).with_suffix(".ODF"))
 
     # ------------------------------------ #
     # FORMATTING DATASET FOR NETCDF OUTPUT #
     # ------------------------------------ #
-    for var in VARIABLES_TO_DROP:
-        if var in dataset.variables:
-            dataset = dataset.drop_vars([var])
+    with profiler.stage("netcdf"):
+        for var in VARIABLES_TO_DROP:
+            if var in dataset.variables:
+                dataset = dataset.drop_vars([var])
 
-    for attr in GLOBAL_ATTRS_TO_DROP:
-        if attr in dataset.attrs:
-            del dataset.attrs[attr]
-
-    for attr in list(dataset.attrs.keys()):
-        if not dataset.attrs[attr]:
-            if pconfig.drop_empty_attrs is True:
+        for attr in GLOBAL_ATTRS_TO_DROP:
+            if attr in dataset.attrs:
                 del dataset.attrs[attr]
+
+        for attr in list(dataset.attrs.keys()):
+            if not dataset.attrs[attr]:
+                if pconfig.drop_empty_attrs is True:
+                    del dataset.attrs[attr]
+                else:
+                    dataset.attrs[attr] = ""
+
+        # ---------- #
+        # NC OUTPUTS #
+        # ---------- #
+        if pconfig.netcdf_output is True:
+            netcdf_path = Path(pconfig.netcdf_path).with_suffix('.nc')
+            if last_time is not None:
+                append_to_netcdf(netcdf_path, dataset)
+                l.log(f"{len(dataset.time)} ensembles appended -> {netcdf_path.resolve()}")
+            elif pconfig.append is True:
+                # Float times so that the appended times are not rounded.
+                dataset.time.encoding = {**dataset.time.encoding, "dtype": "float64"}
+                dataset.to_netcdf(netcdf_path, unlimited_dims=["time"])
+                l.log(f"netcdf file made -> {netcdf_path.resolve()}")
             else:
-                dataset.attrs[attr] = ""
-
-    # ---------- #
-    # NC OUTPUTS #
-    # ---------- #
-    if pconfig.netcdf_output is True:
-        netcdf_path = Path(pconfig.netcdf_path).with_suffix('.nc')
-        dataset.to_netcdf(netcdf_path)
-        l.log(f"netcdf file made -> {netcdf_path.resolve()}")
-
-    if pconfig.make_log is True:
-        log_path = Path(pconfig.log_path).with_suffix(".log")
-        with open(log_path, "w") as log_file:
-            log_file.write(dataset.attrs["history"])
-            print(f"log file made -> {log_path.resolve()}")
+                dataset.to_netcdf(netcdf_path)
+                l.log(f"netcdf file made -> {netcdf_path.resolve()}")
+            outputs.append(netcdf_path)
+
+    # ------------------------ #
+    # LOG AND PROFILING OUTPUT #
+    # ------------------------ #
+    profiling_log = Logger(level=0)
+    profiling_log.section("Profiling")
+    profiling_log.log(profiler.log_lines())
+
+    with profiler.stage("log"):
+        if pconfig.make_log is True:
+            log_path = Path(pconfig.log_path).with_suffix(".log")
+            with open(log_path, "a" if last_time is not None else "w") as log_file:
+                log_file.write(dataset.attrs["history"] + profiling_log.logbook)
+                outputs.append(log_path)
+                print(f"log file made -> {log_path.resolve()}")
+
+    profile_prefix = str(Path(pconfig.log_path).with_suffix("")) + "_profile"
+    if pconfig.profile_report is True:
+        profiler.write_report(profile_prefix + ".json")
+        print(f"profile report made -> {Path(profile_prefix + '.json').resolve()}")
+    if pconfig.profile is True:
+        filenames = profiler.dump_stats(profile_prefix)
+        print(f"cProfile stats made -> {Path(profile_prefix).resolve()}_*.prof ({len(filenames)} stages)")
+
+    write_manifest(manifest_path, processing_hash, outputs)
 
     click.echo(click.style("=" * TERMINAL_WIDTH, fg="white", bold=True))
 
 
-def _load_adcp_data(pconfig: ProcessConfig) -> xr.Dataset:
+def _get_adcp_dataset(
+        pconfig: ProcessConfig, profiler: StageProfiler, after_time: np.datetime64 = None, depth: np.ndarray = None
+) -> xr.Dataset:
+    """Load the adcp data and the navigation data, or restore them from a checkpoint.
+
+    Checkpoints are not used if `after_time` is provided (append mode). See `_load_adcp_data`.
+    """
+    checkpoint_path = _get_checkpoint_path(pconfig) if pconfig.checkpoint and after_time is None else None
+    checkpoint = None
+    if checkpoint_path is not None and checkpoint_path.exists():
+        with profiler.stage("checkpoint") as stage:
+            checkpoint = read_checkpoint(checkpoint_path)
+            if checkpoint is not None:
+                stage["ensembles"] = len(checkpoint[0].time)
+    if checkpoint is not None:
+        dataset, l.logbook = checkpoint
+        l.log(f"Data loaded from checkpoint -> {checkpoint_path.resolve()}")
+        return dataset
+
+    with profiler.stage("load") as stage:
+        dataset = _load_adcp_data(pconfig, after_time=after_time, depth=depth)
+        stage["ensembles"] = len(dataset.time)
+
+    # ----------------------------------------- #
+    # ADDING THE NAVIGATION DATA TO THE DATASET #
+    # ----------------------------------------- #
+    if pconfig.navigation_file:
+        with profiler.stage("navigation"):
+            l.section("Navigation data")
+            dataset = _load_navigation(dataset, pconfig.navigation_file)
+
+    if checkpoint_path is not None:
+        write_checkpoint(checkpoint_path, dataset, l.logbook)
+        l.log(f"Checkpoint made -> {checkpoint_path.resolve()}")
+
+    return dataset
+
+
+def _get_processing_hash(pconfig: ProcessConfig) -> str:
+    """Hash of the input, navigation and platform files and of the processing configuration.
+
+    Options not changing the outputs (e.g. `headless`, `profile`, `checkpoint`) are not hashed.
+    """
+    filenames = list(pconfig.input_files)
+    for filename in [pconfig.navigation_file, pconfig.platform_file]:
+        if filename:
+            filenames.append(filename)
+
+    options = {
+        option: value for option, value in vars(pconfig).items() if option not in MANIFEST_IGNORED_OPTIONS
+    }
+    return checkpoint_key(filenames, options)
+
+
+def _get_append_path(pconfig: ProcessConfig) -> tp.Optional[Path]:
+    """Path of the existing netcdf output to append the new ensembles to.
+
+    Returns None if `append` is not True or if there is no netcdf output to append to yet.
+    """
+    if pconfig.append is not True or pconfig.netcdf_output is not True:
+        return None
+    netcdf_path = Path(pconfig.netcdf_path).with_suffix('.nc')
+    if not netcdf_path.is_file():
+        return None
+    if pconfig.start_time is not None:
+        raise ValueError(
+            "`start_time` cannot be used in append mode. The new time coordinates would not follow the existing ones."
+        )
+    return netcdf_path
+
+
+def _get_checkpoint_path(pconfig: ProcessConfig) -> Path:
+    """Path of the checkpoint of the loaded (and navigation merged) dataset.
+
+    The checkpoint key is computed from the input and navigation files and the options
+    used by `_load_adcp_data` and `_load_navigation`. The checkpoints are in `pconfig.checkpoint`
+    if it is a directory path, else in a `.magtogoek_checkpoints` directory next to the input files.
+    """
+    if isinstance(pconfig.checkpoint, str):
+        directory = Path(pconfig.checkpoint)
+    else:
+        directory = Path(pconfig.input_files[0]).parent.joinpath(DEFAULT_CHECKPOINT_DIRECTORY)
+
+    filenames = list(pconfig.input_files)
+    if pconfig.navigation_file:
+        filenames.append(pconfig.navigation_file)
+
+    options = {option: getattr(pconfig, option) for option in CHECKPOINT_OPTIONS}
+    options["variables"] = sorted(_get_variables_to_load(pconfig))
+
+    return directory.joinpath(checkpoint_key(filenames, options)).with_suffix(CHECKPOINT_SUFFIX)
+
+
+def _load_adcp_data(pconfig: ProcessConfig, after_time: np.datetime64 = None, depth: np.ndarray = None) -> xr.Dataset:
     """
     Load and trim the adcp data into a xarray.Dataset.
     Drops bottom track data if `keep_bt` is False.
+
+    Datetime trims are passed to the loader so that only the ensembles within them are read,
+    unless a new time coordinate is made from `start_time`. `cut_times` is still applied.
+
+    If `after_time` is provided (append mode), only the ensembles after it are read and kept.
+    If `depth` is provided (append mode), the bins are matched to the depths of the existing
+    file. See `match_bin_depths`.
     """
     start_time, leading_index = _get_datetime_and_count(pconfig.leading_trim)
     end_time, trailing_index = _get_datetime_and_count(pconfig.trailing_trim)
+    push_down_times = pconfig.start_time is None
+    leading_time = start_time
+    if after_time is not None and (start_time is None or start_time < pd.Timestamp(after_time)):
+        leading_time = pd.Timestamp(after_time)
 
     dataset = load_adcp_binary(
         filenames=pconfig.input_files,
+        variables=_get_variables_to_load(pconfig),
         yearbase=pconfig.yearbase,
         sonar=pconfig.sonar,
         leading_index=leading_index,
         trailing_index=trailing_index,
+        leading_time=leading_time if push_down_times else None,
+        trailing_time=end_time if push_down_times else None,
         orientation=pconfig.adcp_orientation,
         sensor_depth=pconfig.sensor_depth,
         bad_pressure=pconfig.bad_pressure,
         start_time=pconfig.start_time,
         time_step=pconfig.time_step,
         magnetic_declination_preset=pconfig.magnetic_declination_preset,
+        pd0_reader=pconfig.pd0_reader or "pycurrents",
+        chunk_size=pconfig.chunk_size,
+        float32=pconfig.float32,
+        save_index=pconfig.save_index is not False,
     )
 
+    if depth is not None:
+        dataset = match_bin_depths(dataset, depth)
+
     dataset = cut_bin_depths(dataset, pconfig.depth_range)
 
     dataset = cut_times(dataset, start_time, end_time)
 
+    if after_time is not None:
+        dataset = dataset.sel(time=dataset.time > after_time)
+
     l.log(
         (
             f"Bin counts : {len(dataset.depth.data)}, "
@@ -610,6 +908,25 @@ def _load_adcp_data(pconfig: ProcessConfig) -> xr.Dataset:
     return dataset
 
 
+def _get_variables_to_load(pconfig: ProcessConfig) -> tp.Set[str]:
+    """Optional variables the RTI reader needs to decode.
+
+    Amplitude, correlation and percent good are needed by the quality control
+    even if they are dropped from the output.
+    """
+    variables = {"nav"}
+    for var, drop, threshold in zip(
+            ["amp", "cor", "pg"],
+            [pconfig.drop_amplitude, pconfig.drop_correlation, pconfig.drop_percent_good],
+            [pconfig.amplitude_threshold, pconfig.correlation_threshold, pconfig.percentgood_threshold]
+    ):
+        if drop is not True or (pconfig.quality_control and threshold is not None):
+            variables.add(var)
+    if pconfig.keep_bt:
+        variables.add("bt")
+    return variables
+
+
 def _set_platform_metadata(dataset: xr.Dataset, pconfig: ProcessConfig):
     """Add metadata from platform_metadata files to dataset.attrs.
 
@@ -703,18 +1020,10 @@ def _regrid_dataset(dataset: xr.Dataset, pconfig: ProcessConfig) -> xr.Dataset:
     _new_depths = np.loadtxt(pconfig.grid_depth)
 
     # Pre-process flags
-    for var_ in 'uvw':
-        _flag_name = dataset[var_].attrs['ancillary_variables']
+    _flag_names = [dataset[var_].attrs['ancillary_variables'] for var_ in 'uvw']
+    for _flag_name in _flag_names:
         dataset[_flag_name].values = _prepare_flags_for_regrid(dataset[_flag_name].data)
 
-    # Make new quality flags if grid_method is `bin`. Must happen before averaging.
-    if pconfig.grid_method == 'bin':
-        _new_flags = dict()
-        for var_ in 'uvw':
-            _flag_name = dataset[var_].attrs['ancillary_variables']
-            _new_flags[_flag_name] = _new_flags_bin_regrid(dataset[_flag_name], _new_depths)
-        new_flags = xr.Dataset(_new_flags)
-
     # Apply quality control
     for var_ in 'uvw':
         _flag_name = dataset[var_].attrs['ancillary_variables']
@@ -723,17 +1032,17 @@ def _regrid_dataset(dataset: xr.Dataset, pconfig: ProcessConfig) -> xr.Dataset:
     # Regridding
     msg = f"to grid from file: {pconfig.grid_depth}"
     l.log(f"Regridded dataset with method {pconfig.grid_method} {msg}")
+    # The `bin` method makes the new flags in the same pass as the averaging.
     dataset = regrid_dataset(dataset,
                              grid=_new_depths,
                              dim='depth',
-                             method=pconfig.grid_method)
+                             method=pconfig.grid_method,
+                             flags=_flag_names)
 
-    # Make new flags and replace interpolated/binned values
-    for var_ in 'uvw':
-        _flag_name = dataset[var_].attrs['ancillary_variables']
-        if pconfig.grid_method == 'bin':
-            dataset[_flag_name] = new_flags[_flag_name]
-        elif pconfig.grid_method == 'interp':
+    # Make new flags for the interpolated values
+    if pconfig.grid_method == 'interp':
+        for var_ in 'uvw':
+            _flag_name = dataset[var_].attrs['ancillary_variables']
             dataset[_flag_name] = _new_flags_interp_regrid(dataset, var_)
 
     # Change min and max values
@@ -756,6 +1065,11 @@ def _quality_control(dataset: xr.Dataset, pconfig: ProcessConfig):
                          horizontal_vel_th=pconfig.horizontal_velocity_threshold,
                          vertical_vel_th=pconfig.vertical_velocity_threshold,
                          error_vel_th=pconfig.error_velocity_threshold,
+                         spike_th=pconfig.spike_threshold,
+                         spike_window=pconfig.spike_window,
+                         shear_th=pconfig.shear_threshold,
+                         vel_corr_th=pconfig.velocity_correlation_threshold,
+                         vel_corr_window=pconfig.velocity_correlation_window,
                          motion_correction_mode=pconfig.motion_correction_mode,
                          sidelobes_correction=pconfig.sidelobes_correction,
                          bottom_depth=pconfig.bottom_depth,
@@ -781,19 +1095,19 @@ def _apply_magnetic_correction(dataset: xr.Dataset, magnetic_declination: float)
         angle in decimal degrees measured in the geographic frame of reference.
     """
 
-    dataset.u.values, dataset.v.values = rotate_2d_vector(
-        dataset.u, dataset.v, -magnetic_declination
+    dataset.u.data, dataset.v.data = rotate_2d_vector(
+        dataset.u.data, dataset.v.data, -magnetic_declination
     )
     l.log(f"Velocities transformed to true north and true east.")
     if all(v in dataset for v in ["bt_u", "bt_v"]):
-        dataset.bt_u.values, dataset.bt_v.values = rotate_2d_vector(
-            dataset.bt_u, dataset.bt_v, -magnetic_declination
+        dataset.bt_u.data, dataset.bt_v.data = rotate_2d_vector(
+            dataset.bt_u.data, dataset.bt_v.data, -magnetic_declination
         )
         l.log(f"Bottom velocities transformed to true north and true east.")
 
     # heading goes from -180 to 180
     if "heading" in dataset:
-        dataset.heading.values = (
+        dataset.heading.data = (
             dataset.heading.data + 180 + magnetic_declination
         ) % 360 - 180
         l.log(f"Heading transformed to true north.")
@@ -855,7 +1169,7 @@ def _format_data_encoding(dataset: xr.Dataset):
         elif var == "depth":
             dataset.depth.encoding = DEPTH_ENCODING
         elif "_QC" in var:
-            dataset[var].values = dataset[var].values.astype("int8")
+            dataset[var].data = dataset[var].data.astype("int8")
             dataset[var].encoding = QC_ENCODING
         elif var == "time_string":
             dataset[var].encoding = TIME_STRING_ENCODING
@@ -874,6 +1188,36 @@ def _drop_bottom_track(dataset: xr.Dataset) -> xr.Dataset:
     return dataset
 
 
+def match_bin_depths(dataset: xr.Dataset, depth: np.ndarray) -> xr.Dataset:
+    """Return the dataset with its bins matched to `depth` (e.g. the depths of an existing file).
+
+    The bin depths are computed from the median XducerDepth of the ensembles loaded, so they
+    shift from one batch of ensembles to the other. Each `depth` value is matched to the nearest
+    bin, which must be within half a bin, and the bins not matched are dropped.
+
+    Parameters
+    ----------
+    dataset :
+    depth :
+        Bin depths to match.
+
+    Raises
+    ------
+    ValueError :
+        A `depth` value is more than half a bin away from the bin depths.
+    """
+    try:
+        matched = dataset.sel(depth=depth, method="nearest", tolerance=dataset.attrs["bin_size_m"] / 2)
+    except KeyError:
+        raise ValueError(
+            "The bin depths differ by more than half a bin from the ones of the existing file. "
+            "The ensembles cannot be appended."
+        )
+    shift = np.round(np.abs(matched.depth.data - depth).max(), 3)
+    l.log(f"Bin depths set to the ones of the existing file (maximum shift of {shift} m).")
+    return matched.assign_coords(depth=depth)
+
+
 def cut_bin_depths(
         dataset: xr.Dataset, depth_range: tp.Union[int, float, list] = None
 ) -> xr.Dataset:
@@ -0,0 +1,172 @@
+"""
+Quality control threshold sweeps.
+
+The statistic each threshold test compares against (e.g. the maximum beam amplitude or the
+horizontal speed, see `magtogoek.adcp.quality_control.cell_test_statistic`) is computed once
+for every cell. Each cell is then coded by the position of its statistics in the sorted
+thresholds of each test. The codes are histogrammed by depth and the number of cells passing
+every threshold combination is given by cumulative sums of that histogram along each test.
+So the whole grid of combinations is evaluated in one pass over the data.
+
+Usage:
+sweep = threshold_sweep(dataset, thresholds=dict(amp=[20, 30, 40], corr=[50, 64, 80]))
+sweep.percent_flagged.sel(amp=30, corr=64)
+sweep.retention.sel(amp=30, corr=64)  # fraction of the cells kept at each depth
+
+Notes
+-----
+The binary_mask tests `sidelobe` and the pressure, implausible and missing velocities tests
+have no threshold to sweep. The time series tests (spike, shear and vel correlation) are not
+swept. Their results can be passed as `fixed_flags`.
+"""
+import typing as tp
+
+import numpy as np
+import xarray as xr
+from magtogoek.adcp.quality_control import (BINARY_MASK_TESTS, CELL_TESTS_VARIABLES, QC_BLOCK_SIZE,
+                                            cell_test_statistic, distance_from_circular_mean,
+                                            velocity_qc_kernel)
+
+# Sweepable tests names and their binary_mask bit.
+SWEEP_TESTS = {
+    "amp": 0,
+    "corr": 1,
+    "pg": 2,
+    "horizontal_vel": 3,
+    "vertical_vel": 4,
+    "error": 5,
+    "roll": 6,
+    "pitch": 7,
+}
+TIME_TESTS_VARIABLES = {6: "roll_", 7: "pitch"}
+MAX_SWEEP_SIZE = 10 ** 8  # Maximum number of histogram bins (depth x threshold combinations).
+
+
+def threshold_sweep(
+        dataset: xr.Dataset,
+        thresholds: tp.Dict[str, tp.Sequence[float]],
+        fixed_flags: np.ndarray = None,
+        block_size: int = QC_BLOCK_SIZE,
+) -> xr.Dataset:
+    """Evaluate all the combinations of the tests thresholds.
+
+    Parameters
+    ----------
+    dataset :
+        ADCP dataset formatted as done by adcp_init.
+    thresholds :
+        Thresholds to sweep for each test. Tests names are the keys of `SWEEP_TESTS`.
+    fixed_flags :
+        [depth, time] flags of the tests not swept (e.g. `u_QC` from `adcp_quality_control`
+        without the swept tests). Cells with a flag greater than 2 are flagged in all
+        combinations. If None, only the missing and implausible velocities are.
+    block_size :
+        Number of cells coded at once.
+
+    Returns
+    -------
+    Dataset with a coordinate per test (its sorted thresholds) and the variables:
+        percent_flagged :
+            Percent of the cells flagged by each combination.
+        retention :
+            Fraction of the cells kept at each depth by each combination.
+    """
+    names = list(thresholds)
+    unknown = set(names).difference(SWEEP_TESTS)
+    if unknown:
+        raise ValueError(f"Invalid tests: {sorted(unknown)}. Valid tests: {list(SWEEP_TESTS)}.")
+    missing = [name for name in names if not _has_test_variables(dataset, SWEEP_TESTS[name])]
+    if missing:
+        raise ValueError(f"Data needed by the tests {missing} are missing from the dataset.")
+
+    grids = [np.unique(np.asarray(thresholds[name], dtype=float)) for name in names]
+    codes_count = [len(grid) + 1 for grid in grids]
+    n_depth, n_time = len(dataset.depth), len(dataset.time)
+    n_codes = int(np.prod(codes_count))
+    if n_depth * n_codes > MAX_SWEEP_SIZE:
+        raise ValueError(f"Too many threshold combinations ({n_codes}) to sweep.")
+
+    if fixed_flags is None:
+        fixed_flags, _ = velocity_qc_kernel(dataset)
+
+    time_statistics = {
+        bit: distance_from_circular_mean(np.asarray(dataset[var].data))
+        for bit, var in TIME_TESTS_VARIABLES.items()
+        if bit in [SWEEP_TESTS[name] for name in names]
+    }
+    variables = set().union(*(CELL_TESTS_VARIABLES[SWEEP_TESTS[name]] for name in names if SWEEP_TESTS[name] < 6))
+    data = {var: dataset[var].data for var in variables}
+    depth_index = np.arange(n_depth)[:, np.newaxis] * n_codes
+
+    histogram = np.zeros(n_depth * n_codes, dtype=np.int64)
+    step = max(1, block_size // max(1, n_depth))
+    for start in range(0, n_time, step):
+        t = slice(start, min(start + step, n_time))
+        block = {var: np.asarray(values[:, t]) for var, values in data.items()}
+        codes = np.zeros((n_depth, t.stop - t.start), dtype=np.int64)
+        for name, grid, count in zip(names, grids, codes_count):
+            bit = SWEEP_TESTS[name]
+            if bit in time_statistics:
+                statistic, fails_below = time_statistics[bit][np.newaxis, t], False
+            else:
+                statistic, fails_below = cell_test_statistic(block, bit)
+            codes *= count
+            codes += _threshold_codes(statistic, grid, fails_below)
+        kept = np.asarray(fixed_flags[:, t]) <= 2
+        histogram += np.bincount((codes + depth_index)[kept], minlength=n_depth * n_codes)
+
+    retained = histogram.reshape([n_depth] + codes_count)
+    for axis, name in enumerate(names, start=1):
+        retained = _passing_counts(retained, axis, fails_below=SWEEP_TESTS[name] < 3)
+
+    sweep = xr.Dataset(coords={"depth": dataset.depth.data, **dict(zip(names, grids))})
+    sweep["retention"] = (["depth"] + names, retained / n_time)
+    sweep["percent_flagged"] = (names, 100 * (1 - retained.sum(axis=0) / (n_depth * n_time)))
+    sweep.attrs["binary_mask_tests"] = [BINARY_MASK_TESTS[SWEEP_TESTS[name]] for name in names]
+    return sweep
+
+
+def sweep_table(sweep: xr.Dataset) -> str:
+    """Return a text table of the percent of cells flagged by each combination of thresholds."""
+    names = list(sweep.percent_flagged.dims)
+    lines = ["".join(name.rjust(16) for name in names) + "percent_flagged".rjust(18)]
+    for index in np.ndindex(sweep.percent_flagged.shape):
+        values = [sweep[name].data[i] for name, i in zip(names, index)]
+        lines.append(
+            "".join(f"{value:16g}" for value in values) + f"{sweep.percent_flagged.data[index]:18.2f}"
+        )
+    return "\n".join(lines)
+
+
+def _has_test_variables(dataset: xr.Dataset, bit: int) -> bool:
+    if bit in TIME_TESTS_VARIABLES:
+        return TIME_TESTS_VARIABLES[bit] in dataset
+    return all(var in dataset for var in CELL_TESTS_VARIABLES[bit])
+
+
+def _threshold_codes(statistic: np.ndarray, grid: np.ndarray, fails_below: bool) -> np.ndarray:
+    """Position of the statistics in the sorted thresholds.
+
+    With `code = _threshold_codes(...)`, a cell passes the threshold `grid[j]` if `j < code`
+    when it fails below the threshold, or if `j >= code` when it fails above it.
+    NaN statistics pass all the thresholds.
+    """
+    if fails_below:
+        return np.searchsorted(grid, statistic, side="right")
+    codes = np.searchsorted(grid, statistic, side="left")
+    codes[np.isnan(statistic)] = 0
+    return codes
+
+
+def _passing_counts(histogram: np.ndarray, axis: int, fails_below: bool) -> np.ndarray:
+    """Sum the histogram along `axis` over the codes passing each threshold.
+
+    The `axis` length goes from `len(thresholds) + 1` codes to `len(thresholds)` thresholds.
+    """
+    if fails_below:
+        # Cells pass grid[j] if code > j.
+        counts = np.flip(np.cumsum(np.flip(histogram, axis=axis), axis=axis), axis=axis)
+        return np.delete(counts, 0, axis=axis)
+    # Cells pass grid[j] if code <= j.
+    counts = np.cumsum(histogram, axis=axis)
+    return np.delete(counts, -1, axis=axis)
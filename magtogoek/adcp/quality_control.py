@@ -17,6 +17,10 @@ Notes
    and the corresponding velocity cells have a flag_value of `3` (probably_bad_value)
    - The amplitude, correlation and percentgood thresholds are also applied to
    sentinelV fifth beam data.
+   - Optional time series tests on the horizontal velocities (flag_value of `3`):
+       - spike: distance from the rolling median of the ensembles window.
+       - shear: vertical shear with the adjacent bins.
+       - vel correlation: rolling pearson correlation with the adjacent bins.
 
 
    SeaDataNet Quality Control Flags Value
@@ -44,7 +48,6 @@ IML flags meaning : (Basically the same)
    * 9: value_missing
 
 TODO:
-   - Add a test with the pearson correlation
    - A processing value could be use to tell every fonction which xducer_depth to take instead of checking everytime.
 
 """
@@ -55,7 +58,6 @@ import xarray as xr
 from magtogoek.tools import circular_distance
 from magtogoek.utils import Logger
 from pandas import Timestamp
-from scipy.stats import circmean
 
 # Brand dependent quality control defaults
 #    rti_qc_defaults = dict(amp_th=20)
@@ -84,6 +86,36 @@ FLAG_MEANINGS = (
     "missing_value",
 )
 
+# binary_mask bits: the test `BINARY_MASK_TESTS[i]` sets the bit `2 ** i`.
+BINARY_MASK_TESTS = (
+    "amp",
+    "corr",
+    "pg",
+    "horizontal vel",
+    "vertical vel",
+    "error",
+    "roll",
+    "pitch",
+    "sidelobe",
+    "spike",
+    "shear",
+    "vel correlation",
+)
+# Variables needed by the [depth, time] tests (binary_mask bits 0 to 5).
+CELL_TESTS_VARIABLES = (
+    ("amp1", "amp2", "amp3", "amp4"),
+    ("corr1", "corr2", "corr3", "corr4"),
+    ("pg",),
+    ("u", "v"),
+    ("w",),
+    ("e",),
+)
+# Time series tests on the horizontal velocities (binary_mask bits 9 to 11).
+SERIES_TESTS_BITS = (9, 10, 11)
+SPIKE_WINDOW = 5  # Default ensembles window of the rolling median.
+VEL_CORR_WINDOW = 15  # Default ensembles window of the rolling correlation.
+QC_BLOCK_SIZE = 2 ** 18  # Number of [depth, time] cells evaluated at once by `velocity_qc_kernel`.
+
 
 def no_adcp_quality_control(dataset: xr.Dataset):
     """Adds var_QC ancillary variables to dataset with value 0.
@@ -126,7 +158,12 @@ def adcp_quality_control(
     motion_correction_mode: str = "",
     sidelobes_correction: bool = False,
     bottom_depth: float = None,
-    bad_pressure: bool = False
+    bad_pressure: bool = False,
+    spike_th: float = None,
+    spike_window: int = None,
+    shear_th: float = None,
+    vel_corr_th: float = None,
+    vel_corr_window: int = None,
 ):
     """
     Perform ADCP quality control.
@@ -164,6 +201,18 @@ def adcp_quality_control(
         If not `None`, this depth used for removing side lobe contamination.
     bad_pressure:
         If True, XducerDepth is set to 0 or to `sensor_depth` if provided.
+    spike_th :
+        Require the horizontal velocities be closer than this value to their rolling median (meter per seconds).
+    spike_window :
+        Number of ensembles of the spike test rolling median. Defaults to `SPIKE_WINDOW`.
+    shear_th :
+        Require the vertical shear of the horizontal velocities with at least one adjacent bin
+        be smaller than this value (1/seconds).
+    vel_corr_th :
+        Require the rolling correlation of the horizontal velocities with at least one adjacent
+        bin be greater than this value (-1 to 1).
+    vel_corr_window :
+        Number of ensembles of the rolling correlation. Defaults to `VEL_CORR_WINDOW`.
 
     Notes
     -----
@@ -178,6 +227,8 @@ def adcp_quality_control(
        and the corresponding velocity cells have a flag_value of `3` (probably_bad_value)
        - The amplitude, correlation and percentgood thresholds are also applied to
        sentinelV fifth beam data.
+       - Failing the spike, shear or velocity correlation test returns a flag_value
+       of `3` (probably_bad_value). See `series_test_statistic`.
 
 
        SeaDataNet Quality Control Flags Value
@@ -200,87 +251,68 @@ def adcp_quality_control(
     if motion_correction_mode in ["bt", "nav"]:
         motion_correction(dataset, motion_correction_mode)
 
-    vel_flags = np.ones(dataset.depth.shape + dataset.time.shape).astype(int)
-    binary_mask = np.zeros(dataset.depth.shape + dataset.time.shape).astype(int)
-
     vel_qc_test = []
-    binary_mask_tests_value = [None] * 9
-
-    if amp_th is not None:
-        l.log(f"amplitude threshold {amp_th}")
-        amp_flag = amplitude_test(dataset, amp_th)
-        vel_flags[amp_flag] = 3
-        vel_qc_test.append(f"amplitude_threshold:{amp_th}")
-        binary_mask[amp_flag] += 2 ** 0
-        binary_mask_tests_value[0] = amp_th
-
-    if corr_th is not None:
-        l.log(f"correlation threshold {corr_th}")
-        corr_flag = correlation_test(dataset, corr_th)
-        vel_flags[corr_flag] = 3
-        vel_qc_test.append(f"correlation_threshold:{corr_th}")
-        binary_mask[corr_flag] += 2 ** 1
-        binary_mask_tests_value[1] = corr_th
-
-    if pg_th is not None:
-        l.log(f"percentgood threshold {pg_th}")
-        pg_flag = percentgood_test(dataset, pg_th)
-        vel_flags[pg_flag] = 3
-        vel_qc_test.append(f"percentgood_threshold:{pg_th}")
-        binary_mask[pg_flag] += 2 ** 2
-        binary_mask_tests_value[2] = pg_th
-
-    if horizontal_vel_th is not None:
-        l.log(f"horizontal velocity threshold {horizontal_vel_th} m/s")
-        horizontal_vel_flag = horizontal_vel_test(dataset, horizontal_vel_th)
-        vel_flags[horizontal_vel_flag] = 3
-        vel_qc_test.append(f"horizontal_velocity_threshold:{horizontal_vel_th} m/s")
-        binary_mask[horizontal_vel_flag] += 2 ** 3
-        binary_mask_tests_value[3] = horizontal_vel_th
-
-    if vertical_vel_th is not None:
-        l.log(f"vertical velocity threshold {vertical_vel_th} m/s")
-        vertical_vel_flag = vertical_vel_test(dataset, vertical_vel_th)
-        vel_flags[vertical_vel_flag] = 3
-        vel_qc_test.append(f"vertical_velocity_threshold:{vertical_vel_th} m/s")
-        binary_mask[vertical_vel_flag] += 2 ** 4
-        binary_mask_tests_value[4] = vertical_vel_th
-
-    if error_vel_th is not None:
-        l.log(f"error velocity threshold {error_vel_th} m/s")
-        error_vel_flag = error_vel_test(dataset, error_vel_th)
-        vel_flags[error_vel_flag] = 3
-        vel_qc_test.append(f"velocity_error_threshold:{error_vel_th} m/s")
-        binary_mask[error_vel_flag] += 2 ** 5
-        binary_mask_tests_value[5] = error_vel_th
+    binary_mask_tests_value = [None] * len(BINARY_MASK_TESTS)
+    cell_thresholds = {}
+    time_fails = {}
+    series_tests = {}
+    sidelobe_limit = None
+    bad_time = np.zeros(dataset.time.shape, dtype=bool)
+
+    for bit, (name, threshold, units, qc_test) in enumerate([
+        ("amplitude", amp_th, "", f"amplitude_threshold:{amp_th}"),
+        ("correlation", corr_th, "", f"correlation_threshold:{corr_th}"),
+        ("percentgood", pg_th, "", f"percentgood_threshold:{pg_th}"),
+        ("horizontal velocity", horizontal_vel_th, " m/s", f"horizontal_velocity_threshold:{horizontal_vel_th} m/s"),
+        ("vertical velocity", vertical_vel_th, " m/s", f"vertical_velocity_threshold:{vertical_vel_th} m/s"),
+        ("error velocity", error_vel_th, " m/s", f"velocity_error_threshold:{error_vel_th} m/s"),
+    ]):
+        if threshold is None:
+            continue
+        l.log(f"{name} threshold {threshold}{units}")
+        if all(var in dataset for var in CELL_TESTS_VARIABLES[bit]):
+            cell_thresholds[bit] = threshold
+        else:
+            l.warning(f"{name.capitalize()} test aborted. Missing one or more {CELL_TESTS_VARIABLES[bit][0]} data")
+        vel_qc_test.append(qc_test)
+        binary_mask_tests_value[bit] = threshold
 
     if roll_th is not None:
         l.log(f"roll threshold {roll_th} degree")
-        roll_flag = np.tile(roll_test(dataset, roll_th), dataset.depth.shape + (1,))
-        vel_flags[roll_flag] = 3
+        time_fails[6] = roll_test(dataset, roll_th)
         vel_qc_test.append(f"roll_threshold:{roll_th} degree")
-        binary_mask[roll_flag] += 2 ** 6
         binary_mask_tests_value[6] = roll_th
 
     if pitch_th is not None:
         l.log(f"pitch threshold {pitch_th} degree")
-        pitch_flag = np.tile(pitch_test(dataset, pitch_th), dataset.depth.shape + (1,))
-        vel_flags[pitch_flag] = 3
+        time_fails[7] = pitch_test(dataset, pitch_th)
         vel_qc_test.append(f"pitch_threshold:{pitch_th} degree")
-        binary_mask[pitch_flag] += 2 ** 7
         binary_mask_tests_value[7] = pitch_th
 
+    for bit, (name, threshold, window, units, qc_test) in zip(SERIES_TESTS_BITS, [
+        ("spike", spike_th, spike_window or SPIKE_WINDOW, " m/s",
+         f"spike_threshold:{spike_th} m/s, window:{spike_window or SPIKE_WINDOW} ensembles"),
+        ("shear", shear_th, None, " 1/s", f"shear_threshold:{shear_th} 1/s"),
+        ("velocity correlation", vel_corr_th, vel_corr_window or VEL_CORR_WINDOW, "",
+         f"velocity_correlation_threshold:{vel_corr_th}, window:{vel_corr_window or VEL_CORR_WINDOW} ensembles"),
+    ]):
+        if threshold is None:
+            continue
+        l.log(f"{name} threshold {threshold}{units}" + (f", window {window} ensembles" if window else ""))
+        series_tests[bit] = (threshold, window)
+        vel_qc_test.append(qc_test)
+        binary_mask_tests_value[bit] = threshold
+
     if sidelobes_correction is True:
-        sidelobe_flag, msg = sidelobe_test(dataset, bottom_depth)
-        if isinstance(sidelobe_flag, np.ndarray):
+        depth_limit, msg = sidelobe_depth_limit(dataset, bottom_depth)
+        if isinstance(depth_limit, np.ndarray):
+            sidelobe_limit = depth_limit
             l.log(f"Sidelobe correction carried out. {msg}.")
-            vel_flags[sidelobe_flag] = 3
             vel_qc_test.append("sidelobes")
-            binary_mask[sidelobe_flag] += 2 ** 8
             binary_mask_tests_value[8] = sidelobes_correction
 
     if "pres" in dataset:
-        dataset["pres_QC"] = (["time"], np.ones(dataset.pres.shape))
+        dataset["pres_QC"] = (["time"], np.ones(dataset.pres.shape, dtype=np.uint8))
         if bad_pressure is True:
             l.log("Flag as bad (4) by the user.")
             dataset["pres_QC"].values *= 4
@@ -294,12 +326,12 @@ def adcp_quality_control(
                 f"pressure_threshold: less than {MIN_PRESSURE} dbar and greater than {MAX_PRESSURE} dbar"
             )
 
-            vel_flags[np.tile(pressure_flags, dataset.depth.shape + (1,))] = 3
+            bad_time = pressure_flags
             vel_qc_test.append(dataset["pres_QC"].attrs["quality_test"])
 
     if "temperature" in dataset:
         l.log(f"Good temperature range {MIN_TEMPERATURE} to {MAX_TEMPERATURE} celsius")
-        temperature_QC = np.ones(dataset.temperature.shape)
+        temperature_QC = np.ones(dataset.temperature.shape, dtype=np.uint8)
         temperature_QC[temperature_test(dataset)] = 4
         dataset["temperature_QC"] = (["time"], temperature_QC)
         dataset["temperature_QC"].attrs[
@@ -314,19 +346,21 @@ def adcp_quality_control(
             + "."
         )
         vb_flag = vertical_beam_test(dataset, amp_th, corr_th, pg_th)
-        dataset["vb_vel_QC"] = (["depth", "time"], vb_flag * 3)
+        dataset["vb_vel_QC"] = (["depth", "time"], vb_flag.astype(np.uint8) * 3)
         dataset["vb_vel_QC"].attrs["quality_test"] = (
             f"amplitude_threshold: {amp_th}\n" * ("vb_amp" in dataset)
             + f"correlation_threshold: {corr_th}\n" * ("vb_corr" in dataset)
             + f"percentgood_threshold: {pg_th}\n" * ("vb_pg" in dataset)
         )
 
-    vel_flags[flag_implausible_vel(dataset, threshold=IMPLAUSIBLE_VEL_TRESHOLD)] = 4
-
-    missing_vel = np.bitwise_or(
-        *(~np.isfinite(dataset[v].values) for v in ("u", "v", "w"))
+    vel_flags, binary_mask = velocity_qc_kernel(
+        dataset,
+        cell_thresholds=cell_thresholds,
+        time_fails=time_fails,
+        series_tests=series_tests,
+        sidelobe_limit=sidelobe_limit,
+        bad_time=bad_time,
     )
-    vel_flags[missing_vel] = 9
 
     for v in ("u", "v", "w"):
         dataset[v + "_QC"] = (["depth", "time"], vel_flags)
@@ -342,8 +376,9 @@ def adcp_quality_control(
     dataset.attrs["quality_comments"] = l.logbook[len("[Quality Control]"):]
 
     l.log(f"Quality Control was carried out with {l.w_count} warnings")
-    percent_good_vel = (np.sum(vel_flags == 1) + np.sum(vel_flags == 2)) / (len(dataset.depth) * len(dataset.time))
-    l.log(f"{round(percent_good_vel * 100, 2)}% of the velocities have a flag of 1 or 2.")
+    if not _is_chunked(vel_flags):  # Not computed for chunked data, the flags would be computed twice.
+        percent_good_vel = (np.sum(vel_flags == 1) + np.sum(vel_flags == 2)) / (len(dataset.depth) * len(dataset.time))
+        l.log(f"{round(percent_good_vel * 100, 2)}% of the velocities have a flag of 1 or 2.")
 
     dataset.attrs["logbook"] += l.logbook
 
@@ -353,17 +388,7 @@ def adcp_quality_control(
 
     dataset["binary_mask"] = (["depth", "time"], binary_mask)
 
-    dataset.attrs["binary_mask_tests"] = [
-        "amp",
-        "corr",
-        "pg",
-        "horizontal vel",
-        "vertical vel",
-        "error",
-        "roll",
-        "pitch",
-        "sidelobe",
-    ]
+    dataset.attrs["binary_mask_tests"] = list(BINARY_MASK_TESTS)
     dataset.attrs["binary_mask_tests_values"] = binary_mask_tests_value
 
 
@@ -376,7 +401,7 @@ def motion_correction(dataset: xr.Dataset, mode: str):
     if mode == "bt":
         if all(f"bt_{v}" in dataset for v in ["u", "v", "w"]):
             for field in ["u", "v", "w"]:
-                dataset[field].values -= dataset[f"bt_{field}"].values
+                dataset[field].data = dataset[field].data - dataset[f"bt_{field}"].data
             l.log("Motion correction carried out with bottom track")
         else:
             l.warning(
@@ -389,10 +414,7 @@ def motion_correction(dataset: xr.Dataset, mode: str):
                     velocity_correction = dataset[field + "_ship"].where(np.isfinite(dataset.lon.values), 0)
                 else:
                     velocity_correction = dataset[field + "_ship"]
-                dataset[field] += np.tile(
-                    velocity_correction,
-                    (dataset.depth.size, 1),
-                )
+                dataset[field] += velocity_correction.data.astype(dataset[field].dtype)
             l.log("Motion correction carried out with navigation")
         else:
             l.warning(
@@ -404,57 +426,312 @@ def motion_correction(dataset: xr.Dataset, mode: str):
         )
 
 
-def flag_implausible_vel(
-    dataset: xr.Dataset, threshold: float = 15
-) -> tp.Type[np.array]:
-    """Values greater than `threshold` return True"""
-    return (
-        (dataset.v > threshold) & (dataset.u > threshold) & (dataset.w > threshold)
-    ).data
+def velocity_qc_kernel(
+        dataset: xr.Dataset,
+        cell_thresholds: tp.Dict[int, float] = None,
+        time_fails: tp.Dict[int, np.ndarray] = None,
+        series_tests: tp.Dict[int, tp.Tuple[float, tp.Optional[int]]] = None,
+        sidelobe_limit: np.ndarray = None,
+        bad_time: np.ndarray = None,
+        block_size: int = QC_BLOCK_SIZE,
+) -> tp.Tuple[np.ndarray, np.ndarray]:
+    """Carry out all the velocity tests in a single pass over blocks of ensembles.
 
+    Each block of about `block_size` cells is read once and its flags and binary mask
+    are written in place. The [time] tests are broadcast along depth. The blocks of the
+    time series tests are read with the half window of ensembles before and after them.
 
-def correlation_test(dataset: xr.Dataset, threshold: int):
-    """FIXME
-    Value must be greater than the threshold to be good. (True fails)
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-
-    if all(f"corr{i}" in dataset for i in range(1, 5)):
-        return (
-            (dataset.corr1 < threshold)
-            & (dataset.corr2 < threshold)
-            & (dataset.corr3 < threshold)
-            & (dataset.corr4 < threshold)
-        ).data
-    else:
-        l.warning("Correlation test aborted. Missing one or more corr data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+    If the velocities are chunked (dask) arrays, the flags and binary mask are returned as
+    dask arrays computed chunk by chunk (the chunks of `u` are used instead of `block_size`).
+    The [time] tests results, which may need global statistics (e.g. circular means), are
+    computed beforehand.
+
+    Parameters
+    ----------
+    dataset :
+        ADCP dataset formatted as done by adcp_init.
+    cell_thresholds :
+        Threshold of each [depth, time] test to carry out by binary_mask bit (0 to 5).
+        See `BINARY_MASK_TESTS` and `cell_test_statistic`.
+    time_fails :
+        Results of the [time] tests by binary_mask bit (6: roll, 7: pitch). True fails.
+    series_tests :
+        Threshold and ensembles window of each time series test to carry out by binary_mask
+        bit (9 to 11). See `series_test_statistic`.
+    sidelobe_limit :
+        Sidelobe free depth limit of each ensemble (binary_mask bit 8). See `sidelobe_depth_limit`.
+    bad_time :
+        Ensembles failing a test without binary_mask bit (e.g. pressure). True fails.
+    block_size :
+        Number of cells evaluated at once.
 
+    Returns
+    -------
+    vel_flags :
+        uint8 [depth, time] flags. 1: passed all tests, 3: failed a test, 4: implausible
+        velocity, 9: missing velocity.
+    binary_mask :
+        uint16 [depth, time] bit mask of the failed tests.
+    """
+    cell_thresholds = cell_thresholds or {}
+    series_tests = series_tests or {}
+    time_fails = {bit: np.asarray(fails)[np.newaxis, :] for bit, fails in (time_fails or {}).items()}
+    if sidelobe_limit is not None:
+        sidelobe_limit = np.asarray(sidelobe_limit)[np.newaxis, :]
+    if bad_time is None:
+        bad_time = np.zeros(dataset.time.shape, dtype=bool)
+    bad_time = np.asarray(bad_time)[np.newaxis, :]
+
+    variables = sorted({"u", "v", "w"}.union(*(CELL_TESTS_VARIABLES[bit] for bit in cell_thresholds)))
+    data = {var: dataset[var].data for var in variables}
+    kwargs = dict(
+        variables=variables,
+        bits=list(time_fails),
+        sidelobe=sidelobe_limit is not None,
+        bin_depth=np.asarray(dataset.depth.data)[:, np.newaxis],
+        cell_thresholds=cell_thresholds,
+        series_tests=series_tests,
+        half_bin_size=dataset.attrs.get("bin_size_m", 0) / 2,
+        upward=dataset.attrs.get("orientation") == "up",
+    )
+    time_arrays = [*time_fails.values()] + ([sidelobe_limit] if sidelobe_limit is not None else [])
+    halo = max([(window or 0) // 2 for _, window in series_tests.values()], default=0)
 
-def amplitude_test(dataset: xr.Dataset, threshold: int):
-    """FIXME
-    Value must be greater than the threshold to be good. (True fails)
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-    if all(f"amp{i}" in dataset for i in range(1, 5)):
-        return (
-            (dataset.amp1 < threshold)
-            & (dataset.amp2 < threshold)
-            & (dataset.amp3 < threshold)
-            & (dataset.amp4 < threshold)
-        ).data
-    else:
-        l.warning("Amplitude test aborted. Missing one or more amp data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+    if any(_is_chunked(values) for values in data.values()):
+        return _chunked_velocity_qc(data, time_arrays, bad_time, halo, kwargs)
 
+    shape = dataset.depth.shape + dataset.time.shape
+    vel_flags = np.ones(shape, dtype=np.uint8)
+    binary_mask = np.zeros(shape, dtype=np.uint16)
+    step = max(1, block_size // max(1, shape[0]))
+    for start in range(0, shape[1], step):
+        t = slice(start, start + step)
+        extended = slice(max(0, start - halo), start + step + halo)
+        mask = _binary_mask_block(
+            *(data[var][:, extended] for var in variables),
+            *(values[:, extended] for values in time_arrays),
+            **kwargs,
+        )[:, start - extended.start:][:, :step]
+        binary_mask[:, t] = mask
+        vel_flags[:, t] = _velocity_flags_block(mask, data["u"][:, t], data["v"][:, t], data["w"][:, t], bad_time[:, t])
 
-def percentgood_test(dataset: xr.Dataset, threshold: int):
-    """FIXME
-    Value must be greater than the threshold to be good. (True fails)
-    NOTE JeanLucShaw used absolute but is it needed ?"""
-    if "pg" in dataset:
-        return (dataset.pg < threshold).data
+    return vel_flags, binary_mask
+
+
+def _is_chunked(array) -> bool:
+    """True for dask arrays."""
+    return hasattr(array, "dask")
+
+
+def _chunked_velocity_qc(
+        data: tp.Dict[str, tp.Any], time_arrays: tp.List[np.ndarray], bad_time: np.ndarray, halo: int, kwargs: dict
+):
+    """Map the velocity tests blocks functions on the chunks of the velocities.
+
+    The chunks are overlapped by `halo` ensembles for the time series tests.
+    """
+    import dask.array as da
+
+    time_chunks = da.asarray(data["u"]).chunks[1]
+    arrays = [da.asarray(data[var]).rechunk({0: -1, 1: time_chunks}) for var in kwargs["variables"]]
+    time_arrays = [da.from_array(values, chunks=(1, time_chunks)) for values in time_arrays]
+    bad_time = da.from_array(bad_time, chunks=(1, time_chunks))
+    u, v, w = (arrays[kwargs["variables"].index(var)] for var in "uvw")
+
+    if halo > 0:
+        binary_mask = da.map_overlap(
+            _binary_mask_block, *arrays, *time_arrays, depth={0: 0, 1: halo}, boundary="none",
+            trim=True, align_arrays=False, dtype=np.uint16, **kwargs
+        ).rechunk({1: time_chunks})  # Chunks smaller than the halo are merged by the overlap.
     else:
-        l.warning("Percent Good test aborted. Missing one or more pg data")
-        return np.full(dataset.depth.shape + dataset.time.shape, False)
+        binary_mask = da.map_blocks(_binary_mask_block, *arrays, *time_arrays, dtype=np.uint16, **kwargs)
+    vel_flags = da.map_blocks(_velocity_flags_block, binary_mask, u, v, w, bad_time, dtype=np.uint8)
+    return vel_flags, binary_mask
+
+
+def _binary_mask_block(
+        *arrays: np.ndarray,
+        variables: tp.List[str],
+        bits: tp.List[int],
+        sidelobe: bool,
+        bin_depth: np.ndarray,
+        cell_thresholds: tp.Dict[int, float],
+        series_tests: tp.Dict[int, tp.Tuple[float, tp.Optional[int]]],
+        half_bin_size: float,
+        upward: bool,
+) -> np.ndarray:
+    """Binary mask of a block of ensembles.
+
+    `arrays` are the [depth, time] `variables` blocks followed by the [1, time] blocks of
+    the `bits` time tests results and, if `sidelobe`, of the sidelobe depth limit.
+    """
+    block = {var: np.asarray(values) for var, values in zip(variables, arrays)}
+    time_arrays = arrays[len(variables):]
+    mask = np.zeros(block["u"].shape, dtype=np.uint16)
+
+    for bit, threshold in cell_thresholds.items():
+        statistic, fails_below = cell_test_statistic(block, bit)
+        fails = statistic < threshold if fails_below else statistic > threshold
+        np.bitwise_or(mask, np.uint16(2 ** bit), out=mask, where=fails)
+    for bit, (threshold, window) in series_tests.items():
+        statistic, fails_below = series_test_statistic(block, bit, bin_depth, window)
+        fails = statistic < threshold if fails_below else statistic > threshold
+        np.bitwise_or(mask, np.uint16(2 ** bit), out=mask, where=fails)
+    for bit, fails in zip(bits, time_arrays):
+        np.bitwise_or(mask, np.uint16(2 ** bit), out=mask, where=fails)
+    if sidelobe is True:
+        if upward:
+            fails = bin_depth - half_bin_size < time_arrays[-1]
+        else:
+            fails = bin_depth + half_bin_size > time_arrays[-1]
+        np.bitwise_or(mask, np.uint16(2 ** 8), out=mask, where=fails)
+
+    return mask
+
+
+def _velocity_flags_block(
+        mask: np.ndarray, u: np.ndarray, v: np.ndarray, w: np.ndarray, bad_time: np.ndarray
+) -> np.ndarray:
+    """Velocity flags of a block of ensembles from its binary mask."""
+    u, v, w = np.asarray(u), np.asarray(v), np.asarray(w)
+    flags = np.ones(mask.shape, dtype=np.uint8)
+    flags[(mask != 0) | bad_time] = 3
+    flags[(u > IMPLAUSIBLE_VEL_TRESHOLD) & (v > IMPLAUSIBLE_VEL_TRESHOLD) & (w > IMPLAUSIBLE_VEL_TRESHOLD)] = 4
+    flags[~(np.isfinite(u) & np.isfinite(v) & np.isfinite(w))] = 9
+    return flags
+
+
+def cell_test_statistic(data: tp.Dict[str, np.ndarray], bit: int) -> tp.Tuple[np.ndarray, bool]:
+    """Return the statistic of the [depth, time] test `bit` and if cells fail below the threshold.
+
+    Cells fail if the statistic is below (True) or above (False) the threshold. NaN never fails.
+
+    - amp, corr: maximum of the 4 beams (cells fail if all the beams are below the threshold).
+    - pg: percent good.
+    - horizontal vel: sqrt(u ** 2 + v ** 2).
+    - vertical vel, error: |w|, |e|.
+
+    Parameters
+    ----------
+    data :
+        Arrays of the test variables (see `CELL_TESTS_VARIABLES`).
+    bit :
+        binary_mask bit of the test, 0 to 5.
+    """
+    if bit in (0, 1):
+        beams = [data[var] for var in CELL_TESTS_VARIABLES[bit]]
+        statistic = np.maximum(beams[0], beams[1])
+        for beam in beams[2:]:
+            np.maximum(statistic, beam, out=statistic)
+        return statistic, True
+    if bit == 2:
+        return data["pg"], True
+    if bit == 3:
+        return np.sqrt(data["u"] ** 2 + data["v"] ** 2), False
+    if bit in (4, 5):
+        return np.abs(data[CELL_TESTS_VARIABLES[bit][0]]), False
+    raise ValueError(f"{bit} is not a [depth, time] test binary_mask bit (0 to 5).")
+
+
+def series_test_statistic(
+        data: tp.Dict[str, np.ndarray], bit: int, bin_depth: np.ndarray, window: int = None
+) -> tp.Tuple[np.ndarray, bool]:
+    """Return the statistic of the time series test `bit` and if cells fail below the threshold.
+
+    The statistics are computed on the horizontal velocities of all the bins at once. The
+    rolling windows are centered on each ensemble and truncated at the ends of the data.
+    NaN never fails.
+
+    - spike: sqrt(du ** 2 + dv ** 2) where du and dv are the distances from the rolling medians.
+    - shear: minimum vertical shear with the adjacent bins, sqrt(du ** 2 + dv ** 2) / dz.
+      (cells fail if the shear with all their adjacent bins is above the threshold).
+    - vel correlation: maximum rolling pearson correlation of u or v with the adjacent bins
+      (cells fail if all the correlations are below the threshold).
+
+    Parameters
+    ----------
+    data :
+        [depth, time] arrays of `u` and `v`.
+    bit :
+        binary_mask bit of the test, 9 to 11.
+    bin_depth :
+        [depth, 1] bin depths.
+    window :
+        Number of ensembles of the rolling windows (spike and vel correlation).
+    """
+    u, v = np.asarray(data["u"]), np.asarray(data["v"])
+    if bit == 9:
+        return np.hypot(u - rolling_median(u, window), v - rolling_median(v, window)), False
+    if bit == 10:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shear = np.hypot(np.diff(u, axis=0), np.diff(v, axis=0)) / np.abs(np.diff(bin_depth, axis=0))
+        return np.fmin(_pad_depth(shear, 1, 0), _pad_depth(shear, 0, 1)), False
+    if bit == 11:
+        statistic = np.full(u.shape, np.nan)
+        for values in (u, v):
+            correlation = rolling_correlation(values[:-1], values[1:], window)
+            np.fmax(statistic, _pad_depth(correlation, 1, 0), out=statistic)
+            np.fmax(statistic, _pad_depth(correlation, 0, 1), out=statistic)
+        return statistic, True
+    raise ValueError(f"{bit} is not a time series test binary_mask bit (9 to 11).")
+
+
+def _pad_depth(values: np.ndarray, before: int, after: int) -> np.ndarray:
+    """Pad the [depth - 1, time] adjacent bins statistics with NaN to [depth, time]."""
+    return np.pad(values.astype(float, copy=False), ((before, after), (0, 0)), constant_values=np.nan)
+
+
+def _rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Sums along time of the centered `window` ensembles, in O(n) from a cumulative sum."""
+    length = values.shape[-1]
+    cumsum = np.zeros(values.shape[:-1] + (length + 1,))
+    np.cumsum(values, axis=-1, out=cumsum[..., 1:])
+    # Edge padding truncates the windows at the ends.
+    cumsum = np.pad(cumsum, ((0, 0), (window // 2, window - window // 2)), mode="edge")
+    return cumsum[..., window:window + length] - cumsum[..., :length]
+
+
+def rolling_median(values: np.ndarray, window: int) -> np.ndarray:
+    """Centered rolling median along time (last axis) ignoring NaN.
+
+    The sliding windows of all the bins are sorted at once (NaN last) and the medians are
+    taken at the middle of their valid values. Windows without valid values return NaN.
+    """
+    half = window // 2
+    padded = np.pad(values, ((0, 0), (half, window - half - 1)), constant_values=np.nan)
+    windows = np.sort(np.lib.stride_tricks.sliding_window_view(padded, window, axis=-1), axis=-1)
+    count = _rolling_sum(np.isfinite(values), window).astype(int)[..., np.newaxis]
+    lower = np.take_along_axis(windows, np.maximum(count - 1, 0) // 2, axis=-1)
+    upper = np.take_along_axis(windows, count // 2, axis=-1)
+    median = (lower[..., 0] + upper[..., 0]) / 2
+    median[count[..., 0] == 0] = np.nan
+    return median
+
+
+def rolling_correlation(x: np.ndarray, y: np.ndarray, window: int) -> np.ndarray:
+    """Centered rolling pearson correlation of `x` and `y` along time (last axis).
+
+    Computed in O(n) from the rolling sums of the valid pairs. Windows with less than half
+    their pairs valid or without variance return NaN.
+    """
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = np.where(valid, x, 0).astype(float), np.where(valid, y, 0).astype(float)
+    total = np.maximum(valid.sum(axis=-1, keepdims=True), 1)
+    # Centering on the means reduces the cancellation in the variances.
+    x = np.where(valid, x - x.sum(axis=-1, keepdims=True) / total, 0)
+    y = np.where(valid, y - y.sum(axis=-1, keepdims=True) / total, 0)
+
+    count = _rolling_sum(valid, window)
+    sum_x, sum_y = _rolling_sum(x, window), _rolling_sum(y, window)
+    sum_xx, sum_yy = _rolling_sum(x ** 2, window), _rolling_sum(y ** 2, window)
+    covariance = count * _rolling_sum(x * y, window) - sum_x * sum_y
+    variance_x = count * sum_xx - sum_x ** 2
+    variance_y = count * sum_yy - sum_y ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlation = np.clip(covariance / np.sqrt(variance_x * variance_y), -1, 1)
+    no_variance = (variance_x <= 1e-10 * count * sum_xx) | (variance_y <= 1e-10 * count * sum_yy)
+    correlation[(count <= window // 2) | no_variance] = np.nan
+    return correlation
 
 
 def roll_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
@@ -462,9 +739,7 @@ def roll_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
     Roll conditions (True fails)
     Distance from mean"""
     if "roll_" in dataset:
-        roll_mean = circmean(dataset.roll_.values, low=-180, high=180)
-        roll_from_mean = circular_distance(dataset.roll_.values, roll_mean, units="deg")
-        return roll_from_mean > threshold
+        return distance_from_circular_mean(dataset.roll_.data) > threshold
     else:
         l.warning("Roll test aborted. Missing roll data")
         return np.full(dataset.time.shape, False)
@@ -476,36 +751,29 @@ def pitch_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
     Distance from Mean
     """
     if "pitch" in dataset:
-        pitch_mean = circmean(dataset.pitch.values, low=-180, high=180)
-        pitch_from_mean = circular_distance(
-            dataset.pitch.values, pitch_mean, units="deg"
-        )
-        return pitch_from_mean > threshold
+        return distance_from_circular_mean(dataset.pitch.data) > threshold
 
     else:
         l.warning("Pitch test aborted. Missing pitch data")
         return np.full(dataset.time.shape, False)
 
 
-def horizontal_vel_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-
-    horizontal_velocity = np.sqrt(dataset.u ** 2 + dataset.v ** 2)
-
-    return np.greater(horizontal_velocity.values, threshold)
+def circular_mean(angles: np.ndarray) -> float:
+    """Circular mean (degree) of angles (degree).
 
+    Reduced from the sums of the angles sines and cosines, so chunked (dask) arrays are
+    reduced chunk by chunk. Returns NaN if any angle is NaN.
+    """
+    radians = np.radians(angles)
+    return float(np.degrees(np.arctan2(np.sum(np.sin(radians)), np.sum(np.cos(radians)))))
 
-def vertical_vel_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-    return np.greater(abs(dataset.w.values), threshold)
 
+def distance_from_circular_mean(angles: np.ndarray) -> np.ndarray:
+    """Angular distance (degree) of the angles (degree) from their circular mean.
 
-def error_vel_test(dataset: xr.Dataset, threshold: float) -> tp.Type[np.array]:
-    """FIXME
-    None finite value value will also fail"""
-    return np.greater(abs(dataset.e.values), threshold)
+    The circular mean is reduced first (see `circular_mean`), then the distances are computed.
+    """
+    return circular_distance(np.asarray(angles), circular_mean(angles), units="deg")
 
 
 def vertical_beam_test(
@@ -515,28 +783,27 @@ def vertical_beam_test(
     pg_threshold: float,
 ) -> tp.Type[np.array]:
     """FIXME"""
-    vb_test = np.full(dataset.depth.shape + dataset.time.shape, False)
+    vb_test = np.broadcast_to(False, dataset.depth.shape + dataset.time.shape)
     if "vb_amp" in dataset.variables and amp_threshold:
-        vb_test[dataset.vb_amp < amp_threshold] = True
+        vb_test = vb_test | (dataset.vb_amp.data < amp_threshold)
     if "vb_corr" in dataset.variables and corr_threshold:
-        vb_test[dataset.vb_corr < corr_threshold] = True
+        vb_test = vb_test | (dataset.vb_corr.data < corr_threshold)
     if "vb_pg" in dataset.variables and pg_threshold:
-        vb_test[dataset.vb_pg < pg_threshold] = True
+        vb_test = vb_test | (dataset.vb_pg.data < pg_threshold)
 
     return vb_test
 
 
-def sidelobe_test(dataset: xr.Dataset, bottom_depth: float = None) -> tp.Union[tp.Tuple[np.ndarray, str],
-                                                                               tp.Tuple[bool, None]]:
-    """FIXME
-    Test for sidelobe contamination (True fails).
+def sidelobe_depth_limit(dataset: xr.Dataset, bottom_depth: float = None) -> tp.Union[tp.Tuple[np.ndarray, str],
+                                                                                      tp.Tuple[bool, None]]:
+    """Return the sidelobe free depth limit of each ensemble.
 
-    Returns a boolean array or a False statement if the test cannot be carried out.
+    Returns False statement if it cannot be computed.
 
-    Downward equation:
-        bin_depth + 0.5*bin_size > XducerDepth + (bottom_depth - XducerDepth)*cos(beam_angle)
-    Upward equation:
-        bin_depth - 0.5*bin_size < XducerDepth * ( 1 - cos(beam_angle))
+    Downward (maximum depth):
+        XducerDepth + (bottom_depth - XducerDepth)*cos(beam_angle)
+    Upward (minimum depth):
+        XducerDepth * ( 1 - cos(beam_angle))
 
     Parameters
     ----------
@@ -545,15 +812,14 @@ def sidelobe_test(dataset: xr.Dataset, bottom_depth: float = None) -> tp.Union[t
         Fixed bottom depth to use for sidelobe correction
     Returns
     -------
-    sidelobe_flags : Boolean Array
+    depth_limit : [time] array
     msg :
     """
     msg = ""
     if dataset.attrs["beam_angle"] and dataset.attrs["orientation"]:
         angle_cos = np.cos(np.radians(dataset.attrs["beam_angle"]))
-        depth_array = np.tile(dataset.depth.data, dataset.time.shape + (1,))
         if "xducer_depth" in dataset:
-            xducer_depth = dataset["xducer_depth"].data
+            xducer_depth = np.asarray(dataset["xducer_depth"].data)
             msg += "xducer_depth: time dependent"
         elif "xducer_depth" in dataset.attrs:
             xducer_depth = np.tile(dataset.attrs["xducer_depth"], dataset.time.shape)
@@ -566,7 +832,7 @@ def sidelobe_test(dataset: xr.Dataset, bottom_depth: float = None) -> tp.Union[t
 
         if dataset.attrs["orientation"] == "down":
             if "bt_depth" in dataset:
-                sounding = dataset.bt_depth.data
+                sounding = np.asarray(dataset.bt_depth.data)
                 msg += ", sounding: bottom range"
             elif bottom_depth:
                 sounding = bottom_depth
@@ -577,12 +843,10 @@ def sidelobe_test(dataset: xr.Dataset, bottom_depth: float = None) -> tp.Union[t
                 )
                 return False, None
 
-            max_depth = xducer_depth + (sounding - xducer_depth) * angle_cos
-            return depth_array.T + dataset.attrs["bin_size_m"] / 2 > max_depth, msg
+            return xducer_depth + (sounding - xducer_depth) * angle_cos, msg
 
         elif dataset.attrs["orientation"] == "up":
-            min_depth = xducer_depth * (1 - angle_cos)
-            return depth_array.T - dataset.attrs["bin_size_m"] / 2 < min_depth.T, msg
+            return xducer_depth * (1 - angle_cos), msg
 
         else:
             l.warning(
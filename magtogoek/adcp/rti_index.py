@@ -0,0 +1,194 @@
+"""
+Byte-offset ensemble index for RTI .ENS files.
+
+The ENS files are scanned once with `mmap` to find the ensembles delimiters. For each
+ensemble found, the byte offset, the ensemble length, the ensemble number and the state
+of its checksum are stored in a numpy structured array. The index can be saved as a
+sidecar file (`path/to/file.ENS.idx`) next to the ENS file so that later reads do not
+need to scan the file again.
+
+Usage:
+index = load_ens_index(filename)
+chunk = read_ens_chunk(filename, index[0])
+time = read_ens_time(filename, index[0])
+
+Notes
+-----
+The sidecar file is only used if the size and the modification time of the ENS file
+did not change since the index was made. Otherwise, the file is scanned again and the
+sidecar is overwritten.
+"""
+import binascii
+import mmap
+import struct
+import typing as tp
+from pathlib import Path
+
+import numpy as np
+
+DELIMITER = b"\x80" * 16  # RTB ensemble delimiter
+HEADER_SIZE = 32  # Delimiter + ensemble number (and inverse) + payload size (and inverse)
+CHECKSUM_SIZE = 4
+DATASET_HEADER_SIZE = 28  # 5 int32 (type, num_elements, element_multiplier, image, name_len) + name.
+ENSEMBLE_DATA_NAME = "E000008"
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+ENS_INDEX_DTYPE = np.dtype(
+    [("offset", "i8"), ("length", "i8"), ("ens_num", "u4"), ("checksum_ok", "?")]
+)
+
+
+def build_ens_index(filename: str) -> np.ndarray:
+    """Scan an ENS file in a single pass and return its ensemble index.
+
+    Incomplete ensembles and ensembles failing the checksum are kept in
+    the index with `checksum_ok` set to False.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.ENS
+
+    Returns
+    -------
+    index :
+        Structured array with fields `offset`, `length`, `ens_num`, `checksum_ok`.
+    """
+    entries = []
+    file_size = Path(filename).stat().st_size
+    if file_size == 0:
+        return np.array(entries, dtype=ENS_INDEX_DTYPE)
+
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        buff = memoryview(mm)
+        try:
+            offset = mm.find(DELIMITER)
+            while offset != -1:
+                next_offset, entry = _scan_ensemble(buff, offset, file_size)
+                entries.append(entry)
+                offset = mm.find(DELIMITER, next_offset)
+        finally:
+            buff.release()
+
+    return np.array(entries, dtype=ENS_INDEX_DTYPE)
+
+
+def _scan_ensemble(buff: memoryview, offset: int, file_size: int) -> tp.Tuple[int, tuple]:
+    """Verify the ensemble starting at `offset`.
+
+    Returns the offset where to look for the next delimiter and the index entry.
+    """
+    if offset + HEADER_SIZE + CHECKSUM_SIZE > file_size:
+        return file_size, (offset, file_size - offset, 0, False)
+
+    ens_num, payload_size = struct.unpack_from("<I4xI", buff, offset + len(DELIMITER))
+    length = HEADER_SIZE + payload_size + CHECKSUM_SIZE
+
+    if offset + length > file_size:
+        # Incomplete ensemble. The next delimiter is looked for after this one.
+        return offset + len(DELIMITER), (offset, file_size - offset, ens_num, False)
+
+    payload_start = offset + HEADER_SIZE
+    checksum = struct.unpack_from("<I", buff, payload_start + payload_size)[0]
+    if checksum == binascii.crc_hqx(buff[payload_start: payload_start + payload_size], 0):
+        return offset + length, (offset, length, ens_num, True)
+
+    return offset + len(DELIMITER), (offset, length, ens_num, False)
+
+
+def load_ens_index(filename: str, save: bool = True) -> np.ndarray:
+    """Return the ensemble index of `filename`.
+
+    The sidecar index file is used if it is up to date. Otherwise, the ENS file
+    is scanned and, if `save` is True, the sidecar file is (re)written.
+
+    Parameters
+    ----------
+    filename :
+        path/to/file.ENS
+    save :
+        Write the sidecar index file next to the ENS file.
+    """
+    signature = _file_signature(filename)
+    index_path = get_index_path(filename)
+
+    if index_path.is_file():
+        try:
+            with np.load(index_path) as sidecar:
+                if np.array_equal(sidecar["signature"], signature):
+                    return sidecar["index"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_ens_index(filename)
+
+    if save is True:
+        save_ens_index(filename, index, signature=signature)
+
+    return index
+
+
+def save_ens_index(filename: str, index: np.ndarray, signature: np.ndarray = None):
+    """Write the sidecar index file of `filename`.
+
+    Nothing is written if the directory is not writable.
+    """
+    if signature is None:
+        signature = _file_signature(filename)
+    try:
+        with open(get_index_path(filename), "wb") as f:
+            np.savez(f, index=index, signature=signature)
+    except OSError:
+        pass
+
+
+def get_index_path(filename: str) -> Path:
+    """Return the path of the sidecar index file: path/to/file.ENS.idx"""
+    return Path(str(filename) + INDEX_SUFFIX)
+
+
+def read_ens_chunk(filename: str, entry: np.void) -> bytes:
+    """Read the bytes of the ensemble pointed by an index entry."""
+    with open(filename, "rb") as f:
+        f.seek(int(entry["offset"]))
+        return f.read(int(entry["length"]))
+
+
+def read_ens_time(filename: str, entry: np.void) -> np.datetime64:
+    """Read the date and time of the ensemble pointed by an index entry.
+
+    Only the datasets headers are read until the Ensemble Data dataset (E000008)
+    which contains the date and time. Returns NaT if it is not found.
+    """
+    data = get_dataset(read_ens_chunk(filename, entry), ENSEMBLE_DATA_NAME)
+    if data is None:
+        return np.datetime64("NaT")
+    # ens_num, num_bins, num_beams, desired_ping, actual_ping, status, then the date and time.
+    year, month, day, hour, minute, second, hsec = struct.unpack_from("<7i", data, 24)
+    time = np.datetime64(f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}")
+    return time + np.timedelta64(hsec * 10, "ms")
+
+
+def get_dataset(chunk: bytes, name: str) -> tp.Optional[bytes]:
+    """Return the data (header excluded) of the dataset `name` (e.g. "E000011") of an ensemble chunk.
+
+    Only the datasets headers are read to find the dataset. Returns None if it is not found.
+    """
+    name = name.encode()
+    pointer, end = HEADER_SIZE, len(chunk) - CHECKSUM_SIZE
+    while pointer + DATASET_HEADER_SIZE <= end:
+        ds_type, num_elements, element_multiplier, _, name_len = struct.unpack_from("<5i", chunk, pointer)
+        datatype_size = 1 if ds_type == 50 else 4
+        data_start = pointer + 20 + name_len
+        data_end = data_start + num_elements * element_multiplier * datatype_size
+        if chunk[pointer + 20: pointer + 20 + len(name)] == name:
+            return chunk[data_start: data_end]
+        pointer = data_end
+    return None
+
+
+def _file_signature(filename: str) -> np.ndarray:
+    """File size, modification time (ns) and index version."""
+    stat = Path(filename).stat()
+    return np.array([stat.st_size, stat.st_mtime_ns, INDEX_VERSION], dtype="i8")
@@ -9,30 +9,70 @@ Usage:
 data = RtiReader(filenames).read()
 filenames: path/to/filename or list(path/to/filenames) or path/to/regex.
 
+The ensembles positions in the ENS files are found with a single pass scan and stored
+in a sidecar index file (path/to/file.ENS.idx). See magtogoek.adcp.rti_index.
+
+The ensembles are decoded over multiple processes. Each process receives a range of the
+file index (file path, offsets), reads the ensembles from the file itself and writes the
+decoded values directly into preallocated shared memory arrays.
+
+The ensembles of all the files are decoded in a single pass by one pool of processes, by
+batches of `batch_size` ensembles. `RtiReader.iter_batches` yields the decoded batches so that
+the memory usage is bounded by the batch size:
+for batch in RtiReader(filenames).iter_batches(batch_size=1000):
+    ...
+
+Only the datasets of the optional variables (see OPTIONAL_VARIABLES) passed to RtiReader
+are decoded. The others are jumped over:
+data = RtiReader(filenames, variables=["amp", "cor"]).read()
+
+A time window can be given to read only the ensembles within it. The ensembles times
+are binary searched in the files index so only the ensembles inside the window are decoded:
+data = RtiReader(filenames).read(start_time="2021-01-01T00:00", stop_time="2021-01-08T00:00")
+
 ens.EnsembleData.ActualPingCount # ping_per_ensemble.
 
 """
-from multiprocessing import Pool, cpu_count
+import mmap
+import threading
+from multiprocessing import Pool, cpu_count, resource_tracker, shared_memory
 from pathlib import Path
-from typing import Dict, List, Tuple, Union
+from typing import Collection, Dict, Iterable, Iterator, List, Tuple, Union
 
 import numpy as np
-from scipy.interpolate import griddata
 from scipy.stats import circmean
 from tqdm import tqdm
 
-from magtogoek.adcp.tools import datetime_to_dday
+from magtogoek.adcp.rti_index import get_dataset, load_ens_index, read_ens_chunk, read_ens_time
+from magtogoek.adcp.tools import datetime_to_dday, get_time_window_trims
+from magtogoek.nmea import extract_nmea_fix
+from magtogoek.tools import interpolate_navigation
 from magtogoek.utils import Logger, get_files_from_expression
 from rti_python.Codecs.BinaryCodec import BinaryCodec
 from rti_python.Ensemble.EnsembleData import *
 
-DELIMITER = b"\x80" * 16  # RTB ensemble delimiter
-BLOCK_SIZE = 4096  # Number of bytes read at a time
 RTI_FILL_VALUE = 88.88800048828125
 RDI_FILL_VALUE = -32768.0
 
+BATCH_SIZE = 2000  # Default number of ensembles decoded at once.
+WORK_UNITS_PER_CPU = 4  # Number of ensemble ranges given to each process per batch.
+
+GPS_MAX_GAP = 300  # seconds. Positions are not interpolated between GPS fixes further apart.
+NMEA_DATASET = "E000011"
+
+OPTIONAL_VARIABLES = {  # Bunch variable: RTI datasets names
+    "amp": ("E000004",),  # Amplitude
+    "cor": ("E000005",),  # Correlation
+    "pg": ("E000006", "E000007"),  # Good Beam, Good Earth
+    "bt": ("E000010",),  # Bottom Track
+    "nav": ("E000011",),  # NMEA
+}
+PROFILE_VARIABLES = ("vel", "cor", "amp", "pg")  # [ensemble, bin, beam] variables.
+
 l = Logger(level=0)
 
+_POOL_LOCK = threading.Lock()  # `read_segments` pools are run one at a time, each uses all the cpus.
+
 
 class FilesFormatError(Exception):
     pass
@@ -87,14 +127,19 @@ class RtiReader:
     ----------
     filenames
         path/to/filename or list(path/to/filenames) or path/to/regex
+    variables
+        Optional variables to read. Any of `amp`, `cor`, `pg`, `bt` and `nav`.
+        All are read if None.
+    save_index
+        Write the sidecar index files next to the ENS files.
 
     Methods
     -------
     check_files(self) :
         Prints info about the .ENS files; ensemble counts, number of bin, bin size, etc.
 
-    read(start_index, stop_index) :
-      Return a Bunch object with the read data.
+    read(start_index, stop_index, batch_size, start_time, stop_time, profiles) :
+      Return a Bunch object with the read data of all the files.
 
         Parameters
         ----------
@@ -104,23 +149,46 @@ class RtiReader:
         stop_index :
            Trim trailing chunks by stop_index.
 
+        batch_size :
+           Number of ensembles decoded at once.
+
         Returns
         -------
             data :
+
+    iter_batches(batch_size, start_index, stop_index) :
+      Yield Bunch objects of at most `batch_size` decoded ensembles.
     """
 
-    def __init__(self, filenames: Union[str, List[str]]):
+    def __init__(self, filenames: Union[str, List[str]], variables: Iterable[str] = None, save_index: bool = True):
         """
         Parameters
         ----------
         filenames :
             path/to/filename or list(path/to/filenames) or path/to/regex
+        variables :
+            Optional variables to read. Any of `amp`, `cor`, `pg`, `bt` and `nav`.
+            All are read if None. The RTI datasets of the other optional variables
+            are not decoded.
+        save_index :
+            Write the sidecar index files (see magtogoek.adcp.rti_index) next to the ENS files.
         """
         self.filenames = get_files_from_expression(filenames)
 
+        variables = set(OPTIONAL_VARIABLES) if variables is None else set(variables)
+        if not variables.issubset(OPTIONAL_VARIABLES):
+            raise ValueError(
+                f"Invalid variables: {variables - set(OPTIONAL_VARIABLES)}. Valid variables: {list(OPTIONAL_VARIABLES)}"
+            )
+        self.skip = tuple(
+            name for var in OPTIONAL_VARIABLES if var not in variables for name in OPTIONAL_VARIABLES[var]
+        )
+
         self.start_index = None
         self.stop_index = None
 
+        self.save_index = save_index
+        self.files_index = None
         self.files_ens_count = None
         self.files_start_stop_index = None
         self.ens_chunks = None
@@ -135,15 +203,22 @@ class RtiReader:
 
         for filename in self.filenames:
             self.current_file = filename
-            self.get_ens_chunks()
+            ens_count = len(self.files_index[filename])
+            if ens_count == 0:
+                print("-" * 40)
+                print("File:", Path(filename).name)
+                print("Number of ens:", 0)
+                continue
+            self.get_ens_chunks(start=0, stop=1)
             first_ens = BinaryCodec.decode_data_sets(self.ens_chunks[0][1])
+            self.get_ens_chunks(start=ens_count - 1)
             last_time = BinaryCodec.decode_data_sets(self.ens_chunks[-1][1]).EnsembleData.datetime()
 
             print("-" * 40)
             print("File:", Path(filename).name)
             print("start time:", first_ens.EnsembleData.datetime())
             print("last time:", last_time)
-            print("Number of ens:", len(self.ens_chunks))
+            print("Number of ens:", ens_count)
             print("Number of beams:", first_ens.EnsembleData.NumBeams)
             print("Number of bins:", first_ens.EnsembleData.NumBins)
             print("Binsize:", first_ens.AncillaryData.BinSize)
@@ -151,9 +226,21 @@ class RtiReader:
             print("Beam angle:", _beam_angle(first_ens.EnsembleData.SerialNumber))
             print("Frequency:", int(first_ens.SystemSetup.WpSystemFreqHz), "hz")
 
-    def read(self, start_index: int = None, stop_index: int = None) -> Bunch:
+    def read(
+            self,
+            start_index: int = None,
+            stop_index: int = None,
+            batch_size: int = BATCH_SIZE,
+            start_time: Union[str, np.datetime64] = None,
+            stop_time: Union[str, np.datetime64] = None,
+            profiles: bool = True,
+    ) -> Bunch:
         """Return a Bunch object with the read data.
 
+        The ensembles of all the files are decoded in a single pass by batches and
+        written into arrays allocated for each file. The files Bunch are concatenated
+        once all the files are read.
+
         Parameters
         -----------
         start_index :
@@ -162,10 +249,138 @@ class RtiReader:
         stop_index :
            Trim trailing chunks by stop_index.
 
+        batch_size :
+           Number of ensembles decoded at once.
+
+        start_time :
+           Ensembles before start_time are not read.
+
+        stop_time :
+           Ensembles after stop_time are not read.
+
+        profiles :
+           If False, the profile variables (PROFILE_VARIABLES) are dropped from the decoded
+           batches and the amplitude, correlation and percent good datasets are not decoded.
+           Only the time series and the file level values are read.
+
         Returns
         --------
             data
-        TODO add inline comments
+        """
+        self.set_trims(start_index=start_index, stop_index=stop_index, start_time=start_time, stop_time=stop_time)
+
+        skip = self.skip
+        if profiles is False:
+            skip = (*skip, *(name for var in ("amp", "cor", "pg") for name in OPTIONAL_VARIABLES[var]))
+
+        files_bunch = {filename: self.read_file_header(filename) for filename in self.filenames}
+        positions = dict.fromkeys(self.filenames, 0)
+        ens_count = sum(ppd.ens_count for ppd in files_bunch.values())
+
+        print(f"Reading {len(self.filenames)} file(s)")
+        time0 = datetime.now()
+
+        with _make_pool() as pool, tqdm(total=ens_count) as progress_bar:
+            for filename, batch in self._iter_batches(pool, batch_size, skip):
+                ppd, position = files_bunch[filename], positions[filename]
+                batch_count = len(next(iter(batch.values())))
+                if profiles is False:
+                    batch = {k: v for k, v in batch.items() if k not in PROFILE_VARIABLES}
+                for k, v in batch.items():
+                    if k not in ppd:
+                        ppd[k] = _fill(np.empty((ppd.ens_count,) + v.shape[1:], dtype=v.dtype))
+                    ppd[k][position: position + batch_count] = v
+                positions[filename] += batch_count
+                progress_bar.update(batch_count)
+
+        time1 = datetime.now()
+        print(
+            ens_count,
+            " chuncks read in",
+            round((time1 - time0).total_seconds(), 3),
+            "s",
+        )
+
+        for ppd in files_bunch.values():
+            self.compute_file_values(ppd)
+
+        data: Bunch = self.concatenate_files_bunch(list(files_bunch.values()))
+
+        if "gps_datetime" in data:
+            data.rawnav = self.format_rawnav(data)
+
+        return data
+
+    def iter_batches(
+            self,
+            batch_size: int = BATCH_SIZE,
+            start_index: int = None,
+            stop_index: int = None,
+            start_time: Union[str, np.datetime64] = None,
+            stop_time: Union[str, np.datetime64] = None,
+    ) -> Iterator[Bunch]:
+        """Yield the decoded ensembles by batches of at most `batch_size` ensembles.
+
+        A batch never spans over two files: the ensembles of consecutive files are decoded
+        together by groups of `batch_size` ensembles, but a group is yielded as one batch per
+        file segment. Thus `batch_size` is an upper bound and the batches at the files
+        boundaries are smaller (the remainders are not carried over to the next file).
+        Each batch is a Bunch of arrays with the ensembles
+        along the first dimension and the name of the file (`filename`) the ensembles are from.
+        The beam data are not split (e.g. vel -> vel1,...,vel4) and the file level values
+        (`dep`, `dday`, orientation, etc.) are not computed. See `read` for those.
+
+        Parameters
+        -----------
+        batch_size :
+           Maximum number of ensembles in a batch (upper bound per file segment).
+
+        start_index :
+           Trim leading chunks by start_index.
+
+        stop_index :
+           Trim trailing chunks by stop_index.
+
+        start_time :
+           Ensembles before start_time are not read.
+
+        stop_time :
+           Ensembles after stop_time are not read.
+        """
+        self.set_trims(start_index=start_index, stop_index=stop_index, start_time=start_time, stop_time=stop_time)
+
+        with _make_pool() as pool:
+            for filename, batch in self._iter_batches(pool, batch_size):
+                batch.filename = Path(filename).name
+                yield batch
+
+    def set_trims(
+            self,
+            start_index: int = None,
+            stop_index: int = None,
+            start_time: Union[str, np.datetime64] = None,
+            stop_time: Union[str, np.datetime64] = None,
+    ):
+        """Check the trims, drop empty files and set the files start and stop index.
+
+        The time window [start_time, stop_time] is converted to leading and trailing
+        trims by binary searching the ensembles times. The largest of the index and
+        time trims is used. The time window is not applied if it is outside the files
+        time span.
+
+        Parameters
+        -----------
+        start_index :
+           Trim leading chunks by start_index.
+
+        stop_index :
+           Trim trailing chunks by stop_index.
+
+        start_time :
+           Ensembles before start_time are not read.
+
+        stop_time :
+           Ensembles after stop_time are not read.
         """
         if start_index:
             if start_index < 0:
@@ -185,6 +400,14 @@ class RtiReader:
         if len(self.filenames) == 0:
             raise ValueError("No file left to read. ")
 
+        if start_time is not None or stop_time is not None:
+            leading, trailing = get_time_window_trims(
+                self.files_ens_count, self.get_ens_time, start_time=start_time, end_time=stop_time
+            )
+            self.start_index = max(self.start_index or 0, leading) or None
+            self.stop_index = max(self.stop_index or 0, trailing) or None
+            l.log(f"Time window: {leading} leading and {trailing} trailing ensembles were not read.")
+
         if self.start_index:
             if np.sum(self.files_ens_count) < self.start_index:
                 raise ValueError("Start_index is greater than the number of ensemble.")
@@ -199,41 +422,24 @@ class RtiReader:
 
         self.get_files_start_stop_index()
 
-        files_bunch = []
-        for filename in self.filenames:
-            start, stop = self.files_start_stop_index[filename]
-            self.current_file = filename
-            self.get_ens_chunks()
-            self.ens_chunks = self.ens_chunks[start:stop]
-            files_bunch.append(self.read_file())
-
-        data: Bunch = self.concatenate_files_bunch(files_bunch)
+    def get_ens_time(self, file_number: int, ens_number: int) -> np.datetime64:
+        """Return the time of an ensemble from the file index."""
+        filename = self.filenames[file_number]
+        return read_ens_time(filename, self.files_index[filename][ens_number])
 
-        return data
+    def get_files_index(self):
+        """Load (or make) the ensemble index of each file and keep the valid ensembles."""
+        self.files_index = dict()
+        for filename in self.filenames:
+            index = load_ens_index(filename, save=self.save_index)
+            self.files_index[filename] = index[index["checksum_ok"]]
 
     def get_files_ens_count(self):
-        """Read each files to find the number of ensemble in each file."""
-        self.files_ens_count = []
+        """Get the number of ensemble in each file from the files index."""
+        if self.files_index is None:
+            self.get_files_index()
         self.ens_chunks = []
-
-        for filename in self.filenames:
-            count = 0
-            buff = bytes()
-            with open(filename, "rb") as f:
-                data = f.read(BLOCK_SIZE)
-                while data:
-                    buff += data
-                    if DELIMITER in buff:
-                        chunks = buff.split(DELIMITER)
-                        buff = chunks.pop()
-                        for chunk in chunks:
-                            if BinaryCodec.verify_ens_data(DELIMITER + chunk):
-                                count += 1
-                    data = f.read(BLOCK_SIZE)
-                # check the remaining bytes in buffer
-                if BinaryCodec.verify_ens_data(DELIMITER + buff):
-                    count += 1
-            self.files_ens_count.append(count)
+        self.files_ens_count = [len(self.files_index[filename]) for filename in self.filenames]
 
     def drop_empty_files(self):
         """Drop the files with 0 ensemble from self.filenames"""
@@ -285,51 +491,52 @@ class RtiReader:
                 stop = stop_index
             self.files_start_stop_index[filename] = (start, stop)
 
-    def get_ens_chunks(self):
-        """Read the binary ens file and get ensemble (chunk/ping)
+    def get_ens_chunks(self, start: int = None, stop: int = None):
+        """Read the ensembles (chunk/ping) of the current file using the file index.
 
         makes attributes chunk_list: List[(chunk_idx, chunk)]
 
+        Parameters
+        ----------
+        start :
+            Index of the first ensemble to read.
+        stop :
+            Index of the ensemble where to stop reading.
         """
-        buff = bytes()
-        ii = 0
+        index = self.files_index[self.current_file][start:stop]
         self.ens_chunks = []
 
-        with open(self.current_file, "rb") as f:
-            data = f.read(BLOCK_SIZE)
-            while data:
-                buff += data
-                if DELIMITER in buff:
-                    chunks = buff.split(DELIMITER)
-                    buff = chunks.pop()
-                    for chunk in chunks:
-                        if BinaryCodec.verify_ens_data(DELIMITER + chunk):
-                            self.ens_chunks.append((ii, DELIMITER + chunk))
-                            ii += 1
+        if len(index) == 0:
+            return
 
-                data = f.read(BLOCK_SIZE)
+        with open(self.current_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for ii, (offset, length) in enumerate(zip(index["offset"].tolist(), index["length"].tolist())):
+                self.ens_chunks.append((ii, mm[offset: offset + length]))
 
-            # check the remaining bytes in buffer
-            if BinaryCodec.verify_ens_data(DELIMITER + buff):
-                self.ens_chunks.append((ii, DELIMITER + buff))
-                ii += 1
+    def get_files_read_index(self) -> Dict[str, np.ndarray]:
+        """Return the index entries of the ensembles to read for each file."""
+        files_read_index = dict()
+        for filename in self.filenames:
+            start, stop = self.files_start_stop_index[filename]
+            files_read_index[filename] = self.files_index[filename][start:stop]
+        return files_read_index
 
-    def read_file(self) -> Bunch:
-        """Read data from one RTB .ENS file put them into a Bunch object
+    def read_file_header(self, filename: str) -> Bunch:
+        """Get the `static` data of a RTB .ENS file from its first ensemble to read.
 
         Returns
         -------
         Bunch :
-            bunch with the read data.
+            bunch with the file static data.
 
         """
-        # Get `static` data from the first ensemble.
-        ens = BinaryCodec.decode_data_sets(self.ens_chunks[0][1])
+        index = self.get_files_read_index()[filename]
+        ens = BinaryCodec.decode_data_sets(read_ens_chunk(filename, index[0]), skip=self.skip)
 
         # Get coordinate sizes
         ppd = Bunch()
-        ppd.filename = Path(self.current_file).name
-        ppd.ens_count = len(self.ens_chunks)
+        ppd.filename = Path(filename).name
+        ppd.ens_count = len(index)
 
         ppd.nbin = ens.EnsembleData.NumBins
         ppd.NBeams = ens.EnsembleData.NumBeams
@@ -362,8 +569,17 @@ class RtiReader:
         if ens.IsEarthVelocity:
             ppd.trans = dict(coordsystem="earth")
 
-        # Read chunks and data of ens to ppd.
-        ppd = Bunch(**ppd, **self.read_chunks())
+        return ppd
+
+    def compute_file_values(self, ppd: Bunch):
+        """Compute (in place) the file level values once all the ensembles of a file are read.
+
+        Splits beam data into new individual variable e.g. vel -> vel1,...,vel4,
+        determines the orientation and the bin depths, and computes `dday`.
+        """
+        for k in list(ppd.keys()):
+            if isinstance(ppd[k], np.ndarray) and ppd[k].ndim == 3:
+                ppd.split(k)
 
         # Determine up/down configuration
         mean_roll = circmean(np.radians(ppd.roll))
@@ -382,63 +598,143 @@ class RtiReader:
 
         ppd.dday = datetime_to_dday(ppd["datetime"])
 
-        if "gps_datetime" in ppd:
-            ppd.rawnav = self.format_rawnav(ppd)
-
-        return ppd
-
-    def read_chunks(self) -> Bunch:
-        """Read and decode chunks over multiple process
+    def _iter_batches(
+            self, pool: Pool, batch_size: int, skip: Collection[str] = None
+    ) -> Iterator[Tuple[str, Bunch]]:
+        """Yield (filename, Bunch) of the decoded ensembles of all files.
 
-        Notes
-        -----
-        This could be somewhat faster if the tqdm was removed. It takes ~.25 additional seconds
-        (~5s total) for ~4000 chunks. Exiting the processes to output progress could be time consuming
-        for bigger files.
+        The ensembles of consecutive files are grouped in batches of `batch_size`
+        ensembles which are decoded in a single pass by the pool. A Bunch is yielded
+        for each file segment of a batch. The RTI datasets in `skip` (default: self.skip)
+        are not decoded.
         """
-        # splitting the reading workload on multiple cpu
-        number_of_cpu = cpu_count()
+        skip = self.skip if skip is None else skip
+        segments = []
+        segments_count = 0
+        for filename, index in self.get_files_read_index().items():
+            position = 0
+            while position < len(index):
+                segment = index[position: position + batch_size - segments_count]
+                segments.append((filename, segment))
+                position += len(segment)
+                segments_count += len(segment)
+                if segments_count == batch_size:
+                    yield from zip([f for f, _ in segments], self.read_chunks(pool, segments, skip))
+                    segments, segments_count = [], 0
+        if segments:
+            yield from zip([f for f, _ in segments], self.read_chunks(pool, segments, skip))
 
-        print(f"Reading {self.current_file}")
-        time0 = datetime.now()
-
-        with Pool(number_of_cpu) as p:  # test
-            decoded_chunks = p.starmap(self.decode_chunk, tqdm(self.ens_chunks))  # test
-
-        time1 = datetime.now()
-        print(
-            len(self.ens_chunks),
-            " chuncks read in",
-            round((time1 - time0).total_seconds(), 3),
-            "s",
-        )
+    @staticmethod
+    def read_segments(segments: List[Tuple[str, np.ndarray]], skip: Collection[str] = ()) -> List[Bunch]:
+        """Decode the ensembles of the files segments with a new processes pool. See `read_chunks`.
 
-        # sorting the decoded_chunks with the index position then dropping the index.
-        decoded_chunks.sort()
-        decoded_chunks = [data for _, data in decoded_chunks]
+        Calls from multiple threads (e.g. dask tasks) are run one at a time.
 
-        # Merging bunches into a single one.
-        # Splitting beam data into new individual variable e.g. vel -> vel1,...,vel4
-        ppd = Bunch()
+        Parameters
+        ----------
+        segments :
+            List of (filename, index entries) of the ensembles to decode (e.g. from `get_files_read_index`).
+        skip :
+            Names of the RTI datasets not to decode.
+        """
+        with _POOL_LOCK, _make_pool() as pool:
+            return RtiReader.read_chunks(pool, segments, skip)
 
-        for k in decoded_chunks[0]:
-            chunks = [p[k] for p in decoded_chunks]
-            ppd[k] = np.stack(chunks, axis=0)
+    @staticmethod
+    def read_chunks(pool: Pool, segments: List[Tuple[str, np.ndarray]], skip: Collection[str] = ()) -> List[Bunch]:
+        """Read and decode the ensembles of the files segments over multiple process
+
+        For each segment (filename, index), the first ensemble is decoded to get the
+        layout (shape, dtype) of the decoded variables. An array of shape
+        (ens_count, *layout_shape) is then allocated in shared memory for each variable.
+        The processes are given ranges of the files index, read the ensembles from the
+        files and write the decoded values in the shared arrays. Thus, only the ensembles
+        positions and the arrays layout are passed between processes. The work units
+        of all the segments are given to the pool at once.
+
+        The variables missing from the first ensemble of a segment but found in others are
+        returned by the processes with their layout. They are then decoded in a second pass
+        over the segment, so the layout of a segment is the union of its ensembles variables.
+        Variables missing from an ensemble are left to NaN (NaT for datetimes, 0 for integers).
 
-            if k == "vel":
+        Parameters
+        ----------
+        pool :
+            Processes pool used to decode the ensembles.
+        segments :
+            List of (filename, index entries) of the ensembles to decode.
+        skip :
+            Names of the RTI datasets not to decode.
+        """
+        units_count = max(1, cpu_count() * WORK_UNITS_PER_CPU // len(segments))
+
+        def add_work_units(segment_number: int, layout: Dict[str, tuple]):
+            filename, index = segments[segment_number]
+            for r in np.array_split(np.arange(len(index)), min(len(index), units_count)):
+                work_units.append((filename, index[r[0]: r[-1] + 1][["offset", "length"]], int(r[0]), layout, skip))
+                units_segment.append(segment_number)
+
+        def decode_work_units() -> List[Dict[str, tuple]]:
+            """Decode the work units and return the layout of the variables missing from each segment."""
+            missing_layouts = [{} for _ in segments]
+            for segment_number, missing in zip(units_segment, pool.imap(_decode_ens_range, work_units)):
+                missing_layouts[segment_number].update(missing)
+            return missing_layouts
+
+        layouts, shms, work_units, units_segment = [], [], [], []
+        try:
+            for segment_number, (filename, index) in enumerate(segments):
+                ens_count = len(index)
+                _, template = RtiReader.decode_chunk(0, read_ens_chunk(filename, index[0]), skip)
+                layout = {k: ((ens_count,) + np.shape(v), np.asarray(v).dtype) for k, v in template.items()}
+                shms.append(_create_shared_arrays(layout))
+                layouts.append({k: (shm.name, *layout[k]) for k, shm in shms[-1].items()})
+                add_work_units(segment_number, layouts[-1])
+
+            missing_layouts = decode_work_units()
+
+            work_units, units_segment = [], []
+            for segment_number, missing_layout in enumerate(missing_layouts):
+                if missing_layout:
+                    ens_count = len(segments[segment_number][1])
+                    layout = {k: ((ens_count,) + shape, dtype) for k, (shape, dtype) in missing_layout.items()}
+                    missing_shms = _create_shared_arrays(layout)
+                    shms[segment_number].update(missing_shms)
+                    missing_layout = {k: (shm.name, *layout[k]) for k, shm in missing_shms.items()}
+                    layouts[segment_number].update(missing_layout)
+                    add_work_units(segment_number, missing_layout)
+            if work_units:
+                decode_work_units()
+
+            bunches = []
+            for layout, segment_shms in zip(layouts, shms):
+                ppd = Bunch()
+                for k, (name, shape, dtype) in layout.items():
+                    ppd[k] = np.ndarray(shape, dtype=dtype, buffer=segment_shms[k].buf).copy()
+                bunches.append(ppd)
+        finally:
+            for segment_shms in shms:
+                for shm in segment_shms.values():
+                    shm.close()
+                    shm.unlink()
+
+        for ppd in bunches:
+            # Datetimes are passed as datetime64 between processes.
+            for k in ("datetime", "gps_datetime"):
+                if k in ppd:
+                    ppd[k] = ppd[k].astype(datetime)
+
+            if "vel" in ppd:
                 #  change de vel fill values to the one used by teledyne.
                 ppd.vel[ppd.vel == RTI_FILL_VALUE] = RDI_FILL_VALUE
+            if "bt_vel" in ppd:
+                #  change de vel fill values to the one used by teledyne.
+                ppd.bt_vel[ppd.bt_vel == RTI_FILL_VALUE] = RDI_FILL_VALUE
 
-            if ppd[k].ndim == 3:
-                ppd.split(k)
-        if "bt_vel" in ppd:
-            #  change de vel fill values to the one used by teledyne.
-            ppd.bt_vel[ppd.bt_vel == RTI_FILL_VALUE] = RDI_FILL_VALUE
-
-        return ppd
+        return bunches
 
     @staticmethod
-    def decode_chunk(ii: int, chunk: str) -> Tuple[int, Bunch]:
+    def decode_chunk(ii: int, chunk: str, skip: Collection[str] = ()) -> Tuple[int, Bunch]:
         """Decode single chunk of data.
 
         Parameters
@@ -447,44 +743,54 @@ class RtiReader:
             Index of the chunk in the file. It is passed one with the Bunch
         chunk :
             chunk of binary data containing one ensemble.
+        skip :
+            Names of the RTI datasets not to decode. (See OPTIONAL_VARIABLES)
 
         Notes
         -----
         Correlation are multiplied by 255 to be between 0 and 255 (like RDI).
         Pressure is divided by 10. Pascal to decapascal(like RDI).
+
+        The [bin x beam] datasets are decoded directly into numpy arrays (`as_array=True`).
+        Datetimes are returned as numpy datetime64.
+
+        The NMEA dataset is not decoded by rti_python (pynmea2). The GGA/RMC/ZDA positions
+        and times are extracted with magtogoek.nmea. If the NMEA sentences have no date,
+        the GPS time of day is combined with the ensemble date.
         """
         ppd = Bunch()
 
-        ens = BinaryCodec.decode_data_sets(chunk)
+        nmea = get_dataset(chunk, NMEA_DATASET) if NMEA_DATASET not in skip else None
+        ens = BinaryCodec.decode_data_sets(chunk, as_array=True, skip=(*skip, NMEA_DATASET))
 
         if ens.IsEnsembleData:
-            ppd.datetime = np.array(ens.EnsembleData.datetime())
+            ppd.datetime = np.datetime64(ens.EnsembleData.datetime(), "us")
 
         if ens.IsCorrelation:
-            ppd.cor = np.array(ens.Correlation.Correlation) * 255
+            ppd.cor = np.asarray(ens.Correlation.Correlation, dtype=float) * 255
 
         if ens.IsAmplitude:
-            ppd.amp = np.array(ens.Amplitude.Amplitude)
+            ppd.amp = np.asarray(ens.Amplitude.Amplitude, dtype=float)
         if ens.IsGoodEarth:
-            ppd.pg = np.array(ens.GoodEarth.GoodEarth)
+            ppd.pg = np.asarray(ens.GoodEarth.GoodEarth, dtype=int)
 
         if ens.IsGoodBeam:
-            ppd.pg = np.array(ens.GoodBeam.GoodBeam)
+            ppd.pg = np.asarray(ens.GoodBeam.GoodBeam, dtype=int)
 
         if ens.IsBeamVelocity:
-            ppd.vel = np.array(ens.BeamVelocity.Velocities)
+            ppd.vel = np.asarray(ens.BeamVelocity.Velocities, dtype=float)
 
         if ens.IsInstrumentVelocity:
-            ppd.vel = np.array(ens.InstrumentVelocity.Velocities)
+            ppd.vel = np.asarray(ens.InstrumentVelocity.Velocities, dtype=float)
 
         if ens.IsEarthVelocity:
-            ppd.vel = np.array(ens.EarthVelocity.Velocities)
+            ppd.vel = np.asarray(ens.EarthVelocity.Velocities, dtype=float)
 
         if ens.IsAncillaryData:
             ppd.temperature = ens.AncillaryData.WaterTemp
             ppd.salinity = np.array(ens.AncillaryData.Salinity)
             pressure = np.array(ens.AncillaryData.Pressure) / 10  # pascal to decapascal
-            ppd.VL = np.array(pressure, {"names": ["Pressure"], "formats": [np.float]})
+            ppd.VL = np.array(pressure, {"names": ["Pressure"], "formats": [float]})
             ppd.XducerDepth = np.array(ens.AncillaryData.TransducerDepth)
             ppd.heading = np.array(ens.AncillaryData.Heading)
             ppd.pitch = np.array(ens.AncillaryData.Pitch)
@@ -499,25 +805,39 @@ class RtiReader:
             ppd.bt_cor = np.array(ens.BottomTrack.Correlation) * 255
             ppd.bt_depth = np.array(ens.BottomTrack.Range)
 
-        if ens.IsNmeaData:
-            ppd.longitude = np.array(ens.NmeaData.longitude)
-            ppd.latitude = np.array(ens.NmeaData.latitude)
-            ppd.gps_datetime = np.array(ens.NmeaData.datetime)
+        if nmea is not None:
+            longitude, latitude, time_of_day, date = extract_nmea_fix(nmea)
+            if np.isnat(date) and ens.IsEnsembleData:
+                date = np.datetime64(ens.EnsembleData.datetime().date(), "D")
+            ppd.longitude = np.array(longitude)
+            ppd.latitude = np.array(latitude)
+            ppd.gps_datetime = (date + time_of_day).astype("datetime64[us]")
 
         return ii, ppd
 
     @staticmethod
-    def format_rawnav(data: Bunch) -> Dict:
+    def format_rawnav(data: Bunch, max_gap: float = GPS_MAX_GAP) -> Dict:
         """Format rawnav to pycurent rawnav.
 
-        Interpolates longitude and latitude on adcp dday.
-        """
+        Interpolates longitude and latitude on adcp dday (1-D linear interpolation).
+        Positions are NaN where the GPS fixes are more than `max_gap` seconds apart.
 
-        gps_dday = datetime_to_dday(data.gsp_datetime)
+        Notes
+        -----
+        The NMEA time of day was combined with the ensemble date. GPS times a day
+        off from their ensemble time (midnight crossing) are corrected.
+        """
+        yearbase = data.datetime[0].year
+        gps_time = np.array(data.gps_datetime, dtype="datetime64[us]")
+        gps_dday = (gps_time - np.datetime64(f"{yearbase}-01-01")) / np.timedelta64(1, "D")
+        gps_dday -= np.round(gps_dday - data.dday)
 
+        lon, lat = interpolate_navigation(
+            gps_dday, data.longitude, data.latitude, data.dday, max_gap=max_gap / 86400
+        )
         rawnav = dict(
-            Lon1_BAM4=griddata(gps_dday, data.longitude, data.dday) / (180.0 / 2 ** 31),
-            Lat1_BAM4=griddata(gps_dday, data.latitude, data.dday) / (180.0 / 2 ** 31),
+            Lon1_BAM4=lon / (180.0 / 2 ** 31),
+            Lat1_BAM4=lat / (180.0 / 2 ** 31),
         )
         return rawnav
 
@@ -589,6 +909,89 @@ class RtiReader:
             l.log(f"  {f} : {np.round(d, 3)} meters")
 
 
+def _make_pool() -> Pool:
+    """Return a processes pool sharing the resource tracker of the main process.
+
+    The resource tracker is started before the processes so that they do not start
+    their own, which would try to clean the shared memory blocks when they exit.
+    """
+    resource_tracker.ensure_running()
+    return Pool(cpu_count())
+
+
+def _create_shared_arrays(layout: Dict[str, Tuple[tuple, np.dtype]]) -> Dict[str, shared_memory.SharedMemory]:
+    """Allocate the shared memory blocks for the variables `layout` and set them to their fill value.
+
+    Parameters
+    ----------
+    layout :
+        {variable_name: (shape, dtype)}
+    """
+    shms = dict()
+    for k, (shape, dtype) in layout.items():
+        shms[k] = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        _fill(np.ndarray(shape, dtype=dtype, buffer=shms[k].buf))
+    return shms
+
+
+def _fill(array: np.ndarray) -> np.ndarray:
+    """Set (in place) the values of `array` to their fill value."""
+    if array.dtype.names is not None:
+        for name in array.dtype.names:
+            array[name] = _fill_value(array.dtype[name])
+    else:
+        array[...] = _fill_value(array.dtype)
+    return array
+
+
+def _fill_value(dtype: np.dtype):
+    """Fill value of the decoded arrays."""
+    if dtype.kind == "M":
+        return np.datetime64("NaT")
+    if dtype.kind in "fc":
+        return np.nan
+    return 0
+
+
+def _decode_ens_range(
+        work_unit: Tuple[str, np.ndarray, int, Dict[str, tuple], Collection[str]]
+) -> Dict[str, Tuple[tuple, np.dtype]]:
+    """Decode a range of ensembles and write them in the shared arrays.
+
+    Returns the layout {variable_name: (shape, dtype)} of the decoded variables not in the
+    shared arrays `layout`. Those are not written.
+
+    Parameters
+    ----------
+    work_unit :
+        (filename, index, position, layout, skip):
+            filename: path/to/file.ENS
+            index: index entries (`offset`, `length`) of the ensembles to decode.
+            position: position of the first ensemble in the shared arrays.
+            layout: {variable_name: (shared_memory_name, shape, dtype)}
+            skip: names of the RTI datasets not to decode.
+    """
+    filename, index, position, layout, skip = work_unit
+
+    missing_layout = {}
+    shms = {k: shared_memory.SharedMemory(name=name) for k, (name, _, _) in layout.items()}
+    try:
+        arrays = {k: np.ndarray(shape, dtype=dtype, buffer=shms[k].buf) for k, (_, shape, dtype) in layout.items()}
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for ii, (offset, length) in enumerate(zip(index["offset"].tolist(), index["length"].tolist())):
+                _, ppd = RtiReader.decode_chunk(ii, mm[offset: offset + length], skip)
+                for k in ppd.keys() & arrays.keys():
+                    arrays[k][position + ii] = ppd[k]
+                for k in ppd.keys() - arrays.keys() - missing_layout.keys():
+                    missing_layout[k] = (np.shape(ppd[k]), np.asarray(ppd[k]).dtype)
+        del arrays
+    finally:
+        for shm in shms.values():
+            shm.close()
+
+    return missing_layout
+
+
 def _beam_angle(serial_number):
     """Get the beam angle from the serial number"""
     if serial_number[1] in "12345678DEFGbcdefghi":
@@ -7,14 +7,13 @@ from datetime import datetime
 import numpy as np
 import xarray as xr
 from nptyping import NDArray
-from pandas import Timestamp, to_datetime
+from pandas import Timestamp
 
 
-def dday_to_datetime64(dday: np.ndarray, yearbase: int) -> tp.Tuple[NDArray, NDArray]:
-    """Convert time recorded time to pandas time (np.datetime64[s]).
+def dday_to_datetime64(dday: np.ndarray, yearbase: int) -> NDArray:
+    """Convert time recorded time to numpy time (np.datetime64[s]).
 
-    Replace time coordinates with datetime64 in strftime='%Y-%m-%d %H:%M:%S'
-    Add `time_string` variables to dataset (strftime='%Y-%m-%d %H:%M:%S')
+    The times are truncated to the second.
 
     Parameters
     ----------
@@ -22,32 +21,26 @@ def dday_to_datetime64(dday: np.ndarray, yearbase: int) -> tp.Tuple[NDArray, NDA
     dday:
 
     """
-    start_time = Timestamp(str(yearbase) + "-01-01")
-    time = np.array(
-        to_datetime(dday, unit="D", origin=start_time, utc=True).strftime(
-            "%Y-%m-%d %H:%M:%S"
-        ),
-        dtype="datetime64[s]",
-    )
-    time_string = time.astype(str)
+    nanoseconds = np.round(np.asarray(dday, dtype=np.float64) * 86400e9).astype(np.int64)
+    return np.datetime64(f"{yearbase}-01-01", "s") + (nanoseconds // 10 ** 9).astype("timedelta64[s]")
 
-    return time, time_string
+
+def datetime64_to_string(time: np.ndarray) -> NDArray:
+    """Return the `time_string` (strftime='%Y-%m-%dT%H:%M:%S') of datetime64 values."""
+    return np.datetime_as_string(np.asarray(time, dtype="datetime64[s]"), unit="s")
 
 
 def datetime_to_dday(
-    datetimes: tp.List[tp.Type[datetime]], yearbase: int = None
+    datetimes: tp.Union[tp.List[tp.Type[datetime]], np.ndarray], yearbase: int = None
 ) -> NDArray:
-    """Convert sequence of datetime to an array of dday since yearbase
+    """Convert sequence of datetime (or datetime64) to an array of dday since yearbase
 
     If yearbase is none, default to the year of the first datetime.
     """
-    yearbase = yearbase if yearbase else datetimes[0].year
+    datetimes = np.asarray(datetimes, dtype="datetime64[us]")
+    yearbase = yearbase if yearbase else datetimes[0].astype("datetime64[Y]").astype(int) + 1970
 
-    return (
-        np.array([(t - datetime(yearbase, 1, 1)).total_seconds() for t in datetimes])
-        * 1
-        / (3600 * 24)
-    )
+    return (datetimes - np.datetime64(f"{yearbase}-01-01", "us")) / np.timedelta64(1, "D")
 
 
 def get_datetime_and_count(trim_arg: str):
@@ -74,3 +67,82 @@ def get_datetime_and_count(trim_arg: str):
     else:
         return (None, None)
 
+
+def bisect_times(
+    get_time: tp.Callable[[int], np.datetime64], count: int, time: np.datetime64, side: str = "left"
+) -> int:
+    """Binary search of `time` in a sequence of `count` increasing times.
+
+    Only the times needed by the search are read with `get_time(i)`.
+
+    Returns
+    -------
+    The number of times lower than `time` if `side` is 'left' or
+    lower or equal to `time` if `side` is 'right'.
+    """
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        middle_time = get_time(middle)
+        if middle_time < time or (side == "right" and middle_time == time):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def get_time_window_trims(
+    files_count: tp.List[int],
+    get_time: tp.Callable[[int, int], np.datetime64],
+    start_time: Timestamp = None,
+    end_time: Timestamp = None,
+) -> tp.Tuple[int, int]:
+    """Return the number of leading and trailing ensembles outside [start_time, end_time].
+
+    The files are expected to be ordered in time and their ensemble times to be increasing.
+    Leading and trailing trims of 0 are returned if `start_time` or `end_time` is out of
+    the files time span, like `magtogoek.adcp.process.cut_times` which aborts the slicing.
+
+    Parameters
+    ----------
+    files_count :
+        Number of ensembles in each file.
+    get_time :
+        Function returning the time of an ensemble: get_time(file_number, ensemble_number).
+    start_time :
+        Time of the first ensemble to keep.
+    end_time :
+        Time of the last ensemble to keep.
+    """
+    not_empty = [file_number for file_number, count in enumerate(files_count) if count > 0]
+    if not not_empty:
+        return 0, 0
+    first_time = get_time(not_empty[0], 0)
+    last_time = get_time(not_empty[-1], files_count[not_empty[-1]] - 1)
+    start_time = np.datetime64(start_time) if start_time is not None else None
+    end_time = np.datetime64(end_time) if end_time is not None else None
+
+    if (start_time is not None and start_time > last_time) or (end_time is not None and end_time < first_time):
+        return 0, 0
+
+    leading = 0
+    if start_time is not None:
+        for file_number, count in enumerate(files_count):
+            position = bisect_times(lambda i: get_time(file_number, i), count, start_time, side="left")
+            leading += position
+            if position < count:
+                break
+
+    trailing = 0
+    if end_time is not None:
+        for file_number in reversed(range(len(files_count))):
+            count = files_count[file_number]
+            position = bisect_times(lambda i: get_time(file_number, i), count, end_time, side="right")
+            trailing += count - position
+            if position > 0:
+                break
+
+    if leading + trailing >= sum(files_count):
+        return 0, 0
+
+    return leading, trailing
@@ -0,0 +1,167 @@
+"""
+Batched transformation of the ADCP velocities from beam or xyz coordinates to earth (enu) coordinates.
+
+The beam to xyz matrix and the per-ensemble xyz to enu rotation matrices (heading, pitch, roll)
+are fused into a single [time, 4, 4] matrix which is applied to the [time, depth, beam] velocities
+with one `np.einsum` contraction. The velocities are transformed in place, `chunk_size` ensembles
+at a time, so that only chunk sized temporaries are allocated.
+
+Usage:
+transform_to_earth(data.vel, heading, pitch, roll, beam_angle=20, convex=True, orientation="down")
+
+Notes
+-----
+The transformations follow the Teledyne RDI ADCP Coordinate Transformation manual:
+    Beam to xyz: x = c a (b1 - b2), y = c a (b4 - b3), z = b (b1 + b2 + b3 + b4), e = d (b1 + b2 - b3 - b4)
+        with a = 1 / (2 sin(angle)), b = 1 / (4 cos(angle)), d = a / sqrt(2), c = 1 (convex) or -1 (concave).
+    Xyz to enu: M = H P R (heading, pitch, roll). The roll is increased by 180 degrees for upward
+        looking ADCPs and, if the ADCP is not gimbaled, the pitch is corrected: P = arctan(tan(pitch) cos(roll)).
+
+Cells with a single bad beam use a 3-beam solution: the bad beam is replaced by the value making
+the error velocity null. Cells with more than one bad beam are set to `fill_value`.
+The Sentinel V vertical beam is not transformed since it is already along the vertical axis.
+"""
+import typing as tp
+
+import numpy as np
+
+CHUNK_SIZE = 10000
+VEL_FILL_VALUE = -32768.0
+
+# For each bad beam, the coefficients of the other beams giving a null error velocity.
+THREE_BEAM_SOLUTION = np.array(
+    [[0, -1, 1, 1], [-1, 0, 1, 1], [1, 1, 0, -1], [1, 1, -1, 0]], dtype=float
+)
+
+
+def beam_to_xyz_matrix(beam_angle: float, convex: bool = True) -> np.ndarray:
+    """Return the [4, 4] beam to xyz (x, y, z, error) transformation matrix."""
+    a = 1 / (2 * np.sin(np.deg2rad(beam_angle)))
+    b = 1 / (4 * np.cos(np.deg2rad(beam_angle)))
+    c = 1 if convex else -1
+    d = a / np.sqrt(2)
+    return np.array(
+        [[c * a, -c * a, 0, 0], [0, 0, -c * a, c * a], [b, b, b, b], [d, d, -d, -d]]
+    )
+
+
+def xyz_to_enu_matrices(
+    heading: np.ndarray,
+    pitch: np.ndarray,
+    roll: np.ndarray,
+    orientation: str = "down",
+    gimbal: bool = False,
+) -> np.ndarray:
+    """Return the [time, 4, 4] xyz to enu rotation matrices. The error velocity is unchanged.
+
+    Parameters
+    ----------
+    heading, pitch, roll :
+        Angles in degrees.
+    orientation :
+        Adcp orientation. Either `up` or `down`.
+    gimbal :
+        If False, the pitch is corrected for the roll.
+    """
+    h, p, r = (np.deg2rad(np.asarray(angle, dtype=float)) for angle in (heading, pitch, roll))
+    if not gimbal:
+        p = np.arctan(np.tan(p) * np.cos(r))
+    if orientation == "up":
+        r = r + np.pi
+
+    ch, sh, cp, sp, cr, sr = np.cos(h), np.sin(h), np.cos(p), np.sin(p), np.cos(r), np.sin(r)
+
+    matrices = np.zeros(h.shape + (4, 4))
+    matrices[:, 0, 0] = ch * cr + sh * sp * sr
+    matrices[:, 0, 1] = sh * cp
+    matrices[:, 0, 2] = ch * sr - sh * sp * cr
+    matrices[:, 1, 0] = -sh * cr + ch * sp * sr
+    matrices[:, 1, 1] = ch * cp
+    matrices[:, 1, 2] = -sh * sr - ch * sp * cr
+    matrices[:, 2, 0] = -cp * sr
+    matrices[:, 2, 1] = sp
+    matrices[:, 2, 2] = cp * cr
+    matrices[:, 3, 3] = 1
+    return matrices
+
+
+def transform_to_earth(
+    vel: np.ndarray,
+    heading: np.ndarray = None,
+    pitch: np.ndarray = None,
+    roll: np.ndarray = None,
+    beam_angle: float = None,
+    convex: bool = True,
+    orientation: str = "down",
+    fill_value: float = VEL_FILL_VALUE,
+    chunk_size: int = CHUNK_SIZE,
+    decimals: tp.Optional[int] = 3,
+):
+    """Transform (in place) beam or xyz velocities to enu velocities.
+
+    Parameters
+    ----------
+    vel :
+        Velocities [time, depth, 4] or [time, 4] in beam coordinates if `beam_angle` is given,
+        else in xyz coordinates.
+    heading, pitch, roll :
+        Angles in degrees [time]. If None, the velocities are only transformed to xyz.
+    beam_angle :
+        Beam angle in degrees. Required for velocities in beam coordinates.
+    convex :
+        Beam pattern. False for concave.
+    orientation :
+        Adcp orientation. Either `up` or `down`.
+    fill_value :
+        Value of the bad velocities. NaN are also bad velocities.
+    chunk_size :
+        Number of ensembles transformed at once.
+    decimals :
+        The velocities are rounded to `decimals`. No rounding if None.
+    """
+    profiles = vel if vel.ndim == 3 else vel[:, np.newaxis, :]
+    beam = beam_angle is not None
+
+    to_xyz = beam_to_xyz_matrix(beam_angle, convex) if beam else np.eye(4)
+    to_enu = heading is not None
+
+    for start in range(0, profiles.shape[0], chunk_size):
+        stop = min(start + chunk_size, profiles.shape[0])
+        chunk = profiles[start:stop].astype(float)
+        bad = ~np.isfinite(chunk) | (chunk == fill_value)
+        chunk[bad] = 0
+
+        if beam:
+            bad_count = bad.sum(axis=-1)
+            _three_beam_solution(chunk, bad, bad_count == 1)
+            invalid = bad_count > 1
+        else:
+            invalid = bad[..., :3].any(axis=-1)
+
+        if to_enu:
+            matrices = xyz_to_enu_matrices(
+                heading[start:stop], pitch[start:stop], roll[start:stop], orientation
+            ) @ to_xyz
+            chunk = np.einsum("tij,tdj->tdi", matrices, chunk)
+        elif beam:
+            chunk = np.einsum("ij,tdj->tdi", to_xyz, chunk)
+
+        if decimals is not None:
+            np.round(chunk, decimals=decimals, out=chunk)
+        chunk[invalid] = fill_value
+        if not beam:
+            chunk[..., 3][bad[..., 3]] = fill_value
+        profiles[start:stop] = chunk
+
+
+def _three_beam_solution(chunk: np.ndarray, bad: np.ndarray, three_beam: np.ndarray):
+    """Replace (in place) the bad beam of the `three_beam` cells by the value making the error velocity null.
+
+    The bad beams must be zeroed beforehand.
+    """
+    cells = chunk[three_beam]
+    bad_beam = np.argmax(bad[three_beam], axis=-1)
+    cells[np.arange(len(cells)), bad_beam] = np.einsum(
+        "cj,cj->c", THREE_BEAM_SOLUTION[bad_beam], cells
+    )
+    chunk[three_beam] = cells
@@ -10,7 +10,7 @@ Descriptions:
 Usage:
     $ mtgk config [adcp, platform] [CONFIG_NAME] [OPTIONS]
 
-    $ mtgk process [CONFIG_FILE]
+    $ mtgk process [CONFIG_FILES] [-j JOBS]
 
     $ mtgk quick [adcp, ] [INPUT_FILES] [OPTIONS]
 
@@ -98,7 +98,7 @@ def magtogoek(info, verbosis):
 # --------------------------- #
 @magtogoek.command("process")
 @add_options(common_options)
-@click.argument("config_file", metavar="[config_file]", type=click.Path(exists=True))
+@click.argument("config_files", metavar="[config_files]", nargs=-1, required=True)
 @click.option("--mk-fig/--no-fig",
               type=bool,
               help="""Make figures to inspect the data. Use to overwrite the value in the config_file""",
@@ -106,29 +106,76 @@ def magtogoek(info, verbosis):
 @click.option("--headless",
               is_flag=True,
               help="""Using remotely with no display capability""")
-def process(info, config_file: str, **options):
-    """Process data by reading configfile"""
+@click.option("--profile-report",
+              is_flag=True,
+              help="""Write the wall time, cpu time and memory (RSS) of each processing stage to a json file.""",
+              default=False)
+@click.option("--profile",
+              is_flag=True,
+              help="""Dump the cProfile stats of each processing stage (.prof files).""",
+              default=False)
+@click.option("--force",
+              is_flag=True,
+              help="""Process the data even if the outputs are up-to-date with the inputs and the configuration.""",
+              default=False)
+@click.option("--append",
+              is_flag=True,
+              help="""Only process the ensembles newer than the last time of the existing netcdf output
+              and append them to it.""",
+              default=False)
+@click.option("-j", "--jobs",
+              type=click.IntRange(min=1),
+              help="""Number of files or config files processed in parallel. Figures are not displayed
+              when more than one job is used.""",
+              default=1,
+              show_default=True)
+def process(info, config_files: tp.Tuple[str], **options):
+    """Process data by reading configfiles"""
     # NOTE This could be update as a group with sensor specific command.
     # Doing so would allow the user to pass config options. The load_configfile
     # command is already able to take updated_params options and update de configfile.
     # The same options (or nearly all the same) as for adcp_config could be use.
     from configparser import ParsingError
+    from magtogoek.batch import JobReport, print_jobs_report, run_jobs
     from magtogoek.config_handler import load_configfile
+    from magtogoek.utils import get_files_from_expression
 
     cli_options = {}
     if options['mk_fig'] is not None:
         cli_options['mk_fig'] = options['mk_fig']
+    for option in ['profile_report', 'profile', 'append']:
+        if options[option] is True:
+            cli_options[option] = True
+    headless = options['headless'] or options['jobs'] > 1
 
     try:
-        configuration, sensor_type = load_configfile(config_file, cli_options=cli_options)
-    except (ParsingError, UnicodeDecodeError):
-        print("Failed to open the given configfile.\n mtgk process aborted.")
-        sys.exit()
+        config_files = get_files_from_expression(list(config_files))
+    except FileNotFoundError as error:
+        print(f"{error}\n mtgk process aborted.")
+        sys.exit(1)
+
+    jobs, reports = [], []
+    for config_file in config_files:
+        try:
+            configuration, sensor_type = load_configfile(config_file, cli_options=cli_options)
+        except (ParsingError, UnicodeDecodeError):
+            print(f"Failed to open the given configfile: {config_file}.")
+            reports.append(JobReport(Path(config_file).name, "failed", 0, "Invalid configfile."))
+            continue
+
+        if sensor_type == "adcp":
+            from magtogoek.adcp.process import get_adcp_jobs
+
+            jobs += get_adcp_jobs(configuration, headless=headless, force=options['force'], name=Path(config_file).name)
 
-    if sensor_type == "adcp":
-        from magtogoek.adcp.process import process_adcp
+    if len(jobs) == 1 and not reports:
+        jobs[0].function(*jobs[0].args)
+        return
 
-        process_adcp(configuration, headless=options['headless'])
+    reports += run_jobs(jobs, n_jobs=options['jobs'])
+    print_jobs_report(reports)
+    if any(report.status == "failed" for report in reports):
+        sys.exit(1)
 
 
 # --------------------------- #
@@ -222,6 +269,10 @@ def config_adcp(
 @click.option("--headless",
               is_flag=True,
               help="""Using remotely with no display capability""")
+@click.option("--force",
+              is_flag=True,
+              help="""Process the data even if the outputs are up-to-date with the inputs and the options.""",
+              default=False)
 @click.pass_context
 def quick_adcp(ctx, info, input_files: tuple, sonar: str, yearbase: int, **options: dict):
     """Command to make an quickly process adcp files. The [OPTIONS] can be added
@@ -235,7 +286,8 @@ def quick_adcp(ctx, info, input_files: tuple, sonar: str, yearbase: int, **optio
 
     process_adcp(configuration,
                  drop_empty_attrs=True,
-                 headless=options['headless'])
+                 headless=options['headless'],
+                 force=options['force'])
 
 
 # --------------------------- #
@@ -269,6 +321,52 @@ def navigation(ctx, info, input_files, **options):
     )
 
 
+@compute.command("qc_sweep", context_settings=CONTEXT_SETTINGS)
+@add_options(common_options)
+@click.argument("config_file", metavar="[config_file]", nargs=1, type=click.Path(exists=True), required=True)
+@click.option("--amp", type=click.STRING, default=None, help="Amplitude thresholds. ex: `20,30,40`")
+@click.option("--corr", type=click.STRING, default=None, help="Correlation thresholds.")
+@click.option("--pg", type=click.STRING, default=None, help="Percent good thresholds.")
+@click.option("--horizontal_vel", type=click.STRING, default=None, help="Horizontal velocity thresholds (m/s).")
+@click.option("--vertical_vel", type=click.STRING, default=None, help="Vertical velocity thresholds (m/s).")
+@click.option("--error", type=click.STRING, default=None, help="Error velocity thresholds (m/s).")
+@click.option("--roll", type=click.STRING, default=None, help="Roll thresholds (degree).")
+@click.option("--pitch", type=click.STRING, default=None, help="Pitch thresholds (degree).")
+@click.option("-o", "--output-name", type=click.STRING, default=None,
+              help="Netcdf file for the sweep results (percent flagged and retention by depth).")
+@click.pass_context
+def qc_sweep(ctx, info, config_file, output_name, **options):
+    """Command to evaluate combinations of quality control thresholds on the data of a config file."""
+    from magtogoek.adcp.process import sweep_adcp_thresholds
+    from magtogoek.adcp.qc_sweep import SWEEP_TESTS, sweep_table
+    from magtogoek.config_handler import load_configfile
+
+    thresholds = {}
+    for name in SWEEP_TESTS:
+        if options[name] is not None:
+            try:
+                thresholds[name] = [float(value) for value in options[name].split(",")]
+            except ValueError:
+                raise click.BadParameter(
+                    f"Expected comma separated numbers. Got `{options[name]}`.", param_hint=f"--{name}"
+                )
+    if not thresholds:
+        raise click.UsageError(
+            f"At least one test thresholds must be given: {', '.join('--' + name for name in SWEEP_TESTS)}."
+        )
+
+    configuration, sensor_type = load_configfile(config_file)
+    if sensor_type != "adcp":
+        raise click.UsageError("Threshold sweeps are only available for adcp config files.")
+
+    sweep = sweep_adcp_thresholds(configuration, thresholds)
+    click.echo(sweep_table(sweep))
+    if output_name is not None:
+        output_name = is_valid_filename(output_name, ext=".nc")
+        sweep.to_netcdf(output_name)
+        click.echo(f"qc sweep made -> {Path(output_name).resolve()}")
+
+
 @magtogoek.command('odf2nc', context_settings=CONTEXT_SETTINGS)
 @click.argument('input_files',
                 metavar="[input_files]",
@@ -388,11 +486,12 @@ def _print_arguments(group, parent):
                 "quick":
                     "  adcp".ljust(20, " ") + "Process adcp data.",
 
-                "process": ("  [config_name]".ljust(20, " ")
-                            + "Filename (path/to/file) of the configuration file."),
+                "process": ("  [config_names]".ljust(20, " ")
+                            + "Filenames (path/to/file, or expression) of the configuration files."),
                 "compute":
-                    "  nav".ljust(20, " ")
-                    + "Command to compute u_ship, v_ship, bearing from gsp data.",
+                    '\n'.join(["  nav".ljust(20, " ") + "Command to compute u_ship, v_ship, bearing from gsp data.",
+                               "  qc_sweep".ljust(20, " ") + "Evaluate combinations of adcp quality control thresholds."]),
+                "qc_sweep": "  [config_file]".ljust(20, " ") + "Filename (path/to/file) of the adcp configuration file.",
 
                 "nav": (
                         "  [file_name]".ljust(20, " ")
@@ -430,6 +529,8 @@ def _print_description(group):
             "Command to execute the processing orders from a configuration file. If"
             " relative path where used in the configuration file, they are relative to directory"
             " where the command is called and not where the configuration file is located."
+            " Many configuration files can be given. The files, or the configuration files, are"
+            " processed in parallel with the option `-j/--jobs`."
         ),
         "check": (
             "Print some raw files information. Only available for adcp RTI .ENS files."
@@ -464,6 +565,12 @@ def _print_description(group):
             " `-w`, an averaging window can be use to smooth the computed navigation data."
             " A matplotlib plot is made after each computation."
         ),
+        "qc_sweep": (
+            "Evaluate all the combinations of the given quality control thresholds on the data of"
+            " an adcp configuration file in a single pass. The percent of cells flagged by each"
+            " combination is printed. The tests not swept are carried out with the configuration"
+            " file values. Thresholds are given as comma separated values, e.g. `--amp 20,30,40`."
+        ),
         "platform": "Creates an empty platform.json file",
         "odf2nc": "Converts odf files to netcdf",
         }
@@ -485,7 +592,7 @@ def _print_usage(group, parent):
     if group == "platform":
         click.echo("  mtgk config platform [FILENAME] [OPTIONS]")
     if group == "process":
-        click.echo("  mtgk process [CONFIG_FILE] [OPTIONS]")
+        click.echo("  mtgk process [CONFIG_FILES] [OPTIONS]")
     if group == "quick":
         click.echo("  mtgk quick [adcp, ] [FILENAME,...] [OPTIONS]")
     if group == "adcp":
@@ -499,3 +606,5 @@ def _print_usage(group, parent):
         click.echo("  mtgk check rti [INPUT_FILES] ")
     if group == "nav":
         click.echo("  mtgk compute nav [INPUT_FILES] ")
+    if group == "qc_sweep":
+        click.echo("  mtgk compute qc_sweep [CONFIG_FILE] [--amp, --corr, ... THRESHOLDS] [OPTIONS]")
@@ -275,6 +275,25 @@ def adcp_options(input_files=True, yearbase=True, sonar=True):
             default=True,
             show_default=True,
         ),
+        click.option(
+            "--profile-report",
+            is_flag=True,
+            help="""Write the wall time, cpu time and memory (RSS) of each processing stage to a json file.""",
+            default=False,
+        ),
+        click.option(
+            "--profile",
+            is_flag=True,
+            help="""Dump the cProfile stats of each processing stage (.prof files).""",
+            default=False,
+        ),
+        click.option(
+            "--append",
+            is_flag=True,
+            help="""Only process the ensembles newer than the last time of the existing netcdf output
+        and append them to it.""",
+            default=False,
+        ),
         click.option(
             "--mk-fig/--no-fig",
             help="""Make figures to inspect the data.""",
@@ -294,6 +313,43 @@ def adcp_options(input_files=True, yearbase=True, sonar=True):
             default=True,
             show_default=True,
         ),
+        click.option(
+            "--chunk_size",
+            type=click.INT,
+            help="""Number of ensembles per chunk. The data are read and processed as dask arrays chunked along
+        time. Requires dask (`pip install magtogoek[dask]`).""",
+            nargs=1,
+            default=None,
+        ),
+        click.option(
+            "--float32/--float64",
+            help="""Process the velocities, amplitudes, correlations and percent good in float32.""",
+            default=False,
+            show_default=True,
+        ),
+        click.option(
+            "--checkpoint",
+            type=click.STRING,
+            help="""Directory where the loaded data are cached, or `True` for a `.magtogoek_checkpoints`
+        directory next to the input files. Later runs with the same input files and loading options
+        start from the cached data instead of reading the raw files.""",
+            nargs=1,
+            default=None,
+        ),
+        click.option(
+            "--pd0_reader",
+            type=click.Choice(["pycurrents", "magtogoek"]),
+            help="""Reader used for the RDI pd0 files. `magtogoek` uses the numpy pd0 reader.""",
+            default="pycurrents",
+            show_default=True,
+        ),
+        click.option(
+            "--save_index/--no_save_index",
+            help="""Save the ensembles index of the raw files as sidecar files (`.idx`) next to them.
+        Use --no_save_index for read-only archives.""",
+            default=True,
+            show_default=True,
+        ),
         click.option(
             "--start_time",
             type=click.STRING,
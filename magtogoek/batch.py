@@ -0,0 +1,116 @@
+"""
+Batch execution of independent processing jobs.
+
+A job is a picklable function with its arguments, e.g. the processing of one input file
+or of one configuration file. The jobs are either run one after the other or in parallel
+processes. Each job runs in a fresh spawned process so that the module level `Logger` of
+one job never leaks into another one. The processes are not daemonic, so the jobs can start
+their own processes pools (e.g. the RTI and PD0 readers).
+
+Usage:
+reports = run_jobs([Job("file_0", _process_adcp_data, (pconfig,)), ...], n_jobs=8)
+print_jobs_report(reports)
+"""
+import multiprocessing
+import time
+import traceback
+import typing as tp
+from multiprocessing.connection import Connection, wait
+
+import click
+
+
+class Job(tp.NamedTuple):
+    name: str
+    function: tp.Callable
+    args: tuple = ()
+
+
+class JobReport(tp.NamedTuple):
+    name: str
+    status: str
+    runtime: float
+    error: str = ""
+
+
+def run_jobs(jobs: tp.List[Job], n_jobs: int = 1) -> tp.List[JobReport]:
+    """Run the jobs and return their reports in the same order.
+
+    Parameters
+    ----------
+    jobs :
+        Jobs to run.
+    n_jobs :
+        Number of jobs run in parallel. Jobs are run in the current process if 1.
+    """
+    if n_jobs > 1 and len(jobs) > 1:
+        return _run_jobs_in_processes(jobs, min(n_jobs, len(jobs)))
+    return [_run_job(job) for job in jobs]
+
+
+def _run_jobs_in_processes(jobs: tp.List[Job], n_processes: int) -> tp.List[JobReport]:
+    """Run each job in a new spawned process, `n_processes` jobs at a time.
+
+    A job whose process dies without sending its report (e.g. killed) is reported as failed.
+    """
+    context = multiprocessing.get_context("spawn")
+    reports = [None] * len(jobs)
+    pending = list(enumerate(jobs))
+    running = {}  # {receiver: (job_number, process, start)}
+
+    while pending or running:
+        while pending and len(running) < n_processes:
+            job_number, job = pending.pop(0)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_send_job_report, args=(job, sender), name=job.name)
+            process.start()
+            sender.close()
+            running[receiver] = (job_number, process, time.perf_counter())
+
+        for receiver in wait(list(running)):
+            job_number, process, start = running.pop(receiver)
+            try:
+                reports[job_number] = receiver.recv()
+            except EOFError:
+                reports[job_number] = None
+            receiver.close()
+            process.join()
+            if reports[job_number] is None:
+                reports[job_number] = JobReport(
+                    jobs[job_number].name, "failed", time.perf_counter() - start,
+                    f"The job process died (exit code {process.exitcode})."
+                )
+
+    return reports
+
+
+def _send_job_report(job: Job, sender: Connection):
+    """Run a job and send its report."""
+    sender.send(_run_job(job))
+    sender.close()
+
+
+def _run_job(job: Job) -> JobReport:
+    """Run a job. Errors, `sys.exit` included, are caught and returned in the report."""
+    start = time.perf_counter()
+    try:
+        job.function(*job.args)
+    except (Exception, SystemExit) as error:
+        traceback.print_exc()
+        return JobReport(job.name, "failed", time.perf_counter() - start, repr(error))
+    return JobReport(job.name, "done", time.perf_counter() - start)
+
+
+def print_jobs_report(reports: tp.List[JobReport]):
+    """Print the status and the runtime of each job."""
+    name_width = max([len(report.name) for report in reports] + [len("Job")])
+    click.secho("Jobs report", fg="green")
+    click.echo(f"{'Job'.ljust(name_width)}  {'Status'.ljust(6)}  Runtime")
+    for report in reports:
+        click.secho(
+            f"{report.name.ljust(name_width)}  {report.status.ljust(6)}  {report.runtime:.1f} s"
+            + (f"  {report.error}" if report.error else ""),
+            fg="red" if report.status == "failed" else None,
+        )
+    failed_count = sum(report.status == "failed" for report in reports)
+    click.echo(f"{len(reports) - failed_count} done, {failed_count} failed.")
@@ -0,0 +1,103 @@
+"""
+Checkpoints of intermediate processing datasets.
+
+A checkpoint is a pickled (dataset, logbook) pair stored under a key computed from the input
+files and the options used to make the dataset. A later run with the same files and options
+reads the checkpoint instead of decoding the raw files again.
+
+The input files are identified by their resolved path, size and modification time, so
+editing or replacing a file invalidates its checkpoints. The magtogoek, numpy, pandas and
+xarray versions are also part of the key since the pickled datasets may not be readable by
+other versions of these libraries. A checkpoint that can't be read anyway is skipped
+with a warning and the raw files are read again.
+
+Usage:
+key = checkpoint_key(filenames, options=dict(sonar="wh", yearbase=2021))
+path = Path(directory).joinpath(key).with_suffix(CHECKPOINT_SUFFIX)
+checkpoint = read_checkpoint(path) if path.exists() else None
+if checkpoint is None:
+    ...  # load the dataset
+    write_checkpoint(path, dataset, logbook)
+else:
+    dataset, logbook = checkpoint
+
+Notes
+-----
+Checkpoints are pickle files and must only be read from trusted directories.
+"""
+import hashlib
+import json
+import pickle
+import typing as tp
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from magtogoek.utils import Logger
+from magtogoek.version import VERSION
+
+l = Logger(level=0)
+
+CHECKPOINT_SUFFIX = ".pkl"
+DEFAULT_CHECKPOINT_DIRECTORY = ".magtogoek_checkpoints"
+
+
+def checkpoint_key(filenames: tp.List[str], options: dict) -> str:
+    """Return a sha256 hex digest of the files identity and of the options.
+
+    Parameters
+    ----------
+    filenames :
+        Files read to make the dataset. Missing files are identified by their path only.
+    options :
+        Options used to make the dataset. Values must be json serializable or have a
+        meaningful `str` representation.
+    """
+    files = []
+    for filename in filenames:
+        path = Path(filename).resolve()
+        stat = path.stat() if path.exists() else None
+        files.append([str(path), stat.st_size if stat else None, stat.st_mtime_ns if stat else None])
+
+    content = json.dumps(
+        {
+            "version": VERSION,
+            "libraries": {"numpy": np.__version__, "pandas": pd.__version__, "xarray": xr.__version__},
+            "files": files,
+            "options": options,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def read_checkpoint(path: tp.Union[str, Path]) -> tp.Optional[tp.Tuple[xr.Dataset, str]]:
+    """Return the dataset and the logbook of a checkpoint.
+
+    Returns None, with a warning, if the checkpoint can't be read (e.g. truncated file, other
+    content or made with other versions of the libraries). The raw files should then be read again.
+    """
+    try:
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        return checkpoint["dataset"], checkpoint["logbook"]
+    except Exception as error:
+        l.warning(f"Checkpoint {path} could not be read ({error!r}). Loading the raw files.")
+        return None
+
+
+def write_checkpoint(path: tp.Union[str, Path], dataset: xr.Dataset, logbook: str = ""):
+    """Write a checkpoint. The parent directories are created if needed.
+
+    Lazy (dask) variables are computed first so that the checkpoint holds the data and not a
+    task graph reading the raw files again. The file is written under a temporary name and
+    then renamed so that an interrupted run never leaves a partial checkpoint.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"dataset": dataset.compute(), "logbook": logbook}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
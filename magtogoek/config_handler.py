@@ -210,6 +210,8 @@ def get_config_taskparser(sensor_type: Optional[str] = None):
         tparser.add_option(section, "yearbase", dtypes=["int"], default="", is_required=True)
         tparser.add_option(section, "adcp_orientation", dtypes=["str"], default="down", choice=["up", "down"], comments='up or down')
         tparser.add_option(section, "sonar", dtypes=["str"], choice=["wh", "sv", "os", "sw", "sw_pd0"], comments='[wh, sv, os, sw, sw_pd0, ]', is_required=True)
+        tparser.add_option(section, "pd0_reader", dtypes=["str"], default="pycurrents", choice=["pycurrents", "magtogoek"], comments='[pycurrents, magtogoek].')
+        tparser.add_option(section, "save_index", dtypes=["bool"], default=True, null_value=True, comments='Save the ensembles index files next to the raw files.')
         tparser.add_option(section, "navigation_file", dtypes=["str"], default="", is_file=True)
         tparser.add_option(section, "leading_trim", dtypes=["int", "str"], default="", is_time_stamp=True)
         tparser.add_option(section, "trailing_trim", dtypes=["int", "str"], default="", is_time_stamp=True)
@@ -223,6 +225,9 @@ def get_config_taskparser(sensor_type: Optional[str] = None):
         tparser.add_option(section, "time_step", dtypes=["float"], default="")
         tparser.add_option(section, "grid_depth", dtypes=["str"], default="", null_value=None, comments='Path to column grid file (m).', is_path=True)
         tparser.add_option(section, "grid_method", dtypes=["str"], default="interp", choice=["interp", "bin"], comments='[interp, bin].')
+        tparser.add_option(section, "chunk_size", dtypes=["int"], default="", comments='Number of ensembles per chunk (dask).')
+        tparser.add_option(section, "float32", dtypes=["bool"], default=False, null_value=False, comments='Process the velocities and beam data in float32.')
+        tparser.add_option(section, "checkpoint", dtypes=["str", "bool"], default="", is_path=True, null_value=False, comments='Checkpoint directory or True.')
 
         section = "ADCP_QUALITY_CONTROL"
         tparser.add_option(section, "quality_control", dtypes=["bool"], default=True, null_value=False)
@@ -236,6 +241,11 @@ def get_config_taskparser(sensor_type: Optional[str] = None):
         tparser.add_option(section, "bottom_depth", dtypes=["float"])
         tparser.add_option(section, "pitch_threshold", dtypes=["int"], default=20, value_min=0, value_max=180, comments='Value between 0 and 180.')
         tparser.add_option(section, "roll_threshold", dtypes=["int"], default=20, value_min=0, value_max=180, comments='Value between 0 and 180.')
+        tparser.add_option(section, "spike_threshold", dtypes=["float"], comments='Upper limit (m/s) of the distance from the rolling median.')
+        tparser.add_option(section, "spike_window", dtypes=["int"], default=5, comments='Number of ensembles.')
+        tparser.add_option(section, "shear_threshold", dtypes=["float"], comments='Upper limit (1/s) of the vertical shear.')
+        tparser.add_option(section, "velocity_correlation_threshold", dtypes=["float"], comments='Value between -1 and 1.')
+        tparser.add_option(section, "velocity_correlation_window", dtypes=["int"], default=15, comments='Number of ensembles.')
         tparser.add_option(section, "motion_correction_mode", dtypes=["str"], default="bt", choice=["bt", "nav", "off"], comments='[bt, nav, off, ].')
 
         section = "ADCP_OUTPUT"
@@ -248,6 +258,9 @@ def get_config_taskparser(sensor_type: Optional[str] = None):
         tparser.add_option(section, "odf_data", dtypes=["str"], default="both", choice=["vel", "anc", "both"], comments='One of [vel, anc, both,].')
         tparser.add_option(section, "make_figures", dtypes=["bool", "str"], default=True, null_value=False)
         tparser.add_option(section, "make_log", dtypes=["bool"], default=True, null_value=False)
+        tparser.add_option(section, "append", dtypes=["bool"], default=False, null_value=False, comments='Append the new ensembles to the existing netcdf output.')
+        tparser.add_option(section, "profile_report", dtypes=["bool"], default=False, null_value=False, comments='Write the stages timing and memory to a json file.')
+        tparser.add_option(section, "profile", dtypes=["bool"], default=False, null_value=False, comments='Dump the cProfile stats of each stage.')
 
     return tparser
 
@@ -0,0 +1,69 @@
+"""
+Processing manifests used to skip the reprocessing of unchanged data.
+
+A manifest is a json file written next to the outputs of a processing. It holds the processing
+hash and the outputs made with their size and modification time. The processing hash covers
+the input files (path, size and modification time), the configuration, the platform metadata
+and the magtogoek, numpy, pandas and xarray versions (see `magtogoek.checkpoint.checkpoint_key`).
+
+A processing is up-to-date if its manifest has the same hash and if all the outputs listed
+are still there, unmodified.
+
+Usage:
+processing_hash = checkpoint_key(filenames, options=config)
+if not is_up_to_date(manifest_path, processing_hash):
+    ...  # process
+    write_manifest(manifest_path, processing_hash, outputs=[netcdf_path, log_path])
+"""
+import json
+import typing as tp
+from pathlib import Path
+
+from magtogoek.version import VERSION
+
+
+def _file_signature(path: Path) -> tp.Optional[tp.List[int]]:
+    if not path.is_file():
+        return None
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def write_manifest(path: tp.Union[str, Path], processing_hash: str, outputs: tp.List[tp.Union[str, Path]]):
+    """Write the manifest of a processing.
+
+    Parameters
+    ----------
+    path :
+        Manifest filename.
+    processing_hash :
+        Hash of the processing inputs.
+    outputs :
+        Output files made by the processing.
+    """
+    manifest = {
+        "processing_hash": processing_hash,
+        "version": VERSION,
+        "outputs": {str(Path(output).resolve()): _file_signature(Path(output)) for output in outputs},
+    }
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def is_up_to_date(path: tp.Union[str, Path], processing_hash: str) -> bool:
+    """Return True if the manifest exists, has the same hash and all its outputs are unchanged."""
+    path = Path(path)
+    if not path.is_file():
+        return False
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return False
+
+    if manifest.get("processing_hash") != processing_hash or not manifest.get("outputs"):
+        return False
+    return all(
+        signature is not None and _file_signature(Path(output)) == signature
+        for output, signature in manifest["outputs"].items()
+    )
@@ -17,9 +17,9 @@ from pathlib import Path
 
 import gpxpy
 import numpy as np
-import pynmea2
 import xarray as xr
 import matplotlib.pyplot as plt
+from magtogoek.nmea import iter_nmea_sentences, parse_gga, parse_zda
 from magtogoek.tools import get_gps_bearing, vincenty
 from magtogoek.utils import get_files_from_expression
 
@@ -114,16 +114,24 @@ def _read_gpx(filename: str) -> tp.Dict:
 def _read_nmea(filename: str) -> tp.Dict:
     """Load navigation data `lon`, `lat` and `time` from a NMEA file.
     Returns a dictionary with the loaded data.
+
+    Sentences with an invalid checksum are ignored. GGA sentences without a fix give NaN.
     """
     gps_data = dict(time=[], lon=[], lat=[])
-    with open(filename, "r") as f:
-        for line in f.readlines():
-            m = pynmea2.parse(line)
-            if m.sentence_type == "GGA":
-                gps_data["lon"].append(m.longitude)
-                gps_data["lat"].append(m.latitude)
-            if m.sentence_type == "ZDA":
-                gps_data["time"].append(np.datetime64(m.datetime.replace(tzinfo=None)))
+    with open(filename, "rb") as f:
+        for sentence_type, fields in iter_nmea_sentences(f.read()):
+            if sentence_type == b"GGA":
+                try:
+                    fix = parse_gga(fields)
+                except ValueError:
+                    fix = None
+                gps_data["lon"].append(fix[0] if fix is not None else np.nan)
+                gps_data["lat"].append(fix[1] if fix is not None else np.nan)
+            if sentence_type == b"ZDA":
+                try:
+                    gps_data["time"].append(parse_zda(fields))
+                except ValueError:
+                    gps_data["time"].append(np.datetime64("NaT", "ms"))
     return gps_data
 
 
@@ -0,0 +1,193 @@
+"""
+Append new records along the unlimited `time` dimension of an existing netcdf file.
+
+The new records are encoded like the existing variables (dtype, _FillValue, scale_factor,
+time units, ...) and written to a temporary netcdf file by xarray. Their raw values are then
+copied at the end of the existing variables with netCDF4, so the existing records are neither
+read nor rewritten and the cost of an append only depends on the number of new records.
+
+The `data_min`/`data_max` variables attributes, the `time_coverage_*` and `geospatial_*`
+global attributes are updated from the existing values and the ones of the new records.
+
+Usage:
+last_time = get_last_time(netcdf_path)
+dataset = dataset.sel(time=dataset.time > last_time)
+append_to_netcdf(netcdf_path, dataset)
+
+Notes
+-----
+The time dimension of the existing file must be unlimited (see `xarray.Dataset.to_netcdf`
+`unlimited_dims`) and its other dimensions (e.g. `depth`) must be identical to the
+new records ones.
+"""
+import typing as tp
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+from magtogoek.utils import Logger
+
+l = Logger(level=0)
+
+TIME_DIM = "time"
+ENCODING_KEYS = ["dtype", "_FillValue", "scale_factor", "add_offset", "units", "calendar"]
+
+
+def get_last_time(path: tp.Union[str, Path]) -> np.datetime64:
+    """Return the last time of the existing netcdf file."""
+    with xr.open_dataset(path) as dataset:
+        return dataset[TIME_DIM].data[-1]
+
+
+def get_coordinate(path: tp.Union[str, Path], name: str) -> np.ndarray:
+    """Return the values of the coordinate `name` of the existing netcdf file."""
+    with xr.open_dataset(path) as dataset:
+        return dataset[name].values
+
+
+def append_to_netcdf(path: tp.Union[str, Path], dataset: xr.Dataset):
+    """Append the records of `dataset` at the end of the time dimension of the netcdf file `path`.
+
+    Parameters
+    ----------
+    path :
+        Existing netcdf file with an unlimited time dimension.
+    dataset :
+        New records. Its times must be after the last time of the existing file.
+
+    Raises
+    ------
+    ValueError :
+        The time dimension of the existing file is not unlimited, the new records are not after
+        the existing ones or the other dimensions of the new records do not match the existing ones.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.stem + "_append.tmp.nc")
+    with xr.open_dataset(path) as existing:
+        if dataset[TIME_DIM].data[0] <= existing[TIME_DIM].data[-1]:
+            raise ValueError(f"The new records must be after the last time of {path}.")
+        _check_dimensions(existing, dataset)
+        dataset = _copy_encoding(existing, dataset)
+    try:
+        dataset.to_netcdf(tmp_path, unlimited_dims=[TIME_DIM])
+        with netCDF4.Dataset(path, "a") as dst, netCDF4.Dataset(tmp_path, "r") as src:
+            if not dst.dimensions[TIME_DIM].isunlimited():
+                raise ValueError(f"The time dimension of {path} is not unlimited. Records cannot be appended.")
+            dst.set_auto_maskandscale(False)
+            src.set_auto_maskandscale(False)
+            existing_count = len(dst.dimensions[TIME_DIM])
+            new_count = len(src.dimensions[TIME_DIM])
+            _append_variables(dst, src, existing_count)
+            _update_variables_attrs(dst, src)
+            _update_global_attrs(dst, src, existing_count, new_count)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _check_dimensions(existing: xr.Dataset, dataset: xr.Dataset):
+    """Checks that the coordinates other than time are identical."""
+    for coord in set(dataset.coords).difference({TIME_DIM}):
+        if coord not in existing.coords or dataset[coord].dims != existing[coord].dims:
+            raise ValueError(f"The new records coordinate `{coord}` is not in the existing file.")
+        if TIME_DIM in dataset[coord].dims:
+            continue
+        if dataset[coord].shape != existing[coord].shape or not np.allclose(
+                dataset[coord].data, existing[coord].data, equal_nan=True
+        ):
+            raise ValueError(f"The new records coordinate `{coord}` differs from the existing one.")
+
+
+def _copy_encoding(existing: xr.Dataset, dataset: xr.Dataset) -> xr.Dataset:
+    """Returns `dataset` with the encoding of the existing variables so their raw values match."""
+    dataset = dataset.copy()
+    for var in set(dataset.variables).intersection(existing.variables):
+        encoding = {key: existing[var].encoding[key] for key in ENCODING_KEYS if key in existing[var].encoding}
+        if np.issubdtype(dataset[var].dtype, np.datetime64) and "units" in encoding:
+            _check_time_encoding(dataset[var].data, encoding)
+        dataset[var].encoding = encoding
+    return dataset
+
+
+def _check_time_encoding(times: np.ndarray, encoding: dict):
+    """Checks that the times can be encoded without rounding in the existing integer time units."""
+    if not np.issubdtype(np.dtype(encoding.get("dtype", float)), np.integer):
+        return
+    unit, reference = encoding["units"].split(" since ")
+    step = pd.Timedelta(1, unit=unit.strip())
+    if ((pd.DatetimeIndex(times) - pd.Timestamp(reference).tz_localize(None)) % step != pd.Timedelta(0)).any():
+        raise ValueError(
+            f"The existing times are integers in `{encoding['units']}`. "
+            "The new times cannot be appended without rounding."
+        )
+
+
+def _append_variables(dst: netCDF4.Dataset, src: netCDF4.Dataset, start: int):
+    """Copies the raw values of the `src` time variables at the index `start` of the `dst` variables."""
+    for name, variable in src.variables.items():
+        if TIME_DIM not in variable.dimensions:
+            continue
+        if name not in dst.variables or dst.variables[name].dimensions != variable.dimensions:
+            l.warning(f"`{name}` is not in the existing file or has different dimensions. It was not appended.")
+            continue
+        index = tuple(
+            slice(start, start + len(src.dimensions[TIME_DIM])) if dim == TIME_DIM else slice(None)
+            for dim in variable.dimensions
+        )
+        # The char arrays (e.g. time_string) are copied as raw characters.
+        variable.set_auto_chartostring(False)
+        dst.variables[name].set_auto_chartostring(False)
+        dst.variables[name][index] = variable[:]
+
+
+def _update_variables_attrs(dst: netCDF4.Dataset, src: netCDF4.Dataset):
+    """Combines the `data_min` and `data_max` attributes."""
+    for name, variable in src.variables.items():
+        if name not in dst.variables:
+            continue
+        for attr, func in [("data_min", np.fmin), ("data_max", np.fmax)]:
+            if attr in variable.ncattrs():
+                value = variable.getncattr(attr)
+                if attr in dst.variables[name].ncattrs():
+                    value = func(dst.variables[name].getncattr(attr), value)
+                dst.variables[name].setncattr(attr, value)
+
+
+def _update_global_attrs(dst: netCDF4.Dataset, src: netCDF4.Dataset, existing_count: int, new_count: int):
+    """Updates the time coverage and geospatial global attributes.
+
+    `latitude` and `longitude` are averaged weighted by the records counts. A line
+    is added to the `history`.
+    """
+    dst_attrs, src_attrs = dst.__dict__, src.__dict__
+
+    for attr in ["geospatial_lat_min", "geospatial_lon_min", "geospatial_vertical_min"]:
+        if attr in src_attrs:
+            dst.setncattr(attr, np.fmin(dst_attrs.get(attr, np.nan), src_attrs[attr]))
+    for attr in ["geospatial_lat_max", "geospatial_lon_max", "geospatial_vertical_max"]:
+        if attr in src_attrs:
+            dst.setncattr(attr, np.fmax(dst_attrs.get(attr, np.nan), src_attrs[attr]))
+    for attr in ["latitude", "longitude"]:
+        if isinstance(dst_attrs.get(attr), (float, np.floating)) and isinstance(
+                src_attrs.get(attr), (float, np.floating)
+        ):
+            mean = (dst_attrs[attr] * existing_count + src_attrs[attr] * new_count) / (existing_count + new_count)
+            dst.setncattr(attr, round(mean, 4))
+
+    if "time_coverage_end" in src_attrs:
+        dst.setncattr("time_coverage_end", src_attrs["time_coverage_end"])
+        if "time_coverage_start" in dst_attrs:
+            duration = np.datetime64(src_attrs["time_coverage_end"]) - np.datetime64(dst_attrs["time_coverage_start"])
+            dst.setncattr("time_coverage_duration", np.round(duration / np.timedelta64(1, "D"), 3))
+
+    if "date_modified" in src_attrs:
+        dst.setncattr("date_modified", src_attrs["date_modified"])
+
+    if "history" in dst_attrs:
+        dst.setncattr(
+            "history",
+            dst_attrs["history"]
+            + f"[Append] {pd.Timestamp.now().strftime('%Y-%m-%d %Hh%M:%S')} {new_count} records appended "
+            + f"({src_attrs.get('time_coverage_start', '')} to {src_attrs.get('time_coverage_end', '')}).\n",
+        )
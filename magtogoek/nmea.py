@@ -0,0 +1,125 @@
+"""
+Lightweight NMEA extractor for the GGA, RMC and ZDA sentences.
+
+The sentences are found with a precompiled bytes pattern and their checksums are validated.
+Only the positions, times and dates are extracted and returned as floats and numpy datetime64
+and timedelta64. Use `pynmea2` when the other fields or sentences are needed.
+
+Usage:
+lon, lat, time_of_day, date = extract_nmea_fix(b"$GPGGA,...*hh\\r\\n$GPZDA,...*hh")
+
+Notes
+-----
+GGA: time, latitude, N/S, longitude, E/W, fix quality, ...
+RMC: time, status, latitude, N/S, longitude, E/W, speed, course, date (ddmmyy), ...
+ZDA: time, day, month, year, ...
+"""
+import re
+import typing as tp
+from functools import reduce
+from operator import xor
+
+import numpy as np
+
+SENTENCE_PATTERN = re.compile(
+    rb"\$(?P<body>[A-Z]{2}(?P<type>GGA|RMC|ZDA),(?P<fields>[^$*\r\n]*))\*(?P<checksum>[0-9A-Fa-f]{2})"
+)
+
+NAT = np.datetime64("NaT", "D")
+TIME_NAT = np.timedelta64("NaT", "ms")
+
+
+def nmea_checksum(body: bytes) -> int:
+    """XOR of the bytes between `$` and `*`."""
+    return reduce(xor, body, 0)
+
+
+def iter_nmea_sentences(data: bytes) -> tp.Iterator[tp.Tuple[bytes, tp.List[bytes]]]:
+    """Yield the sentence type and the fields of the GGA, RMC and ZDA sentences with a valid checksum."""
+    for match in SENTENCE_PATTERN.finditer(data):
+        if nmea_checksum(match["body"]) == int(match["checksum"], 16):
+            yield match["type"], match["fields"].split(b",")
+
+
+def extract_nmea_fix(data: bytes) -> tp.Tuple[float, float, np.timedelta64, np.datetime64]:
+    """Extract the position, the time of day and the date from NMEA sentences.
+
+    The position and time are taken from the first valid GGA sentence or, if there is
+    none, from the first valid RMC sentence. The date is taken from the first RMC or ZDA
+    sentence.
+
+    Returns
+    -------
+    longitude, latitude, time_of_day, date :
+        NaN, NaT if not found.
+    """
+    gga_fix, rmc_fix, date = None, None, NAT
+    for sentence_type, fields in iter_nmea_sentences(data):
+        try:
+            if sentence_type == b"GGA":
+                if gga_fix is None:
+                    gga_fix = parse_gga(fields)
+            elif sentence_type == b"RMC":
+                if rmc_fix is None:
+                    rmc_fix = parse_rmc(fields)
+                if np.isnat(date) and len(fields) > 8 and len(fields[8]) == 6:
+                    year = int(fields[8][4:6])
+                    year += 1900 if year >= 80 else 2000
+                    date = _parse_date(day=fields[8][0:2], month=fields[8][2:4], year=str(year).encode())
+            elif sentence_type == b"ZDA":
+                if np.isnat(date):
+                    date = parse_zda(fields).astype("datetime64[D]")
+        except ValueError:
+            continue
+
+    fix = gga_fix or rmc_fix
+    if fix is None:
+        return np.nan, np.nan, TIME_NAT, date
+    return (*fix, date)
+
+
+def parse_gga(fields: tp.List[bytes]) -> tp.Optional[tp.Tuple[float, float, np.timedelta64]]:
+    """Return the longitude, latitude and time of day of a GGA sentence. None if there is no fix."""
+    if len(fields) < 6 or fields[5] in (b"", b"0"):
+        return None
+    return _parse_lon(fields[3], fields[4]), _parse_lat(fields[1], fields[2]), _parse_time(fields[0])
+
+
+def parse_rmc(fields: tp.List[bytes]) -> tp.Optional[tp.Tuple[float, float, np.timedelta64]]:
+    """Return the longitude, latitude and time of day of a RMC sentence. None if the status is not valid (A)."""
+    if len(fields) < 6 or fields[1] != b"A":
+        return None
+    return _parse_lon(fields[4], fields[5]), _parse_lat(fields[2], fields[3]), _parse_time(fields[0])
+
+
+def parse_zda(fields: tp.List[bytes]) -> np.datetime64:
+    """Return the datetime of a ZDA sentence."""
+    if len(fields) < 4 or not fields[3]:
+        return np.datetime64("NaT", "ms")
+    return _parse_date(day=fields[1], month=fields[2], year=fields[3]) + _parse_time(fields[0])
+
+
+def _parse_date(day: bytes, month: bytes, year: bytes) -> np.datetime64:
+    return np.datetime64(f"{int(year):04d}-{int(month):02d}-{int(day):02d}", "D")
+
+
+def _parse_lat(value: bytes, hemisphere: bytes) -> float:
+    """ddmm.mmmm to decimal degree."""
+    lat = int(value[:2]) + float(value[2:]) / 60
+    return -lat if hemisphere == b"S" else lat
+
+
+def _parse_lon(value: bytes, hemisphere: bytes) -> float:
+    """dddmm.mmmm to decimal degree."""
+    lon = int(value[:3]) + float(value[3:]) / 60
+    return -lon if hemisphere == b"W" else lon
+
+
+def _parse_time(value: bytes) -> np.timedelta64:
+    """hhmmss.ss to time of day."""
+    if len(value) < 6:
+        return TIME_NAT
+    milliseconds = round(
+        (int(value[:2]) * 3600 + int(value[2:4]) * 60 + float(value[4:])) * 1000
+    )
+    return np.timedelta64(milliseconds, "ms")
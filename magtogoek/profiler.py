@@ -0,0 +1,131 @@
+"""
+Per-stage timing and memory instrumentation.
+
+For each stage, the wall time, the cpu time and the resident memory (RSS) of the process at the
+start and at the end of the stage are recorded, with the peak RSS of the process so far (the
+peak RSS is a process lifetime high-water mark, it is not reset between the stages). Counts
+(e.g. number of ensembles) can be added to a stage to compute rates. If `profile` is True, each stage is also run under `cProfile`.
+
+Usage:
+profiler = StageProfiler(profile=False)
+with profiler.stage("load") as stage:
+    dataset = load(...)
+    stage["ensembles"] = len(dataset.time)
+profiler.log_lines()
+profiler.write_report("report.json")
+"""
+import cProfile
+import json
+import os
+import sys
+import time
+import typing as tp
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def max_rss_so_far_mb() -> tp.Optional[float]:
+    """Return the peak resident memory of the process since it started in MB. None if not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10  # bytes or kilobytes.
+
+
+def rss_mb() -> tp.Optional[float]:
+    """Return the current resident memory of the process in MB. None if not available (not Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+class StageProfiler:
+    """Record the wall time, cpu time and RSS of processing stages.
+
+    Parameters
+    ----------
+    profile :
+        If True, the stages are run under `cProfile` and their stats can be
+        dumped with `dump_stats`.
+
+    Attributes
+    ----------
+    stages :
+        Records of the stages: name, wall_time_s, cpu_time_s, rss_start_mb, rss_end_mb,
+        max_rss_so_far_mb and any count added to the stage.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.profile = profile
+        self.stages: tp.List[dict] = []
+        self._profiles: tp.List[cProfile.Profile] = []
+
+    @contextmanager
+    def stage(self, name: str) -> tp.Iterator[dict]:
+        """Context manager recording a stage. Counts can be added to the yielded record."""
+        record = {"name": name}
+        profile = cProfile.Profile() if self.profile else None
+        rss_start = rss_mb()
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiles.append(profile)
+            record["wall_time_s"] = round(time.perf_counter() - wall_time, 4)
+            record["cpu_time_s"] = round(time.process_time() - cpu_time, 4)
+            record["rss_start_mb"] = _round(rss_start)
+            record["rss_end_mb"] = _round(rss_mb())
+            record["max_rss_so_far_mb"] = _round(max_rss_so_far_mb())
+            self.stages.append(record)
+
+    def log_lines(self) -> tp.List[str]:
+        """Return one line per stage for the logbook."""
+        lines = []
+        for record in self.stages:
+            line = f"{record['name']}: wall {record['wall_time_s']:.2f} s, cpu {record['cpu_time_s']:.2f} s"
+            if record["rss_start_mb"] is not None:
+                line += f", RSS {record['rss_start_mb']:.0f} -> {record['rss_end_mb']:.0f} MB"
+            if record["max_rss_so_far_mb"] is not None:
+                line += f", max RSS so far {record['max_rss_so_far_mb']:.0f} MB"
+            if "ensembles" in record and record["wall_time_s"] > 0:
+                line += f", {record['ensembles'] / record['wall_time_s']:.0f} ensembles/s"
+            lines.append(line)
+        return lines
+
+    def write_report(self, path: tp.Union[str, Path]):
+        """Write the stages records to a json file."""
+        total = {
+            "wall_time_s": round(sum(record["wall_time_s"] for record in self.stages), 4),
+            "cpu_time_s": round(sum(record["cpu_time_s"] for record in self.stages), 4),
+            "max_rss_so_far_mb": _round(max_rss_so_far_mb()),
+        }
+        with open(path, "w") as f:
+            json.dump({"stages": self.stages, "total": total}, f, indent=4)
+
+    def dump_stats(self, prefix: tp.Union[str, Path]) -> tp.List[str]:
+        """Dump the cProfile stats of each stage to `{prefix}_{number}_{stage}.prof`.
+
+        The stats can be read with `pstats` or `snakeviz`. Returns the filenames.
+        """
+        filenames = []
+        for number, (record, profile) in enumerate(zip(self.stages, self._profiles)):
+            filename = f"{prefix}_{number:02d}_{record['name']}.prof"
+            profile.dump_stats(filename)
+            filenames.append(filename)
+        return filenames
+
+
+def _round(value: tp.Optional[float]) -> tp.Optional[float]:
+    return None if value is None else round(value, 1)
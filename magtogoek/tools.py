@@ -8,7 +8,6 @@ import numpy as np
 import xarray as xr
 from nptyping import NDArray
 from pygeodesy.ellipsoidalVincenty import LatLon
-import warnings
 
 
 def flag_data(dataset: xr.Dataset, var: str, flag_thres: int = 2, ancillary_variables: str = None):
@@ -108,6 +107,67 @@ def circular_distance(a1, a2, units="rad"):
     return res
 
 
+def interpolate_navigation(
+        time: np.ndarray,
+        lon: np.ndarray,
+        lat: np.ndarray,
+        new_time: np.ndarray,
+        max_gap: float = None
+) -> tp.Tuple[np.ndarray, np.ndarray]:
+    """Linear interpolation of longitudes and latitudes on `new_time`.
+
+    1-D interpolation on the sorted times using `np.searchsorted`. Fixes with missing
+    values are dropped. Longitudes are unwrapped before the interpolation so that
+    crossing the antimeridian does not interpolate through 0 and are wrapped back
+    to [-180, 180) after.
+
+    Parameters
+    ----------
+    time :
+        Times of the longitudes and latitudes.
+    lon :
+        Longitudes in degree.
+    lat :
+        Latitudes in degree.
+    new_time :
+        Times to interpolate on. Same units as `time`.
+    max_gap :
+        Maximum time between two fixes to interpolate between them. Same units as `time`.
+
+    Returns
+    -------
+    lon, lat :
+        Interpolated longitudes and latitudes. NaN outside the time span of the fixes
+        or in gaps larger than `max_gap`.
+    """
+    time, lon, lat = np.asarray(time, dtype=float), np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    new_time = np.asarray(new_time, dtype=float)
+
+    finite = np.isfinite(time) & np.isfinite(lon) & np.isfinite(lat)
+    order = np.argsort(time[finite], kind="stable")
+    time, lon, lat = time[finite][order], lon[finite][order], lat[finite][order]
+
+    if len(time) == 0:
+        return nans(new_time.shape), nans(new_time.shape)
+
+    lon = np.rad2deg(np.unwrap(np.deg2rad(lon)))
+
+    right = np.clip(np.searchsorted(time, new_time, side="right"), 1, len(time) - 1)  # 0 if a single fix.
+    left = np.maximum(right - 1, 0)
+    time_step = time[right] - time[left]
+    weight = np.divide(new_time - time[left], time_step, out=np.zeros(new_time.shape), where=time_step > 0)
+
+    new_lon = lon[left] + weight * (lon[right] - lon[left])
+    new_lat = lat[left] + weight * (lat[right] - lat[left])
+
+    invalid = (new_time < time[0]) | (new_time > time[-1])
+    if max_gap is not None:
+        invalid |= time_step > max_gap
+    new_lon[invalid], new_lat[invalid] = np.nan, np.nan
+
+    return (new_lon + 180) % 360 - 180, new_lat
+
+
 def vincenty(p0: tp.Tuple[float, float], p1: tp.Tuple[float, float]) -> float:
     """Calculate the distance between 2 coordinates with pygeodesy.ellipsoidalVincenty.LatLon
 
@@ -187,7 +247,8 @@ def rotate_2d_vector(
 def regrid_dataset(dataset: xr.Dataset,
                    grid: tp.Union[str, list, np.ndarray],
                    method: str = 'interp',
-                   dim: str = 'depth') -> xr.Dataset:
+                   dim: str = 'depth',
+                   flags: tp.List[str] = None) -> xr.Dataset:
     """
     Regrid data to predefined depths.
 
@@ -201,6 +262,10 @@ def regrid_dataset(dataset: xr.Dataset,
         One of [`interp`, `bin`]. Regrid by bin-averaging or interpolation.
     dim :
         Name of the coordinate along which to regrid `dataset`.
+    flags :
+        `bin` method only. Names of the flags variables prepared for regridding (5, 8, 9)
+        (see `_prepare_flags_for_regrid`). They are given the new flags of their bins
+        instead of being averaged.
 
     Returns
     -------
@@ -211,7 +276,8 @@ def regrid_dataset(dataset: xr.Dataset,
     ----
     The `interp` method performs linear interpolation. The `bin` method
     performs averaging of input data strictly within the bin boundaries
-    and with equal weights for all data inside each bin.
+    and with equal weights for all data inside each bin. The floating point
+    dtypes of the input variables are preserved.
     """
     # Read grid file
     if isinstance(grid, str):
@@ -227,12 +293,17 @@ def regrid_dataset(dataset: xr.Dataset,
 
     # Regrid by bin averaging
     elif method == 'bin':
-        regridded = _xr_bin(dataset, dim, z)
+        regridded = _xr_bin(dataset, dim, z, flags=flags)
 
     # Error handling
     else:
         raise ValueError('Unrecognized regrid method: %s' % method)
 
+    # Keep the input floating point precision (e.g. float32)
+    for var in regridded.data_vars:
+        if var in dataset and np.issubdtype(dataset[var].dtype, np.floating):
+            regridded[var] = regridded[var].astype(dataset[var].dtype, copy=False)
+
     # Change data extent for the depth coordinate
     regridded[dim].attrs['data_min'] = z.min()
     regridded[dim].attrs['data_max'] = z.max()
@@ -288,13 +359,20 @@ def _bin_edges_to_centers(edges: tp.Union[list, np.ndarray]) -> np.ndarray:
 def _xr_bin(dataset: tp.Union[xr.Dataset, xr.DataArray],
             dim: str,
             bins: np.ndarray,
-            centers: bool = True) -> tp.Union[xr.Dataset, xr.DataArray]:
+            centers: bool = True,
+            flags: tp.List[str] = None) -> tp.Union[xr.Dataset, xr.DataArray]:
     """
     Bin dataset along `dim`.
 
-    Convenience wrapper for the groupby_bins xarray method. Meant for
-    simply binning xarray `dataset` to the values of dimension `dim`, and
-    return values at bin centers (or edges) `bins`.
+    Averages the values of `dataset` inside each bin along the dimension `dim`
+    and returns them at the bin centers (or edges) `bins`. A value is inside the
+    bin `i` if `edges[i] < value <= edges[i + 1]` (as `groupby_bins`). NaN are
+    ignored and bins without values are NaN.
+
+    The bins membership is computed once from the bin edges (see `_bin_indices`)
+    and shared by all the variables. Each variable is then reduced with the sums
+    and counts of the contiguous bins segments (see `_bin_means_block`). Non-numeric
+    variables along `dim` are dropped.
 
     Parameters
     ----------
@@ -306,6 +384,9 @@ def _xr_bin(dataset: tp.Union[xr.Dataset, xr.DataArray],
         Bin centers or edges if `centers` is False.
     centers :
         Parameter `bins` is the centers, otherwise it is the edges.
+    flags :
+        Names of the flags variables prepared for regridding (5, 8, 9). They are given
+        the new flags of their bins instead of being averaged (see `_bin_flags_block`).
 
     Returns
     -------
@@ -313,101 +394,128 @@ def _xr_bin(dataset: tp.Union[xr.Dataset, xr.DataArray],
         Dataset binned at `binc` along `dim`.
 
     """
+    if isinstance(dataset, xr.DataArray):
+        name = dataset.name if dataset.name is not None else "__binned__"
+        return _xr_bin(dataset.to_dataset(name=name), dim, bins, centers=centers)[name].rename(dataset.name)
+
     # Bin type management
     if centers:
         edge = _bin_centers_to_edges(bins)
-        labels = bins
+        labels = np.asarray(bins)
     else:
-        edge = bins
+        edge = np.asarray(bins)
         labels = _bin_edges_to_centers(bins)
 
-    # Skip for compatibility with DataArray
-    if isinstance(dataset, xr.core.dataset.Dataset):
-        # Save dimension orders for each variable
-        dim_dict = dict()
-        for key in dataset.keys():
-            dim_dict[key] = dataset[key].dims
-
-    # Avoids printing mean of empty slice warning
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore', category=RuntimeWarning)
-
-        # Bin reduction 
-        output = (dataset.groupby_bins(dataset[dim], bins=edge, labels=labels)
-                  .mean(dim=dim, keep_attrs=True)
-                  .rename({dim+'_bins': dim}))
-
-    # Skip for compatibility with DataArray
-    if isinstance(dataset, xr.core.dataset.Dataset):
-        # Restore dataset attributes
-        output.attrs = dataset.attrs
-
-        # Restore dimension order to each variable
-        for key, dim_tuple in dim_dict.items():
-            if dim not in dim_tuple:
-                output[key] = dataset[key]
-            else:
-                output[key] = output[key].transpose(*dim_tuple)
+    segments = _bin_indices(dataset[dim].values, edge)
+
+    output = xr.Dataset(coords={key: coord for key, coord in dataset.coords.items() if dim not in coord.dims})
+    output.coords[dim] = labels
+    for key, variable in dataset.data_vars.items():
+        if dim not in variable.dims:
+            output[key] = variable
+        elif key in (flags or []):
+            binned = _map_bin_block(
+                _bin_flags_block, variable.data, variable.dims.index(dim), segments, len(labels), np.uint8
+            )
+            output[key] = (variable.dims, binned, variable.attrs)
+        elif np.issubdtype(variable.dtype, np.number) or variable.dtype == bool:
+            dtype = variable.dtype if np.issubdtype(variable.dtype, np.floating) else np.float64
+            binned = _map_bin_block(
+                _bin_means_block, variable.data, variable.dims.index(dim), segments, len(labels), dtype
+            )
+            output[key] = (variable.dims, binned, variable.attrs)
+    output.attrs = dataset.attrs
 
     return output
 
 
-def _isin_any(array: tp.Union[np.ndarray, xr.DataArray],
-              element: tp.Union[int, float, str],
-              dim) -> tp.Union[np.ndarray, xr.DataArray]:
+def _bin_indices(values: np.ndarray, edges: np.ndarray) -> tp.Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    Check if `elements` are in `array` along `axis`.
+    Bins membership of `values` as contiguous segments of the values sorted by bin.
+
+    A value is inside the bin `i` if `edges[i] < value <= edges[i + 1]`.
 
     Parameters
     ----------
-    array :
-        In which to look for elements.
-    element :
-        Element to look for.
-    dim :
-        Name of the dimension along which look for `elements` in `array`.
+    values :
+        Coordinate values.
+    edges :
+        Monotonically increasing bin edges.
 
     Returns
     -------
-    bool_array :
-        True if element was found, False otherwise.
+    order :
+        Indices of the values inside the bins, sorted by bin.
+    bounds :
+        The values of the bin `nonempty[i]` are `order[bounds[i]:bounds[i + 1]]`.
+    nonempty :
+        Indices of the non-empty bins.
     """
-    return (array == element).any(dim=dim)
+    index = np.searchsorted(edges, values, side="left") - 1
+    inside = (index >= 0) & (index < len(edges) - 1) & ~np.isnan(values)
+    order = np.flatnonzero(inside)
+    order = order[np.argsort(index[order], kind="stable")]
+    nonempty, starts = np.unique(index[order], return_index=True)
+    return order, np.append(starts, len(order)), nonempty
+
+
+def _map_bin_block(func: tp.Callable, values: tp.Any, axis: int, segments: tuple, n_bins: int, dtype) -> tp.Any:
+    """Apply a bin block function to `values`. Chunked (dask) arrays are binned chunk by chunk."""
+    if hasattr(values, "dask"):
+        values = values.rechunk({axis: -1})
+        chunks = values.chunks[:axis] + ((n_bins,),) + values.chunks[axis + 1:]
+        return values.map_blocks(func, axis, segments, n_bins, chunks=chunks, dtype=dtype)
+    return func(values, axis, segments, n_bins)
+
+
+def _bin_segments(values: np.ndarray, axis: int, segments: tuple) -> tp.Tuple[np.ndarray, tp.Iterator]:
+    """Move `axis` first and iterate over the (bin, values) segments of the values sorted by bin."""
+    order, bounds, nonempty = segments
+    values = np.moveaxis(np.asarray(values), axis, 0)
+    if len(order) > 0 and order[-1] - order[0] == len(order) - 1 and (np.diff(order) == 1).all():
+        values = values[order[0]:order[-1] + 1]  # Already sorted, no copy.
+    else:
+        values = values[order]
+    return values, ((i, values[start:stop]) for i, start, stop in zip(nonempty, bounds[:-1], bounds[1:]))
 
 
-def _new_flags_bin_regrid(flags: xr.DataArray,
-                          bin_depths: np.ndarray,
-                          dim: str = 'depth') -> xr.DataArray:
+def _bin_means_block(values: np.ndarray, axis: int, segments: tuple, n_bins: int) -> np.ndarray:
     """
-    Quality flag transfer function for bin average regridding.
-
-    Parameters
-    ----------
-    flags :
-        Flags prepared for regridding (5, 8, 9).
-    bin_depths :
-        Center of the regridding averaging bins (meters).
-    dim :
-        Name of the dimension along which the binning is done.
-
-    Returns
-    -------
-    new_flags :
-        Quality flags for the regridded data.
+    NaN-aware bins means along `axis`.
 
+    The values are sorted by bin once (a view if already sorted) so that each bin is a
+    contiguous segment reduced at once from its sums and counts of valid values.
+    Floating point values keep their dtype, others are averaged as float64.
     """
-    bin_edges = _bin_centers_to_edges(bin_depths)
-
-    # Determine if original bins contained 5 or 8 flags
-    grouped = flags.groupby_bins(dim, bin_edges, labels=bin_depths)
-    good = grouped.map(_isin_any, args=(8, dim,)).rename({f"{dim}_bins": dim})  # contains 8 flags
-    changed = grouped.map(_isin_any, args=(5, dim,)).rename({f"{dim}_bins": dim})  # contains 5 flags
-
-    # Set bins outside data from NaN to False (-> missing)
-    good = good.where(np.isfinite(good), False).astype(bool)
-    changed = changed.where(np.isfinite(changed), False).astype(bool)
+    dtype = values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64
+    values, bins = _bin_segments(values, axis, segments)
+    means = np.full((n_bins,) + values.shape[1:], np.nan, dtype=dtype)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for i, segment in bins:
+            if len(segment) == 1 or not np.issubdtype(values.dtype, np.floating):
+                means[i] = segment.mean(axis=0)
+                continue
+            invalid = np.isnan(segment)
+            sums = np.add.reduce(np.where(invalid, 0, segment), axis=0)
+            means[i] = sums / (len(segment) - np.add.reduce(invalid, axis=0, dtype=np.intp))
+    return np.moveaxis(means, 0, axis)
+
+
+def _bin_flags_block(flags: np.ndarray, axis: int, segments: tuple, n_bins: int) -> np.ndarray:
+    """
+    Bins flags along `axis` from flags prepared for regridding (5, 8, 9).
 
-    return good*8 + (changed & ~good)*5 + (~changed & ~good)*9
+    New flags are 8 (interpolated_value) if the bin has any 8, otherwise 5 (changed_value)
+    if it has any 5, otherwise 9 (missing_value). The `any 8` and `any 5` of each bin are
+    reduced together as the bits of a single code.
+    """
+    codes = (np.asarray(flags) == 8).astype(np.uint8) * 2 + (np.asarray(flags) == 5)
+    codes, bins = _bin_segments(codes, axis, segments)
+    binned_codes = np.zeros((n_bins,) + codes.shape[1:], dtype=np.uint8)
+    for i, segment in bins:
+        binned_codes[i] = np.bitwise_or.reduce(segment, axis=0)
+    new_flags = np.where(binned_codes & 2, 8, np.where(binned_codes & 1, 5, 9)).astype(np.uint8)
+    return np.moveaxis(new_flags, 0, axis)
 
 
 def _new_flags_interp_regrid(dataset: xr.Dataset, variable: str) -> xr.DataArray:
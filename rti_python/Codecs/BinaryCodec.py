@@ -169,13 +169,16 @@ class BinaryCodec:
 
 
     @staticmethod
-    def decode_data_sets(ens):
+    def decode_data_sets(ens, as_array=False, skip=()):
         """
         Decode the datasets in the ensemble.
 
         Use verify_ens_data if you are using this
         as a static method to verify the data is correct.
         :param ens: Ensemble data.  Decode the dataset.
+        :param as_array: If True, the [Bin x Beam] datasets (velocities, amplitude, correlation,
+                         good beam and good earth) are returned as numpy arrays. (ADD BY MAGTOGOEK)
+        :param skip: Names of the datasets (e.g. "E000011") to jump over without decoding them. (ADD BY MAGTOGOEK)
         :return: Return the decoded ensemble.
         """
         # print(ens)
@@ -251,53 +254,58 @@ class BinaryCodec:
                     ds_type, name_len, num_elements, element_multiplier
                 )
 
+                # Skipped datasets
+                if name[:7] in skip:
+                    packetPointer += data_set_size
+                    continue
+
                 # Beam Velocity
                 if "E000001" in name:
                     logging.debug(name)
                     bv = BeamVelocity(num_elements, element_multiplier)
-                    bv.decode(ens[packetPointer : packetPointer + data_set_size])
+                    bv.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddBeamVelocity(bv)
 
                 # Instrument Velocity
                 if "E000002" in name:
                     logging.debug(name)
                     iv = InstrumentVelocity(num_elements, element_multiplier)
-                    iv.decode(ens[packetPointer : packetPointer + data_set_size])
+                    iv.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddInstrumentVelocity(iv)
 
                 # Earth Velocity
                 if "E000003" in name:
                     logging.debug(name)
                     ev = EarthVelocity(num_elements, element_multiplier)
-                    ev.decode(ens[packetPointer : packetPointer + data_set_size])
+                    ev.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddEarthVelocity(ev)
 
                 # Amplitude
                 if "E000004" in name:
                     logging.debug(name)
                     amp = Amplitude(num_elements, element_multiplier)
-                    amp.decode(ens[packetPointer : packetPointer + data_set_size])
+                    amp.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddAmplitude(amp)
 
                 # Correlation
                 if "E000005" in name:
                     logging.debug(name)
                     corr = Correlation(num_elements, element_multiplier)
-                    corr.decode(ens[packetPointer : packetPointer + data_set_size])
+                    corr.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddCorrelation(corr)
 
                 # Good Beam
                 if "E000006" in name:
                     logging.debug(name)
                     gb = GoodBeam(num_elements, element_multiplier)
-                    gb.decode(ens[packetPointer : packetPointer + data_set_size])
+                    gb.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddGoodBeam(gb)
 
                 # Good Earth
                 if "E000007" in name:
                     logging.debug(name)
                     ge = GoodEarth(num_elements, element_multiplier)
-                    ge.decode(ens[packetPointer : packetPointer + data_set_size])
+                    ge.decode(ens[packetPointer : packetPointer + data_set_size], as_array=as_array)
                     ensemble.AddGoodEarth(ge)
 
                 # Ensemble Data
@@ -22,22 +22,21 @@ class Correlation:
         for bins in range(num_elements):
             bins = []
             for beams in range(element_multiplier):
-                bins.append([Ensemble().BadVelocity])
+                bins.append([Ensemble.BadVelocity])
 
             self.Correlation.append(bins)
 
-    def decode(self, data):
+    def decode(self, data, as_array=False):
         """
         Take the data bytearray.  Decode the data to populate
         the velocities.
         :param data: Bytearray for the dataset.
+        :param as_array: Keep the correlations as a numpy [Bin x Beam] array instead of nested lists.
         """
         packet_pointer = Ensemble.GetBaseDataSize(self.name_len)
 
-        for beam in range(self.element_multiplier):
-            for bin_num in range(self.num_elements):
-                self.Correlation[bin_num][beam] = Ensemble.GetFloat(packet_pointer, Ensemble().BytesInFloat, data)
-                packet_pointer += Ensemble().BytesInFloat
+        values = Ensemble.GetBinBeamArray(packet_pointer, self.num_elements, self.element_multiplier, data, "<f4")
+        self.Correlation = values if as_array else values.tolist()
 
         logging.debug(self.Correlation)
 
@@ -33,21 +33,22 @@ class EarthVelocity:
             self.Magnitude.append(Ensemble.BadVelocity)     # Mark Mag Bad
             self.Direction.append(Ensemble.BadVelocity)     # Mark Dir Bad
 
-    def decode(self, data):
+    def decode(self, data, as_array=False):
         """
         Take the data bytearray.  Decode the data to populate
         the velocities.
         :param data: Bytearray for the dataset.
+        :param as_array: Keep the velocities as a numpy [Bin x Beam] array instead of nested lists.
+                         The Magnitude and Direction are then not generated.
         """
         packet_pointer = Ensemble.GetBaseDataSize(self.name_len)
 
-        for beam in range(self.element_multiplier):
-            for bin_num in range(self.num_elements):
-                self.Velocities[bin_num][beam] = Ensemble.GetFloat(packet_pointer, Ensemble().BytesInFloat, data)
-                packet_pointer += Ensemble().BytesInFloat
+        values = Ensemble.GetBinBeamArray(packet_pointer, self.num_elements, self.element_multiplier, data, "<f4")
+        self.Velocities = values if as_array else values.tolist()
 
         # Generate Water Current Magnitude and Direction
-        self.generate_velocity_vectors()
+        if not as_array:
+            self.generate_velocity_vectors()
 
         logging.debug(self.Velocities)
 
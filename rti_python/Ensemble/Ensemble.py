@@ -859,6 +859,22 @@ class Ensemble:
         """
         return struct.pack("f", value)
 
+    @staticmethod
+    def GetBinBeamArray(start, num_elements, element_multiplier, ens, dtype="<f4"):
+        """
+        Read a [Bin x Beam] block of values with numpy.
+        The values are stored beam by beam in the buffer.
+        THIS METHOD IS ADD BY MAGTOGOEK
+        :param start: Start location in the buffer.
+        :param num_elements: Number of bins.
+        :param element_multiplier: Number of beams.
+        :param ens: Buffer containing the ensemble data.
+        :param dtype: Type of the values. ('<f4' for float, '<i4' for int)
+        :return: Numpy array of shape (bins, beams).
+        """
+        values = np.frombuffer(ens, dtype=dtype, count=num_elements * element_multiplier, offset=start)
+        return values.reshape(element_multiplier, num_elements).T
+
     @staticmethod
     def GetDataSetSize(ds_type, name_len, num_elements, element_multipler):
         """
@@ -26,18 +26,17 @@ class GoodEarth:
 
             self.GoodEarth.append(bins)
 
-    def decode(self, data):
+    def decode(self, data, as_array=False):
         """
         Take the data bytearray.  Decode the data to populate
         the Good Earth.
         :param data: Bytearray for the dataset.
+        :param as_array: Keep the good earth as a numpy [Bin x Beam] array instead of nested lists.
         """
         packet_pointer = Ensemble.GetBaseDataSize(self.name_len)
 
-        for beam in range(self.element_multiplier):
-            for bin_num in range(self.num_elements):
-                self.GoodEarth[bin_num][beam] = Ensemble.GetInt32(packet_pointer, Ensemble().BytesInInt32, data)
-                packet_pointer += Ensemble().BytesInInt32
+        values = Ensemble.GetBinBeamArray(packet_pointer, self.num_elements, self.element_multiplier, data, "<i4")
+        self.GoodEarth = values if as_array else values.tolist()
 
         logging.debug(self.GoodEarth)
 
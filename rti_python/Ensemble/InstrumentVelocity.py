@@ -20,22 +20,21 @@ class InstrumentVelocity:
         for bins in range(num_elements):
             bins = []
             for beams in range(element_multiplier):
-                bins.append([Ensemble().BadVelocity])
+                bins.append([Ensemble.BadVelocity])
 
             self.Velocities.append(bins)
 
-    def decode(self, data):
+    def decode(self, data, as_array=False):
         """
         Take the data bytearray.  Decode the data to populate
         the velocities.
         :param data: Bytearray for the dataset.
+        :param as_array: Keep the velocities as a numpy [Bin x Beam] array instead of nested lists.
         """
         packetpointer = Ensemble.GetBaseDataSize(self.name_len)
 
-        for beam in range(self.element_multiplier):
-            for bin_num in range(self.num_elements):
-                self.Velocities[bin_num][beam] = Ensemble.GetFloat(packetpointer, Ensemble().BytesInFloat, data)
-                packetpointer += Ensemble().BytesInFloat
+        values = Ensemble.GetBinBeamArray(packetpointer, self.num_elements, self.element_multiplier, data, "<f4")
+        self.Velocities = values if as_array else values.tolist()
 
         logging.debug(self.Velocities)
 
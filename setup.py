@@ -40,6 +40,7 @@ setup(
         "pyqt5",
         "pycurrents @ hg+https://currents.soest.hawaii.edu/hgstage/pycurrents",
     ],
+    extras_require={"dask": ["dask[array]>=2021.10.0"]},
     packages=find_packages(),
     package_data={"": ["*.json"], "magtogoek/test": ["files/*.*"]},
     include_package_data=True,
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.adcp.quality_control import adcp_quality_control
+from magtogoek.tools import regrid_dataset, rotate_2d_vector
+
+BEAM_VARIABLES = [f"{var}{i}" for var in ["corr", "amp"] for i in range(1, 5)] + ["pg"]
+
+
+def make_dataset(float32: bool = False) -> xr.Dataset:
+    """Synthetic adcp dataset. The velocities, beam data and bottom track are float32 if `float32`."""
+    rng = np.random.default_rng(0)
+    depth, time = np.arange(1, 21, dtype=float), np.arange(200).astype("datetime64[m]")
+    shape = (len(depth), len(time))
+
+    dataset = xr.Dataset(coords={"depth": depth, "time": time})
+    for var in "uvwe":
+        values = rng.uniform(-1, 1, shape)
+        values[rng.random(shape) < 0.02] = 10
+        values[rng.random(shape) < 0.02] = np.nan
+        dataset[var] = (["depth", "time"], values)
+    for var in BEAM_VARIABLES:
+        dataset[var] = (["depth", "time"], rng.integers(0, 256, shape).astype(float))
+    for var in ["bt_u", "bt_v", "bt_w"]:
+        dataset[var] = (["time"], rng.uniform(-0.5, 0.5, len(time)))
+    dataset["roll_"] = (["time"], rng.normal(0, 10, len(time)))
+    dataset["pitch"] = (["time"], rng.normal(0, 10, len(time)))
+    dataset["temperature"] = (["time"], rng.uniform(-5, 35, len(time)))
+    dataset["pres"] = (["time"], rng.uniform(-10, 100, len(time)))
+    dataset.attrs["logbook"] = ""
+
+    if float32 is True:
+        for var in [*"uvwe", *BEAM_VARIABLES, "bt_u", "bt_v", "bt_w"]:
+            dataset[var] = dataset[var].astype(np.float32)
+    return dataset
+
+
+def quality_control(dataset: xr.Dataset):
+    adcp_quality_control(dataset, motion_correction_mode="bt")
+    dataset.u.data, dataset.v.data = rotate_2d_vector(dataset.u.data, dataset.v.data, -15.5)
+
+
+@pytest.mark.parametrize("method", ["interp", "bin"])
+def test_float32_equivalence(method):
+    dataset64, dataset32 = make_dataset(), make_dataset(float32=True)
+    quality_control(dataset64)
+    quality_control(dataset32)
+
+    for var in ["u_QC", "binary_mask", "pres_QC", "temperature_QC"]:
+        np.testing.assert_array_equal(dataset32[var], dataset64[var])
+    assert dataset32.u_QC.dtype == np.uint8 and dataset32.binary_mask.dtype == np.uint16
+
+    grid = np.arange(2, 20, 2.5)
+    dataset64 = regrid_dataset(dataset64, grid=grid, method=method)
+    dataset32 = regrid_dataset(dataset32, grid=grid, method=method)
+    for var in [*"uvwe", "corr1", "amp1", "pg"]:
+        assert dataset32[var].dtype == np.float32
+        np.testing.assert_allclose(dataset32[var], dataset64[var], rtol=1e-5, atol=1e-5)
@@ -1,6 +1,11 @@
+import numpy as np
 import pytest
+import xarray as xr
 from pathlib import Path
-from magtogoek.adcp.process import ProcessConfig
+from magtogoek.adcp.process import ProcessConfig, process_adcp, sweep_adcp_thresholds
+from magtogoek.config_handler import load_configfile, write_configfile
+from pd0_reader_test import _velocity, make_pd0_ensemble
+from rti_reader_test import make_ensemble
 
 INPUT_FILES = str(Path('input_file').absolute())
 CONFIG_PATH = Path().cwd()
@@ -61,3 +66,47 @@ def test_figures_outputs(config_dict, figure_output, figure_path):
     pconfig.resolve_outputs()
     assert pconfig.figures_output == figure_output
     assert pconfig.figures_path == figure_path
+
+
+def test_append_xducer_depth(tmp_path):
+    """The second batch XducerDepth median is 0.3 m deeper so its bin depths are shifted."""
+    filenames = []
+    for i, (minutes, xducer_depth) in enumerate([(range(0, 4), 105), (range(4, 8), 108)]):
+        filename = tmp_path / f"adcp_{i}.000"
+        filename.write_bytes(b"".join(make_pd0_ensemble(m, _velocity(m), xducer_depth=xducer_depth) for m in minutes))
+        filenames.append(str(filename))
+
+    config_path = str(tmp_path / "adcp.ini")
+    write_configfile(
+        config_path, "adcp", {"sensor_type": "adcp", "input_files": filenames[0], "yearbase": 2021, "sonar": "wh"}
+    )
+    config, _ = load_configfile(config_path)
+    config["ADCP_PROCESSING"]["pd0_reader"] = "magtogoek"
+    config["ADCP_QUALITY_CONTROL"]["quality_control"] = False
+    config["ADCP_OUTPUT"].update(append=True, merge_output_files=True)
+    config["OUTPUT"]["netcdf_output"] = str(tmp_path / "adcp")
+
+    for filename in filenames:
+        config["INPUT"]["input_files"] = [filename]
+        process_adcp(config, headless=True)
+
+    with xr.open_dataset(tmp_path / "adcp.nc") as dataset:
+        assert len(dataset.time) == 8
+        np.testing.assert_allclose(dataset.depth, [6.3, 7.3, 8.3])
+
+
+def test_sweep_dropped_amplitude(tmp_path):
+    """The RTI amplitude is decoded for the sweep even if it is dropped and its threshold is unset."""
+    filename = tmp_path / "adcp.ENS"
+    filename.write_bytes(b"".join(make_ensemble(n, minute=n) for n in range(4)))
+
+    config_path = str(tmp_path / "adcp.ini")
+    write_configfile(
+        config_path, "adcp", {"sensor_type": "adcp", "input_files": str(filename), "yearbase": 2020, "sonar": "sw"}
+    )
+    config, _ = load_configfile(config_path)
+    config["ADCP_QUALITY_CONTROL"]["amplitude_threshold"] = None
+    config["ADCP_OUTPUT"]["drop_amplitude"] = True
+
+    sweep = sweep_adcp_thresholds(config, dict(amp=[70, 90]))
+    assert "amp" in sweep.coords
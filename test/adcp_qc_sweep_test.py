@@ -0,0 +1,36 @@
+import itertools
+
+import numpy as np
+import pytest
+from adcp_float32_test import make_dataset
+from magtogoek.adcp.qc_sweep import SWEEP_TESTS, sweep_table, threshold_sweep
+from magtogoek.adcp.quality_control import pitch_test, velocity_qc_kernel
+
+THRESHOLDS = dict(amp=[200, 30, 100], horizontal_vel=[0.5, 1.0], pitch=[5, 15], corr=[64])
+
+
+@pytest.mark.parametrize("block_size", [7, 10 ** 6])
+def test_threshold_sweep(block_size):
+    dataset = make_dataset()
+    dataset["amp2"][0, :10] = np.nan
+    dataset["u"][1, :10] = np.nan
+    sweep = threshold_sweep(dataset, THRESHOLDS, block_size=block_size)
+
+    assert list(sweep.amp.data) == [30, 100, 200]
+    assert sweep.retention.dims == ("depth", "amp", "horizontal_vel", "pitch", "corr")
+    for amp, hvel, pitch, corr in itertools.product(*(sweep[name].data for name in THRESHOLDS)):
+        bits = {SWEEP_TESTS["amp"]: amp, SWEEP_TESTS["horizontal_vel"]: hvel, SWEEP_TESTS["corr"]: corr}
+        flags, _ = velocity_qc_kernel(dataset, cell_thresholds=bits, time_fails={7: pitch_test(dataset, pitch)})
+        combination = dict(amp=amp, horizontal_vel=hvel, pitch=pitch, corr=corr)
+        np.testing.assert_allclose(sweep.retention.sel(combination), (flags == 1).mean(axis=1))
+        np.testing.assert_allclose(sweep.percent_flagged.sel(combination), 100 * (flags != 1).mean())
+
+    assert len(sweep_table(sweep).splitlines()) == 1 + 3 * 2 * 2 * 1
+
+
+def test_threshold_sweep_errors():
+    dataset = make_dataset()
+    with pytest.raises(ValueError, match="Invalid tests"):
+        threshold_sweep(dataset, dict(sidelobe=[1]))
+    with pytest.raises(ValueError, match="missing"):
+        threshold_sweep(dataset.drop_vars("amp1"), dict(amp=[1]))
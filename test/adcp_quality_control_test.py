@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from adcp_float32_test import make_dataset
+from magtogoek.adcp.quality_control import (adcp_quality_control, circular_mean, distance_from_circular_mean,
+                                            rolling_correlation, rolling_median, velocity_qc_kernel)
+
+
+def test_velocity_qc_kernel_blocks():
+    dataset = make_dataset()
+    dataset.attrs.update(beam_angle=20, orientation="down", bin_size_m=1.0)
+    roll_fails = np.arange(len(dataset.time)) % 7 == 0
+    kwargs = dict(
+        cell_thresholds={0: 30, 1: 64, 2: 90, 3: 1.0, 4: 0.5, 5: 0.5},
+        time_fails={6: roll_fails},
+        sidelobe_limit=np.full(dataset.time.shape, 15.0),
+    )
+
+    vel_flags, binary_mask = velocity_qc_kernel(dataset, **kwargs)
+    for block_size in [1, 13, 10 ** 6]:
+        flags, mask = velocity_qc_kernel(dataset, **kwargs, block_size=block_size)
+        np.testing.assert_array_equal(flags, vel_flags)
+        np.testing.assert_array_equal(mask, binary_mask)
+
+    assert vel_flags.dtype == np.uint8 and binary_mask.dtype == np.uint16
+    amp = np.stack([dataset[f"amp{i}"].data for i in range(1, 5)])
+    np.testing.assert_array_equal(binary_mask & 1 != 0, (amp < 30).all(axis=0))
+    np.testing.assert_array_equal(binary_mask & 2 ** 3 != 0, np.hypot(dataset.u.data, dataset.v.data) > 1.0)
+    assert (binary_mask[:, roll_fails] & 2 ** 6 != 0).all() and not (binary_mask[:, ~roll_fails] & 2 ** 6).any()
+    sidelobe_fails = np.broadcast_to(dataset.depth.data[:, np.newaxis] + 0.5 > 15, binary_mask.shape)
+    np.testing.assert_array_equal(binary_mask & 2 ** 8 != 0, sidelobe_fails)
+
+
+def test_adcp_quality_control_flags():
+    dataset = make_dataset()
+    dataset.attrs.update(beam_angle=20, orientation="up", bin_size_m=1.0, xducer_depth=10.0)
+    dataset["w"][3, 5] = np.nan
+    adcp_quality_control(dataset, sidelobes_correction=True)
+
+    assert dataset.u_QC.dtype == np.uint8 and dataset.binary_mask.dtype == np.uint16
+    assert dataset.u_QC.data[3, 5] == 9
+    failed = (dataset.binary_mask.data != 0) | (dataset.pres_QC.data == 4)
+    valid = np.isfinite(dataset.u.data) & np.isfinite(dataset.v.data) & np.isfinite(dataset.w.data)
+    assert (dataset.u_QC.data[failed & valid] >= 3).all()
+    sidelobe_fails = dataset.depth.data - 0.5 < 10.0 * (1 - np.cos(np.radians(20)))  # 0.603 m: first bin only
+    np.testing.assert_array_equal(sidelobe_fails, [True] + [False] * 19)
+    np.testing.assert_array_equal(
+        dataset.binary_mask.data & 2 ** 8 != 0, np.broadcast_to(sidelobe_fails[:, np.newaxis], dataset.u.shape)
+    )
+
+
+def test_adcp_quality_control_sidelobes_aborted():
+    dataset = make_dataset()
+    dataset.attrs.update(beam_angle=20, orientation="up", bin_size_m=1.0)
+    adcp_quality_control(dataset, sidelobes_correction=True)
+
+    assert not (dataset.binary_mask.data & 2 ** 8).any()
+    assert "sidelobes" not in dataset.attrs["quality_comments"]
+
+
+def test_velocity_qc_kernel_cell_tests():
+    nan = np.nan
+    dataset = xr.Dataset(
+        {
+            **{f"amp{i}": (["depth", "time"], [[10, 50, 10], [10, 10, nan]]) for i in range(1, 4)},
+            "amp4": (["depth", "time"], [[20, 10, 40], [10, 10, nan]]),
+            "u": (["depth", "time"], [[0.6, 0.3, nan], [2.0, 0.1, 0.0]]),
+            "v": (["depth", "time"], [[0.8, 0.3, 0.0], [0.0, 0.1, 0.0]]),
+            "w": (["depth", "time"], [[0.1, -0.6, 0.0], [0.0, 0.0, 0.0]]),
+        },
+        coords={"depth": [1.0, 2.0], "time": np.arange(3)},
+    )
+    flags, mask = velocity_qc_kernel(dataset, cell_thresholds={0: 30, 3: 1.0, 4: 0.5})
+
+    np.testing.assert_array_equal(mask, [[1, 16, 0], [1 + 8, 1, 0]])
+    np.testing.assert_array_equal(flags, [[3, 3, 9], [3, 3, 1]])
+
+
+def test_circular_mean():
+    angles = np.array([170.0, -170.0, 180.0, 160.0, -160.0])
+    assert abs(abs(circular_mean(angles)) - 180) < 1e-9
+    np.testing.assert_allclose(distance_from_circular_mean(angles), [10, 10, 0, 20, 20], atol=1e-9)
+
+
+def make_profiles_dataset():
+    """Smooth tidal currents sheared with depth."""
+    time = np.arange(300)
+    depth = np.arange(1.0, 21.0)
+    phase = 2 * np.pi * time / 124 + depth[:, np.newaxis] / 40
+    u = 0.5 * np.cos(phase) + 0.01 * depth[:, np.newaxis]
+    v = 0.3 * np.sin(phase)
+    return xr.Dataset(
+        {"u": (["depth", "time"], u), "v": (["depth", "time"], v), "w": (["depth", "time"], np.zeros_like(u))},
+        coords={"depth": depth, "time": time},
+    )
+
+
+@pytest.mark.parametrize("window", [1, 4, 5, 15])
+def test_rolling_statistics(window):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(6, 120))
+    x[1, 10:30], x[2], x[3, ::3] = np.nan, np.nan, np.nan
+    y = x + rng.normal(size=x.shape)
+
+    expected = pd.DataFrame(x.T).rolling(window, center=True, min_periods=1).median().values.T
+    np.testing.assert_allclose(rolling_median(x, window), expected, equal_nan=True)
+
+    expected = pd.DataFrame(x.T).rolling(window, center=True, min_periods=window // 2 + 1).corr(pd.DataFrame(y.T))
+    np.testing.assert_allclose(rolling_correlation(x, y, window), expected.values.T, atol=1e-9, equal_nan=True)
+
+
+def test_series_tests():
+    dataset = make_profiles_dataset()
+    dataset["u"][5, 100] += 2  # spike
+    for var in "uv":  # anti-correlated with the adjacent bins
+        dataset[var][12, 150:] = -dataset[var][12, 150:]
+    series_tests = {9: (0.5, 5), 10: (0.5, None), 11: (0.5, 15)}
+
+    _, binary_mask = velocity_qc_kernel(dataset, series_tests=series_tests)
+    for block_size in [20, 20 * 13]:
+        _, mask = velocity_qc_kernel(dataset, series_tests=series_tests, block_size=block_size)
+        np.testing.assert_array_equal(mask, binary_mask)
+
+    spike, shear, correlation = (binary_mask & 2 ** bit != 0 for bit in (9, 10, 11))
+    assert spike[5, 100] and spike.sum() == 1
+    assert shear[5, 100] and shear[:, :150].sum() == 1
+    assert correlation[12, 160:290].all() and not correlation[:, :140].any()
+
+
+def test_chunked_quality_control():
+    pytest.importorskip("dask")
+    dataset = make_dataset()
+    dataset.attrs.update(beam_angle=20, orientation="up", bin_size_m=1.0, xducer_depth=10.0)
+    chunked = dataset.copy(deep=True)
+    for var in chunked.data_vars:
+        if chunked[var].dims == ("depth", "time"):
+            chunked[var] = chunked[var].chunk({"depth": -1, "time": 30})
+
+    kwargs = dict(sidelobes_correction=True, motion_correction_mode="bt", spike_th=0.5, shear_th=0.5, vel_corr_th=0)
+    adcp_quality_control(dataset, **kwargs)
+    adcp_quality_control(chunked, **kwargs)
+
+    assert chunked.u_QC.chunks is not None and chunked.binary_mask.chunks is not None
+    for var in ["u_QC", "binary_mask", "pres_QC", "temperature_QC"]:
+        np.testing.assert_array_equal(chunked[var].values, dataset[var].values)
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from magtogoek.adcp.tools import datetime64_to_string, datetime_to_dday, dday_to_datetime64, get_time_window_trims
+
+
+def test_datetime_to_dday():
+    datetimes = [datetime(2020, 1, 1, 6), datetime(2020, 3, 1, 12, 30), datetime(2021, 1, 1)]
+    expected = [0.25, 60 + 12.5 / 24, 366]
+    np.testing.assert_allclose(datetime_to_dday(datetimes), expected)
+    np.testing.assert_allclose(datetime_to_dday(np.array(datetimes, dtype="datetime64[ns]")), expected)
+    np.testing.assert_allclose(datetime_to_dday(datetimes, yearbase=2019), np.array(expected) + 365)
+
+
+def test_dday_to_datetime64():
+    dday = np.array([-0.5, 0, 0.25, 60.52083333, 365.99999999])
+    expected = np.array(
+        pd.to_datetime(dday, unit="D", origin=pd.Timestamp("2020-01-01")).strftime("%Y-%m-%d %H:%M:%S"),
+        dtype="datetime64[s]",
+    )
+    time = dday_to_datetime64(dday, 2020)
+    np.testing.assert_array_equal(time, expected)
+    assert datetime64_to_string(time)[2] == "2020-01-01T06:00:00"
+
+
+def test_get_time_window_trims_empty_files():
+    """Empty files are skipped: their ensembles are never read."""
+    files_times = [[], np.arange(0, 4), np.arange(4, 8), []]
+    files_times = [np.datetime64("2021-01-01T00:00") + np.array(t, dtype="timedelta64[m]") for t in files_times]
+    files_count = [len(times) for times in files_times]
+
+    def get_time(file_number, ensemble_number):
+        assert ensemble_number >= 0
+        return files_times[file_number][ensemble_number]
+
+    assert get_time_window_trims(files_count, get_time, "2021-01-01T00:01", "2021-01-01T00:05") == (1, 2)
+    assert get_time_window_trims([0, 0], get_time, "2021-01-01T00:01") == (0, 0)
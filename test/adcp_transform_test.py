@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from magtogoek.adcp.transform import VEL_FILL_VALUE, beam_to_xyz_matrix, transform_to_earth, xyz_to_enu_matrices
+
+
+def test_beam_to_xyz_matrix():
+    xyze = beam_to_xyz_matrix(20, convex=True) @ np.ones(4)
+    np.testing.assert_allclose(xyze, [0, 0, 1 / np.cos(np.deg2rad(20)), 0], atol=1e-12)
+
+    beam = np.array([1, -1, 0, 0])
+    assert (beam_to_xyz_matrix(20, convex=True) @ beam)[0] == -(beam_to_xyz_matrix(20, convex=False) @ beam)[0]
+
+
+@pytest.mark.parametrize(
+    "heading, orientation, xyz, enu",
+    [(90, "down", [1, 0, 0], [0, -1, 0]), (90, "down", [0, 1, 0], [1, 0, 0]), (0, "up", [0, 0, 1], [0, 0, -1])],
+)
+def test_xyz_to_enu_matrices(heading, orientation, xyz, enu):
+    matrices = xyz_to_enu_matrices(np.array([heading]), np.array([0]), np.array([0]), orientation=orientation)
+    np.testing.assert_allclose(matrices[0] @ np.r_[xyz, 0], np.r_[enu, 0], atol=1e-12)
+
+
+# Beams (0.1, -0.2, 0.3, 0.05) m/s, 20 degrees convex, heading 30, pitch 10 and roll 25 degrees.
+# Expected values computed by hand with the RDI Coordinate Transformation manual formulas.
+BEAMS = np.array([0.1, -0.2, 0.3, 0.05])
+RDI_XYZE = [0.438571, -0.365476, 0.066511, -0.465174]
+
+
+def test_beam_to_xyz_matrix_rdi():
+    np.testing.assert_allclose(beam_to_xyz_matrix(20, convex=True) @ BEAMS, RDI_XYZE, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "orientation, gimbal, enu",
+    [
+        ("down", False, [0.197991, -0.508248, -0.181175]),  # P = arctan(tan(pitch) cos(roll))
+        ("up", False, [-0.558887, -0.116843, 0.065828]),  # R = roll + 180
+        ("down", True, [0.199468, -0.505689, -0.186633]),
+        ("up", True, [-0.559391, -0.117716, 0.059704]),
+    ],
+)
+def test_xyz_to_enu_matrices_rdi(orientation, gimbal, enu):
+    matrices = xyz_to_enu_matrices(np.array([30]), np.array([10]), np.array([25]), orientation, gimbal=gimbal)
+    np.testing.assert_allclose(matrices[0] @ RDI_XYZE, np.r_[enu, RDI_XYZE[3]], atol=2e-6)
+
+
+@pytest.mark.parametrize(
+    "orientation, enu",
+    [("down", [0.198, -0.508, -0.181, -0.465]), ("up", [-0.559, -0.117, 0.066, -0.465])],
+)
+def test_transform_to_earth_rdi(orientation, enu):
+    vel = np.tile(BEAMS, (3, 2, 1))
+    transform_to_earth(vel, np.full(3, 30), np.full(3, 10), np.full(3, 25), beam_angle=20, orientation=orientation)
+    np.testing.assert_allclose(vel, np.broadcast_to(enu, vel.shape))
+
+
+@pytest.mark.parametrize("orientation", ["down", "up"])
+def test_transform_to_earth_pycurrents(orientation):
+    pycurrents_transform = pytest.importorskip("pycurrents.adcp.transform")
+    rng = np.random.default_rng(0)
+    heading, pitch, roll = rng.uniform(0, 360, 20), rng.normal(0, 10, 20), rng.normal(0, 10, 20)
+    vel = rng.uniform(-1, 1, (20, 5, 4))
+
+    xyze = pycurrents_transform.Transform(angle=20, geometry="concave").beam_to_xyz(vel)
+    expected = pycurrents_transform.rdi_xyz_enu(xyze, heading, pitch, roll, orientation=orientation)
+    transform_to_earth(vel, heading, pitch, roll, beam_angle=20, convex=False, orientation=orientation, decimals=None)
+
+    np.testing.assert_allclose(vel, expected, atol=1e-9)
+
+
+def test_transform_to_earth():
+    rng = np.random.default_rng(0)
+    heading, pitch, roll = rng.uniform(-180, 180, 50), rng.normal(0, 5, 50), rng.normal(0, 5, 50)
+    vel = rng.uniform(-1, 1, (50, 10, 4))
+    vel[0, 0, 0] = VEL_FILL_VALUE
+    vel[0, 1, :2] = np.nan
+
+    expected = np.einsum(
+        "tij,tdj->tdi",
+        xyz_to_enu_matrices(heading, pitch, roll, orientation="up"),
+        np.einsum("ij,tdj->tdi", beam_to_xyz_matrix(25, convex=False), vel),
+    )
+    transform_to_earth(vel, heading, pitch, roll, beam_angle=25, convex=False, orientation="up", chunk_size=7)
+
+    np.testing.assert_allclose(vel[1:], expected[1:], atol=5e-4)
+    assert np.isfinite(vel[0, 0]).all() and vel[0, 0, 3] == 0  # 3-beam solution
+    assert (vel[0, 1] == VEL_FILL_VALUE).all()
+
+
+def test_transform_to_earth_bottom_track_xyz():
+    bt_vel = np.array([[1, 0, 0, 0.1], [0, 1, 0, VEL_FILL_VALUE], [np.nan, 1, 0, 0.1]])
+    transform_to_earth(bt_vel, heading=np.full(3, 90), pitch=np.zeros(3), roll=np.zeros(3))
+    np.testing.assert_allclose(bt_vel[:2], [[0, -1, 0, 0.1], [1, 0, 0, VEL_FILL_VALUE]], atol=1e-12)
+    assert (bt_vel[2] == VEL_FILL_VALUE).all()
@@ -0,0 +1,73 @@
+import importlib.util
+import os
+
+import pytest
+from magtogoek.batch import Job, print_jobs_report, run_jobs
+
+
+def _write_pid(filename):
+    with open(filename, "w") as f:
+        f.write(str(os.getpid()))
+
+
+def _fail():
+    raise ValueError("bad input")
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_run_jobs(tmp_path, n_jobs):
+    jobs = [Job(f"job_{i}", _write_pid, (tmp_path / f"{i}.txt",)) for i in range(3)]
+    jobs.insert(1, Job("failed", _fail))
+
+    reports = run_jobs(jobs, n_jobs=n_jobs)
+    print_jobs_report(reports)
+
+    assert [(r.name, r.status) for r in reports] == [
+        ("job_0", "done"), ("failed", "failed"), ("job_1", "done"), ("job_2", "done")
+    ]
+    assert reports[1].error == "ValueError('bad input')"
+    pids = {(tmp_path / f"{i}.txt").read_text() for i in range(3)}
+    assert (str(os.getpid()) in pids) is (n_jobs == 1)
+
+
+def _read_rti(filenames):
+    from magtogoek.adcp.rti_reader import RtiReader
+
+    assert len(RtiReader(filenames).read().vel) == 6
+
+
+def _read_pd0(filenames):
+    from magtogoek.adcp.pd0_reader import Pd0Reader
+
+    assert len(Pd0Reader(filenames, sonar="wh", yearbase=2021).read().vel) == 6
+
+
+def _check_pd0_fixed_leader(filenames):
+    from magtogoek.adcp.loader import check_pd0_fixed_leader
+
+    assert check_pd0_fixed_leader(filenames) == (True, 0)
+
+
+def _write_files(tmp_path, suffix, make_ensemble):
+    filenames = []
+    for i, minutes in enumerate([range(0, 3), range(3, 6)]):
+        filename = tmp_path / f"test_{i}{suffix}"
+        filename.write_bytes(b"".join(make_ensemble(m) for m in minutes))
+        filenames.append(str(filename))
+    return filenames
+
+
+def test_run_jobs_with_readers_pools(tmp_path):
+    """The jobs can start the readers processes pools."""
+    from pd0_reader_test import _velocity, make_pd0_ensemble
+    from rti_reader_test import make_ensemble
+
+    rti_files = _write_files(tmp_path, ".ENS", lambda m: make_ensemble(m, minute=m))
+    pd0_files = _write_files(tmp_path, ".000", lambda m: make_pd0_ensemble(m, _velocity(m)))
+    jobs = [Job("rti", _read_rti, (rti_files,)), Job("pd0", _read_pd0, (pd0_files,))]
+    if importlib.util.find_spec("pycurrents") is not None:
+        jobs.append(Job("fixed_leader", _check_pd0_fixed_leader, (pd0_files,)))
+
+    reports = run_jobs(jobs, n_jobs=2)
+
+    assert [(r.status, r.error) for r in reports] == [("done", "")] * len(jobs)
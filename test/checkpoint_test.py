@@ -0,0 +1,78 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.checkpoint import checkpoint_key, read_checkpoint, write_checkpoint
+
+
+def test_checkpoint_key(tmp_path):
+    filename = tmp_path / "adcp.000"
+    filename.write_bytes(b"\x7f\x7f" * 10)
+    options = dict(sonar="wh", yearbase=2021, depth_range=[0, 10])
+
+    key = checkpoint_key([str(filename)], options)
+    assert key == checkpoint_key([str(filename)], dict(options))
+    assert key != checkpoint_key([str(filename)], {**options, "yearbase": 2022})
+
+    stat = filename.stat()
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert key != checkpoint_key([str(filename)], options)
+
+
+@pytest.mark.parametrize("library", [np, xr])
+def test_checkpoint_key_libraries_versions(monkeypatch, library):
+    key = checkpoint_key([], dict(sonar="wh"))
+    monkeypatch.setattr(library, "__version__", "0.0.0")
+    assert key != checkpoint_key([], dict(sonar="wh"))
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    dataset = xr.Dataset(
+        {"u": (["depth", "time"], np.arange(6, dtype="float32").reshape(2, 3))},
+        coords={"depth": [1.0, 2.0], "time": np.arange(3).astype("datetime64[s]")},
+        attrs={"magnetic_declination": None, "logbook": "[Loading adcp data]\n"},
+    )
+    path = tmp_path / "checkpoints" / "key.pkl"
+    write_checkpoint(path, dataset, logbook="Bin counts : 2\n")
+
+    cached, logbook = read_checkpoint(path)
+    xr.testing.assert_identical(cached, dataset)
+    assert cached.u.dtype == np.float32 and logbook == "Bin counts : 2\n"
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_checkpoint_lazy_dataset(tmp_path):
+    """A checkpoint of a dataset read lazily from a file can be read without the file."""
+    dask = pytest.importorskip("dask")
+    import dask.array as da
+
+    filename = tmp_path / "u.npy"
+    np.save(filename, np.arange(6.0))
+    u = da.from_delayed(dask.delayed(np.load)(str(filename)), shape=(6,), dtype=float)
+    dataset = xr.Dataset({"u": (["time"], u)})
+    path = tmp_path / "key.pkl"
+    write_checkpoint(path, dataset)
+    filename.unlink()
+
+    cached, _ = read_checkpoint(path)
+    assert cached.u.chunks is None
+    np.testing.assert_array_equal(cached.u.data, np.arange(6.0))
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"",  # EOFError
+        b"not a pickle",  # UnpicklingError
+        b"cmissing_module\nDataset\n.",  # ImportError
+        b"cxarray\nMissingClass\n.",  # AttributeError
+        pickle.dumps({"dataset": None}),  # KeyError
+        pickle.dumps(None),  # TypeError
+    ],
+)
+def test_read_checkpoint_unreadable(tmp_path, content):
+    path = tmp_path / "key.pkl"
+    path.write_bytes(content)
+    assert read_checkpoint(path) is None
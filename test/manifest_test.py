@@ -0,0 +1,24 @@
+from magtogoek.manifest import is_up_to_date, write_manifest
+
+
+def test_manifest(tmp_path):
+    manifest_path = tmp_path / "adcp_manifest.json"
+    netcdf_path, log_path = tmp_path / "adcp.nc", tmp_path / "adcp.log"
+    netcdf_path.write_bytes(b"netcdf")
+    log_path.write_text("log")
+
+    assert not is_up_to_date(manifest_path, "hash")
+
+    write_manifest(manifest_path, "hash", outputs=[netcdf_path, log_path])
+    assert is_up_to_date(manifest_path, "hash")
+    assert not is_up_to_date(manifest_path, "new_hash")
+
+    netcdf_path.write_bytes(b"modified netcdf")
+    assert not is_up_to_date(manifest_path, "hash")
+
+    write_manifest(manifest_path, "hash", outputs=[netcdf_path, log_path])
+    log_path.unlink()
+    assert not is_up_to_date(manifest_path, "hash")
+
+    manifest_path.write_text("not json")
+    assert not is_up_to_date(manifest_path, "hash")
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.netcdf_append import append_to_netcdf, get_last_time
+
+
+def _dataset(times, u, lon):
+    dataset = xr.Dataset(
+        {
+            "u": (["depth", "time"], u, {"data_min": np.nanmin(u), "data_max": np.nanmax(u)}),
+            "u_QC": (["depth", "time"], np.ones(u.shape, dtype="int8")),
+            "lon": (["time"], lon),
+        },
+        coords={"depth": [1.0, 2.0], "time": times},
+        attrs={
+            "time_coverage_start": str(times[0].astype("datetime64[s]")),
+            "time_coverage_end": str(times[-1].astype("datetime64[s]")),
+            "geospatial_lon_min": lon.min(),
+            "geospatial_lon_max": lon.max(),
+            "longitude": lon.mean(),
+            "history": "processed\n",
+        },
+    )
+    dataset.u.encoding = {"dtype": "float32", "_FillValue": -9999.0}
+    dataset.time.encoding = {"units": "seconds since 1970-1-1 00:00:00Z", "dtype": "float64"}
+    return dataset
+
+
+def test_append_to_netcdf(tmp_path):
+    path = tmp_path / "adcp.nc"
+    times = np.datetime64("2021-01-01") + np.arange(4) * np.timedelta64(60, "s")
+    _dataset(times, np.arange(8.0).reshape(2, 4), np.zeros(4)).to_netcdf(path, unlimited_dims=["time"])
+
+    new_times = np.datetime64("2021-01-02T00:00:30.5") + np.arange(2) * np.timedelta64(60, "s")
+    append_to_netcdf(path, _dataset(new_times, np.array([[np.nan, 20.0], [-1.0, 3.0]]), np.ones(2)))
+
+    with xr.open_dataset(path) as dataset:
+        np.testing.assert_array_equal(dataset.time.data, np.concatenate([times, new_times]))
+        np.testing.assert_array_equal(dataset.u.data[:, 4:], [[np.nan, 20.0], [-1.0, 3.0]])
+        assert dataset.u_QC.dtype == np.int8 and dataset.lon.data.tolist() == [0, 0, 0, 0, 1, 1]
+        assert dataset.u.attrs["data_min"] == -1.0 and dataset.u.attrs["data_max"] == 20.0
+        assert dataset.attrs["time_coverage_start"] == "2021-01-01T00:00:00"
+        assert dataset.attrs["time_coverage_end"] == "2021-01-02T00:01:30"
+        assert dataset.attrs["time_coverage_duration"] == 1.001
+        assert dataset.attrs["geospatial_lon_max"] == 1.0 and dataset.attrs["longitude"] == 0.3333
+        assert "2 records appended" in dataset.attrs["history"]
+    assert get_last_time(path) == new_times[-1]
+
+    with pytest.raises(ValueError):
+        append_to_netcdf(path, _dataset(new_times, np.ones((2, 2)), np.ones(2)))
+
+
+def test_append_to_netcdf_errors(tmp_path):
+    path = tmp_path / "adcp.nc"
+    times = np.datetime64("2021-01-01") + np.arange(4) * np.timedelta64(60, "s")
+    _dataset(times, np.ones((2, 4)), np.zeros(4)).to_netcdf(path)
+    new_times = np.datetime64("2021-01-02") + np.arange(2) * np.timedelta64(60, "s")
+
+    with pytest.raises(ValueError, match="not unlimited"):
+        append_to_netcdf(path, _dataset(new_times, np.ones((2, 2)), np.ones(2)))
+
+    new_dataset = _dataset(new_times, np.ones((2, 2)), np.ones(2)).assign_coords(depth=[1.0, 3.0])
+    with pytest.raises(ValueError, match="differs"):
+        append_to_netcdf(path, new_dataset)
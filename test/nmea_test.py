@@ -0,0 +1,34 @@
+import numpy as np
+from magtogoek.nmea import extract_nmea_fix, nmea_checksum
+
+GGA = b"$GPGGA,123519.50,4807.038,N,01131.000,W,1,08,0.9,545.4,M,46.9,M,,*7E"
+RMC_BODY = b"GPRMC,123520,A,4807.038,S,01131.000,E,022.4,084.4,230394,003.1,W"
+ZDA = b"$GPZDA,201530.00,04,07,2002,00,00*60"
+
+
+def _sentence(body: bytes) -> bytes:
+    return b"$" + body + b"*" + f"{nmea_checksum(body):02X}".encode()
+
+
+RMC = _sentence(RMC_BODY)
+
+
+def test_nmea_checksum():
+    assert _sentence(GGA[1:-3]) == GGA
+    assert _sentence(ZDA[1:-3]) == ZDA
+
+
+def test_extract_nmea_fix():
+    lon, lat, time_of_day, date = extract_nmea_fix(GGA + b"\r\n" + ZDA + b"\r\n")
+    np.testing.assert_allclose([lon, lat], [-11.516666, 48.1173], rtol=1e-6)
+    assert time_of_day == np.timedelta64((12 * 3600 + 35 * 60 + 19) * 1000 + 500, "ms")
+    assert date == np.datetime64("2002-07-04")
+
+
+def test_extract_nmea_fix_rmc_and_bad_checksum():
+    bad_gga = GGA.replace(b"4807", b"4808")
+    lon, lat, time_of_day, date = extract_nmea_fix(bad_gga + b"\n" + RMC)
+    np.testing.assert_allclose([lon, lat], [11.516666, -48.1173], rtol=1e-6)
+    assert date == np.datetime64("1994-03-23")
+
+    assert np.isnan(extract_nmea_fix(bad_gga)[0])
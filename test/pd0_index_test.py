@@ -0,0 +1,78 @@
+import struct
+
+import numpy as np
+from magtogoek.adcp.pd0_index import (build_pd0_index, get_index_path, load_pd0_index, read_pd0_sys_cfg,
+                                      read_pd0_time)
+
+
+def make_pd0_ensemble(minute: int, sys_cfg: int = 0) -> bytes:
+    """Make a PD0 ensemble with a Fixed Leader and a Variable Leader."""
+    fixed_leader = struct.pack("<H2BH", 0x0000, 50, 40, sys_cfg) + bytes(53)
+    variable_leader = struct.pack("<HH7B", 0x0080, 1, 21, 1, 1, 0, minute, 0, 50) + bytes(52)
+    header_size = 6 + 2 * 2
+    offsets = struct.pack("<2H", header_size, header_size + len(fixed_leader))
+    ens_length = header_size + len(fixed_leader) + len(variable_leader)
+    ensemble = b"\x7f\x7f" + struct.pack("<HBB", ens_length, 0, 2) + offsets + fixed_leader + variable_leader
+    return ensemble + struct.pack("<H", sum(ensemble) % 65536)
+
+
+def test_build_pd0_index(tmp_path):
+    filename = tmp_path / "test.000"
+    ensembles = [make_pd0_ensemble(minute) for minute in range(3)]
+    corrupted = bytearray(make_pd0_ensemble(10))
+    corrupted[20] += 1
+    filename.write_bytes(b"\x7f\x7fgarbage" + ensembles[0] + bytes(corrupted) + ensembles[1] + ensembles[2][:-1])
+
+    index = build_pd0_index(str(filename))
+    assert index["offset"].tolist() == [9, 9 + 2 * len(ensembles[0])]
+    assert (index["length"] == len(ensembles[0])).all()
+    assert read_pd0_time(str(filename), index[1], yearbase=2021) == np.datetime64("2021-01-01T00:01:00.500")
+
+
+def test_load_pd0_index_sidecar(tmp_path):
+    filename = tmp_path / "test.000"
+    filename.write_bytes(b"".join(make_pd0_ensemble(minute) for minute in range(3)))
+
+    index = load_pd0_index(str(filename))
+    assert get_index_path(str(filename)).is_file()
+    np.testing.assert_array_equal(load_pd0_index(str(filename)), index)
+    np.testing.assert_array_equal(index, build_pd0_index(str(filename)))
+
+    with open(filename, "ab") as f:
+        f.write(make_pd0_ensemble(3))
+    assert len(load_pd0_index(str(filename))) == 4
+
+
+def test_read_pd0_sys_cfg(tmp_path):
+    filename = tmp_path / "test.000"
+    ensembles = [make_pd0_ensemble(0, sys_cfg) for sys_cfg in (0b11001011, 0b01001011, 2 ** 16 - 1)]
+    filename.write_bytes(b"garbage" + ensembles[0] + b"\x7f\x7f" + ensembles[1] + ensembles[2] + ensembles[0][:-10])
+
+    assert read_pd0_sys_cfg(str(filename)).tolist() == [0b11001011, 0b01001011, 2 ** 16 - 1]
+
+
+def test_read_pd0_sys_cfg_checksum(tmp_path):
+    """A corrupted ensemble followed by a header ID is not read, as in the index."""
+    filename = tmp_path / "test.000"
+    corrupted = bytearray(make_pd0_ensemble(0, 0b1))
+    corrupted[30] += 1
+    filename.write_bytes(make_pd0_ensemble(0, 0b11) + bytes(corrupted) + make_pd0_ensemble(1, 0b111))
+
+    index = build_pd0_index(str(filename))
+    assert len(index) == 2
+    assert read_pd0_sys_cfg(str(filename)).tolist() == [0b11, 0b111]
+    assert read_pd0_sys_cfg(str(filename), index).tolist() == [0b11, 0b111]
+
+
+def test_read_pd0_sys_cfg_missing_fixed_leader(tmp_path):
+    """The ensembles without a Fixed Leader are masked, the SysCfg stay aligned with the index."""
+    filename = tmp_path / "test.000"
+    variable_leader = struct.pack("<HH7B", 0x0080, 1, 21, 1, 1, 0, 0, 0, 50) + bytes(52)
+    header = b"\x7f\x7f" + struct.pack("<HBBH", 8 + len(variable_leader), 0, 1, 8)
+    no_fixed_leader = header + variable_leader
+    no_fixed_leader += struct.pack("<H", sum(no_fixed_leader) % 65536)
+    filename.write_bytes(make_pd0_ensemble(0, 0b11) + no_fixed_leader + make_pd0_ensemble(1, 0b111))
+
+    sys_cfg = read_pd0_sys_cfg(str(filename))
+    assert len(sys_cfg) == len(load_pd0_index(str(filename))) == 3
+    assert sys_cfg.tolist() == [0b11, None, 0b111]
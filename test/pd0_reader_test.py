@@ -0,0 +1,140 @@
+import struct
+
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.adcp.pd0_index import get_index_path
+from magtogoek.adcp.pd0_reader import Pd0Reader
+
+NCELLS = 3
+NBEAMS = 4
+SYS_CFG = 0b0100_0001_1100_1010  # 300 kHz, convex, up, 20 degrees
+
+
+def make_pd0_ensemble(
+        minute: int, velocity: np.ndarray, bottom_track: bool = True, xducer_depth: int = 105, coord_xform: int = 0b11111
+) -> bytes:
+    """Make a PD0 ensemble with Fixed Leader, Variable Leader, Velocity, Correlation, Echo, Percent Good and BT."""
+    fixed_leader = struct.pack(
+        "<H2BH4BH3H", 0x0000, 51, 40, SYS_CFG, 0, 0, NBEAMS, NCELLS, 45, 100, 88, 0
+    ) + bytes(7) + struct.pack("<BhhBBHH", coord_xform, 0, -1530, 0, 0, 220, 90) + bytes(23)
+    variable_leader = struct.pack(
+        "<HH7BBHHHHhhHh", 0x0080, 1, 21, 1, 1, 0, minute, 0, 50, 0, 0, 1500, xducer_depth, 18000, -150, 200, 35, 1250
+    ) + bytes(20) + struct.pack("<I", 10500) + bytes(13)
+    data_types = [
+        fixed_leader,
+        variable_leader,
+        struct.pack("<H", 0x0100) + velocity.astype("<i2").tobytes(),
+        struct.pack("<H", 0x0200) + np.full(NCELLS * NBEAMS, 120, dtype="u1").tobytes(),
+        struct.pack("<H", 0x0300) + np.full(NCELLS * NBEAMS, 80, dtype="u1").tobytes(),
+        struct.pack("<H", 0x0400) + np.full(NCELLS * NBEAMS, 100, dtype="u1").tobytes(),
+    ]
+    if bottom_track:
+        data_types.append(
+            struct.pack("<H", 0x0600) + bytes(14) + struct.pack("<4H4h", 2000, 2100, 0, 2000, 100, -200, 0, -32768)
+            + bytes(45) + bytes([0, 1, 0, 0])
+        )
+
+    header_size = 6 + 2 * len(data_types)
+    offsets = np.cumsum([header_size] + [len(d) for d in data_types[:-1]])
+    ens_length = header_size + sum(len(d) for d in data_types)
+    ensemble = b"\x7f\x7f" + struct.pack("<HBB", ens_length, 0, len(data_types))
+    ensemble += struct.pack(f"<{len(data_types)}H", *offsets) + b"".join(data_types)
+    return ensemble + struct.pack("<H", sum(ensemble) % 65536)
+
+
+def _velocity(n: int) -> np.ndarray:
+    velocity = np.arange(NCELLS * NBEAMS).reshape(NCELLS, NBEAMS) * 10 + n
+    velocity[-1, -1] = -32768
+    return velocity
+
+
+@pytest.fixture
+def pd0_files(tmp_path):
+    filenames = []
+    for i, minutes in enumerate([range(0, 4), range(4, 6)]):
+        filename = tmp_path / f"test_{i}.000"
+        filename.write_bytes(
+            b"".join(make_pd0_ensemble(m, _velocity(m), bottom_track=(m != 2)) for m in minutes)
+        )
+        filenames.append(str(filename))
+    return filenames
+
+
+def test_pd0_reader_read(pd0_files):
+    data = Pd0Reader(pd0_files[0], sonar="wh", yearbase=2021).read()
+
+    assert data.vel.shape == (4, NCELLS, NBEAMS)
+    np.testing.assert_allclose(data.vel[1, 0], [0.001, 0.011, 0.021, 0.031])
+    assert data.vel[1, -1, -1] == -32768
+    np.testing.assert_array_equal(data.vel1, data.vel[..., 0])
+    assert (data.cor == 120).all() and (data.amp == 80).all() and (data.pg4 == 100).all()
+
+    np.testing.assert_allclose(data.dday, np.arange(4) / 1440 + 0.5 / 86400)
+    np.testing.assert_allclose(data.XducerDepth, 10.5)
+    np.testing.assert_allclose(data.heading, 180)
+    np.testing.assert_allclose(data.pitch, -1.5)
+    np.testing.assert_allclose(data.temperature, 12.5)
+    assert (data.VL["Pressure"] == 10500).all()
+
+    np.testing.assert_allclose(data.bt_vel[0], [0.1, -0.2, 0, -32768])
+    assert (data.bt_vel[2] == -32768).all()
+    np.testing.assert_allclose(data.bt_depth[0], [20, 21 + 655.36, np.nan, 20])
+
+    assert data.CellSize == 1 and data.Blank == 0.88 and data.Bin1Dist == 2.2
+    np.testing.assert_allclose(data.dep, [2.2, 3.2, 4.2])
+    assert data.sysconfig.kHz == 300 and data.sysconfig.convex and data.sysconfig.up
+    assert data.sysconfig.angle == 20
+    assert data.trans.coordsystem == "earth"
+    assert data.FL["EV"] == -1530 and data.FL["Pulse"] == 90 and data.FL["FWV"] == 51
+
+
+def test_pd0_reader_trims_and_files(pd0_files):
+    data = Pd0Reader(pd0_files, sonar="wh", yearbase=2021).read(start_index=1, stop_index=1)
+    np.testing.assert_allclose(data.dday * 1440, [1, 2, 3, 4], atol=0.01)
+    assert data.vel.shape == (4, NCELLS, NBEAMS)
+
+    batches = list(Pd0Reader(pd0_files, sonar="wh", yearbase=2021).iter_batches(batch_size=3))
+    assert [(b.filename, len(b.dday)) for b in batches] == [("test_0.000", 3), ("test_0.000", 1), ("test_1.000", 2)]
+
+    assert not Pd0Reader(pd0_files, sonar="wh", yearbase=2021).read(start_index=4, stop_index=2)
+
+
+def test_pd0_reader_save_index(pd0_files):
+    Pd0Reader(pd0_files, sonar="wh", yearbase=2021, save_index=False).read()
+    assert not any(get_index_path(filename).exists() for filename in pd0_files)
+
+    Pd0Reader(pd0_files, sonar="wh", yearbase=2021).read()
+    assert all(get_index_path(filename).is_file() for filename in pd0_files)
+
+
+def test_load_bottom_depth(pd0_files):
+    """Bottom depths are kept if some beams ranges are missing (0, read as nan)."""
+    pytest.importorskip("pycurrents")
+    from magtogoek.adcp.loader import load_adcp_binary
+
+    dataset = load_adcp_binary(pd0_files[0], sonar="wh", yearbase=2021, pd0_reader="magtogoek")
+    bt_depth = np.nanmean([20, 21 + 655.36, 20])  # up orientation: water height above the adcp.
+    np.testing.assert_allclose(dataset.bt_depth, [bt_depth, bt_depth, np.nan, bt_depth])
+
+
+@pytest.mark.parametrize("coord_xform, float32", [(0b11111, False), (0b00111, True)])
+def test_load_chunked(tmp_path, coord_xform, float32):
+    """The chunked profiles are read from the files and match the ones loaded in memory."""
+    pytest.importorskip("pycurrents")
+    pytest.importorskip("dask")
+    from magtogoek.adcp.loader import load_adcp_binary
+
+    filenames = []
+    for i, minutes in enumerate([range(0, 4), range(4, 6)]):
+        filename = tmp_path / f"test_{i}.000"
+        filename.write_bytes(b"".join(make_pd0_ensemble(m, _velocity(m), coord_xform=coord_xform) for m in minutes))
+        filenames.append(str(filename))
+
+    options = dict(sonar="wh", yearbase=2021, pd0_reader="magtogoek", leading_index=1, float32=float32)
+    dataset = load_adcp_binary(filenames, **options)
+    chunked = load_adcp_binary(filenames, **options, chunk_size=2)
+
+    assert chunked.u.chunks == ((NCELLS,), (2, 2, 1))
+    assert list(chunked.data_vars) == list(dataset.data_vars)
+    xr.testing.assert_equal(chunked.compute(), dataset)
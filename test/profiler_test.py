@@ -0,0 +1,43 @@
+import json
+import pstats
+
+import numpy as np
+import pytest
+from magtogoek.profiler import StageProfiler
+
+
+def test_stage_profiler(tmp_path):
+    profiler = StageProfiler(profile=True)
+    with profiler.stage("load") as stage:
+        stage["ensembles"] = len(np.sort(np.random.default_rng(0).random(10 ** 5)))
+    with profiler.stage("quality_control"):
+        pass
+
+    assert [record["name"] for record in profiler.stages] == ["load", "quality_control"]
+    assert all(record["wall_time_s"] >= 0 and record["cpu_time_s"] >= 0 for record in profiler.stages)
+    assert "ensembles/s" in profiler.log_lines()[0] and "ensembles/s" not in profiler.log_lines()[1]
+
+    profiler.write_report(tmp_path / "report.json")
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["stages"][0]["ensembles"] == 10 ** 5
+    assert set(report["total"]) == {"wall_time_s", "cpu_time_s", "max_rss_so_far_mb"}
+
+    filenames = profiler.dump_stats(tmp_path / "profile")
+    assert [f.split("profile_")[-1] for f in filenames] == ["00_load.prof", "01_quality_control.prof"]
+    assert pstats.Stats(filenames[0]).total_calls > 0
+
+
+def test_stage_profiler_rss():
+    profiler = StageProfiler()
+    with profiler.stage("allocate"):
+        array = np.ones(2 ** 25)  # 256 MB
+    with profiler.stage("free"):
+        del array
+
+    allocate, free = profiler.stages
+    if allocate["rss_start_mb"] is None:
+        pytest.skip("The current RSS is only available on Linux.")
+    assert allocate["rss_end_mb"] - allocate["rss_start_mb"] > 200
+    assert free["rss_start_mb"] - free["rss_end_mb"] > 200
+    assert free["max_rss_so_far_mb"] - free["rss_end_mb"] > 200
+    assert "RSS" in profiler.log_lines()[0]
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import xarray as xr
+from magtogoek.tools import regrid_dataset
+
+
+def make_dataset() -> xr.Dataset:
+    rng = np.random.default_rng(0)
+    depth, time = np.array([1.0, 2.0, 3.0, 4.0, 5.5, 6.0, 9.0, 12.0]), np.arange(40)
+    u = rng.normal(size=(len(depth), len(time))).astype(np.float32)
+    u[rng.random(u.shape) < 0.3] = np.nan
+    flags = rng.choice([5, 8, 9], size=u.shape)
+    return xr.Dataset(
+        {
+            "u": (["depth", "time"], u, {"units": "m s-1"}),
+            "u_QC": (["depth", "time"], flags),
+            "amp": (["time", "depth"], rng.integers(0, 10, size=u.shape[::-1])),
+            "heading": (["time"], rng.uniform(0, 360, len(time))),
+        },
+        coords={"depth": depth, "time": time},
+        attrs={"title": "regrid"},
+    )
+
+
+def test_bin_regrid():
+    dataset = make_dataset()
+    grid = np.array([1.5, 3.5, 5.5, 7.5, 9.5])  # edges: 0.5, 2.5, 4.5, 6.5, 8.5, 10.5
+    regridded = regrid_dataset(dataset, grid, method="bin")
+
+    edges = np.array([0.5, 2.5, 4.5, 6.5, 8.5, 10.5])
+    for var in ["u", "amp"]:
+        values = dataset[var].transpose("depth", "time").values.astype(float)
+        with np.errstate(invalid="ignore"), pytest.warns(RuntimeWarning):
+            expected = np.stack([
+                np.nanmean(values[(dataset.depth.data > low) & (dataset.depth.data <= high)], axis=0)
+                for low, high in zip(edges[:-1], edges[1:])
+            ])
+        np.testing.assert_allclose(regridded[var].transpose("depth", "time"), expected, rtol=1e-6)
+
+    assert np.isnan(regridded.u.sel(depth=7.5)).all()  # empty bin
+    assert regridded.u.dtype == np.float32 and regridded.amp.dtype == np.float64
+    assert regridded.amp.dims == ("time", "depth") and regridded.u.attrs == {"units": "m s-1"}
+    xr.testing.assert_identical(regridded.heading, dataset.heading)
+    assert regridded.attrs["title"] == "regrid"
+
+
+def test_bin_regrid_flags():
+    dataset = make_dataset()
+    grid = np.array([1.5, 3.5, 5.5, 7.5, 9.5])
+    regridded = regrid_dataset(dataset, grid, method="bin", flags=["u_QC"])
+
+    flags = dataset.u_QC.values
+    for i, (low, high) in enumerate([(0.5, 2.5), (2.5, 4.5), (4.5, 6.5), (6.5, 8.5), (8.5, 10.5)]):
+        in_bin = flags[(dataset.depth.data > low) & (dataset.depth.data <= high)]
+        expected = np.where((in_bin == 8).any(axis=0), 8, np.where((in_bin == 5).any(axis=0), 5, 9))
+        np.testing.assert_array_equal(regridded.u_QC.values[i], expected)
+    assert regridded.u_QC.dtype == np.uint8
+
+
+def test_chunked_bin_regrid():
+    pytest.importorskip("dask")
+    dataset = make_dataset()
+    grid = np.array([1.5, 3.5, 5.5, 7.5, 9.5])
+    regridded = regrid_dataset(dataset, grid, method="bin", flags=["u_QC"])
+    chunked = regrid_dataset(dataset.chunk({"time": 15}), grid, method="bin", flags=["u_QC"])
+
+    assert chunked.u.chunks is not None
+    xr.testing.assert_identical(chunked.compute(), regridded)
@@ -0,0 +1,236 @@
+import binascii
+import struct
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from magtogoek.adcp.rti_index import build_ens_index, get_index_path, load_ens_index
+from magtogoek.adcp.rti_reader import Bunch, RtiReader
+from rti_python.Codecs.BinaryCodec import BinaryCodec
+
+NBIN = 5
+NBEAM = 4
+SERIAL_NUMBER = "01300000000000000000000000000001"
+
+
+def _dataset(name: str, values, ds_type: int = 10, element_multiplier: int = 1) -> bytes:
+    """Encode a RTB dataset. Values are [bin x beam] ordered beam first like in the ENS files."""
+    values = np.asarray(values)
+    num_elements = values.shape[0] if values.ndim == 2 else values.size
+    element_multiplier = values.shape[1] if values.ndim == 2 else element_multiplier
+    header = struct.pack("<5i8s", ds_type, num_elements, element_multiplier, 0, 8, name.encode())
+    fmt = "<f" if ds_type == 10 else "<i"
+    data = np.asarray(values.T.ravel(), dtype=fmt).tobytes()
+    return header + data
+
+
+def _ensemble_data(ens_num: int, minute: int) -> bytes:
+    header = struct.pack("<5i8s", 20, 23, 1, 0, 8, b"E000008\0")
+    ints = struct.pack("<13i", ens_num, NBIN, NBEAM, 1, 1, 0, 2020, 1, 1, 0, minute, 0, 0)
+    return header + ints + SERIAL_NUMBER.encode() + bytes([3, 2, 1, 0x41]) + bytes([0, 0, 0, 1])
+
+
+def _nmea_dataset(sentences: bytes) -> bytes:
+    header = struct.pack("<5i8s", 50, len(sentences), 1, 0, 8, b"E000011\0")
+    return header + sentences
+
+
+def make_ensemble(ens_num: int, minute: int = 0, bad_checksum: bool = False, nmea: bytes = None) -> bytes:
+    """Make a valid RTB ensemble with earth velocities."""
+    payload = _ensemble_data(ens_num, minute)
+    if nmea is not None:
+        payload += _nmea_dataset(nmea)
+    payload += _dataset("E000009\0", [0.5, 1, 0, 0, 10, 1, 180, 5, 5, 30, 10000, 10, 1500, 0, 0, 0, 0, 0, 0])
+    payload += _dataset("E000014\0", [0] * 6 + [300000] + [0] * 18)
+    velocity = np.arange(NBIN * NBEAM, dtype=float).reshape(NBIN, NBEAM) / 100 + ens_num
+    payload += _dataset("E000003\0", velocity)
+    payload += _dataset("E000004\0", np.full((NBIN, NBEAM), 40.0))
+    payload += _dataset("E000005\0", np.full((NBIN, NBEAM), 0.5))
+    payload += _dataset("E000007\0", np.full((NBIN, NBEAM), 100), ds_type=20)
+
+    header = b"\x80" * 16 + struct.pack("<IiIi", ens_num, ~ens_num, len(payload), ~len(payload))
+    checksum = binascii.crc_hqx(payload, 0) + (1 if bad_checksum else 0)
+    return header + payload + struct.pack("<I", checksum)
+
+
+@pytest.fixture
+def ens_file(tmp_path):
+    filename = tmp_path / "test.ENS"
+    with open(filename, "wb") as f:
+        f.write(b"garbage")
+        for n in range(1, 6):
+            f.write(make_ensemble(n, minute=n, bad_checksum=(n == 3)))
+        f.write(make_ensemble(6, minute=6)[:-20])  # incomplete ensemble
+    return str(filename)
+
+
+def test_build_ens_index(ens_file):
+    index = build_ens_index(ens_file)
+    assert index["ens_num"].tolist() == [1, 2, 3, 4, 5, 6]
+    assert index["checksum_ok"].tolist() == [True, True, False, True, True, False]
+    assert index["offset"][0] == len(b"garbage")
+    assert (index["length"][:-1] == len(make_ensemble(1))).all()
+
+
+def test_load_ens_index_sidecar(ens_file):
+    index = load_ens_index(ens_file)
+    assert get_index_path(ens_file).is_file()
+    np.testing.assert_array_equal(load_ens_index(ens_file), index)
+
+
+def test_reader_uses_index(ens_file):
+    reader = RtiReader(ens_file)
+    reader.get_files_ens_count()
+    assert reader.files_ens_count == [4]
+
+    reader.current_file = ens_file
+    reader.get_ens_chunks(start=1, stop=3)
+    assert [chunk[16:20] for _, chunk in reader.ens_chunks] == [struct.pack("<I", n) for n in (2, 4)]
+
+
+def test_decode_data_sets_as_array():
+    chunk = make_ensemble(2)
+    ens_list = BinaryCodec.decode_data_sets(chunk)
+    ens_array = BinaryCodec.decode_data_sets(chunk, as_array=True)
+
+    assert isinstance(ens_array.EarthVelocity.Velocities, np.ndarray)
+    assert ens_array.EarthVelocity.Velocities.shape == (NBIN, NBEAM)
+    np.testing.assert_array_equal(ens_array.EarthVelocity.Velocities, ens_list.EarthVelocity.Velocities)
+    np.testing.assert_array_equal(ens_array.Amplitude.Amplitude, ens_list.Amplitude.Amplitude)
+    np.testing.assert_array_equal(ens_array.Correlation.Correlation, ens_list.Correlation.Correlation)
+    np.testing.assert_array_equal(ens_array.GoodEarth.GoodEarth, ens_list.GoodEarth.GoodEarth)
+
+
+def test_reader_read(ens_file):
+    data = RtiReader(ens_file).read()
+    velocity = np.arange(NBIN * NBEAM).reshape(NBIN, NBEAM) / 100
+    assert data.vel.shape == (4, NBIN, NBEAM)
+    np.testing.assert_allclose(data.vel[1], velocity + 2, rtol=1e-6)
+    assert (data.cor == 0.5 * 255).all()
+    assert data.pg.dtype.kind == "i"
+    np.testing.assert_allclose(data.VL["Pressure"], 1000)
+    assert data.datetime.tolist() == [datetime(2020, 1, 1, 0, n) for n in (1, 2, 4, 5)]
+
+
+def test_reader_iter_batches(ens_file):
+    batches = list(RtiReader(ens_file).iter_batches(batch_size=3))
+    assert [len(batch.vel) for batch in batches] == [3, 1]
+    assert batches[0].filename == "test.ENS"
+
+    data = RtiReader(ens_file).read(batch_size=3)
+    np.testing.assert_array_equal(np.concatenate([batch.vel for batch in batches]), data.vel)
+    np.testing.assert_array_equal(data.vel1, data.vel[..., 0])
+
+
+def test_reader_read_multiple_files(ens_file, tmp_path):
+    other_file = tmp_path / "test_2.ENS"
+    other_file.write_bytes(b"".join(make_ensemble(n, minute=n) for n in range(7, 10)))
+
+    reader = RtiReader([ens_file, str(other_file)])
+    batches = list(reader.iter_batches(batch_size=3))
+    assert [(batch.filename, len(batch.vel)) for batch in batches] == [
+        ("test.ENS", 3), ("test.ENS", 1), ("test_2.ENS", 2), ("test_2.ENS", 1)
+    ]
+
+    data = RtiReader([ens_file, str(other_file)]).read(start_index=1, batch_size=3)
+    assert [t.minute for t in data.datetime] == [2, 4, 5, 7, 8, 9]
+
+
+def test_reader_variables(ens_file):
+    ens = BinaryCodec.decode_data_sets(make_ensemble(1), skip=("E000004", "E000007"))
+    assert not ens.IsAmplitude and not ens.IsGoodEarth
+    assert ens.IsCorrelation and ens.IsEarthVelocity
+
+    data = RtiReader(ens_file, variables=["cor"]).read()
+    assert "cor" in data and "amp" not in data and "pg" not in data
+
+    with pytest.raises(ValueError):
+        RtiReader(ens_file, variables=["velocity"])
+
+
+def test_reader_time_window(ens_file, tmp_path):
+    other_file = tmp_path / "test_2.ENS"
+    other_file.write_bytes(b"".join(make_ensemble(n, minute=n) for n in range(7, 10)))
+    filenames = [ens_file, str(other_file)]
+
+    data = RtiReader(filenames).read(start_time="2020-01-01T00:03:00", stop_time="2020-01-01T00:08:00")
+    assert [t.minute for t in data.datetime] == [4, 5, 7, 8]
+
+    data = RtiReader(filenames).read(start_index=3, start_time="2020-01-01T00:02:00")
+    assert [t.minute for t in data.datetime] == [5, 7, 8, 9]
+
+    # Out of bounds time windows are not applied.
+    data = RtiReader(filenames).read(start_time="2021-01-01T00:00:00")
+    assert len(data.datetime) == 7
+
+
+def test_format_rawnav():
+    datetimes = np.arange("2020-01-01T00:00", "2020-01-01T00:20", np.timedelta64(2, "m"), dtype="datetime64[us]")
+    gps_datetimes = datetimes - np.timedelta64(1, "m")
+    data = Bunch(
+        datetime=datetimes.astype(datetime),
+        dday=(datetimes - np.datetime64("2020-01-01")) / np.timedelta64(1, "D"),
+        gps_datetime=gps_datetimes.astype(datetime),
+        longitude=np.array([179.0, 179.5, -180.0, -179.5, -179.0, -178.5, -178.0, -177.5, -177.0, -176.5]),
+        latitude=np.linspace(45, 46, 10),
+    )
+    data.gps_datetime[6] = None  # missing fix
+    data.gps_datetime[7:] = gps_datetimes[7:].astype(datetime) + timedelta(minutes=10)  # gap
+
+    rawnav = RtiReader.format_rawnav(data)
+    lon = rawnav["Lon1_BAM4"] * 180.0 / 2 ** 31
+    lat = rawnav["Lat1_BAM4"] * 180.0 / 2 ** 31
+    np.testing.assert_allclose(lon[:5], [179.25, 179.75, -179.75, -179.25, -178.75])
+    np.testing.assert_allclose(lat[:5], (data.latitude[:5] + data.latitude[1:6]) / 2)
+    assert np.isnan(lon[5:]).all()
+
+
+def test_decode_chunk_nmea():
+    gga = b"$GPGGA,000030.00,4807.038,N,06911.000,W,1,08,0.9,545.4,M,46.9,M,,*78\r\n"
+    _, ppd = RtiReader.decode_chunk(0, make_ensemble(1, minute=1, nmea=gga))
+    np.testing.assert_allclose([ppd.longitude, ppd.latitude], [-69.183333, 48.1173], rtol=1e-6)
+    assert ppd.gps_datetime == np.datetime64("2020-01-01T00:00:30")
+
+    _, ppd = RtiReader.decode_chunk(0, make_ensemble(1, minute=1, nmea=gga), skip=("E000011",))
+    assert "longitude" not in ppd
+
+
+def test_reader_variables_missing_from_first_ensemble(tmp_path):
+    """The NMEA dataset is only in the second and third ensembles."""
+    gga = b"$GPGGA,000030.00,4807.038,N,06911.000,W,1,08,0.9,545.4,M,46.9,M,,*78\r\n"
+    filename = tmp_path / "test.ENS"
+    filename.write_bytes(b"".join(make_ensemble(n, minute=n, nmea=gga if n > 1 else None) for n in range(1, 4)))
+
+    batch = next(RtiReader(str(filename)).iter_batches())
+    np.testing.assert_allclose(batch.longitude, [np.nan, -69.183333, -69.183333], rtol=1e-6)
+    assert batch.gps_datetime[0] is None and batch.gps_datetime[1] == datetime(2020, 1, 1, 0, 0, 30)
+    assert len(batch.vel) == 3
+
+
+def test_reader_read_without_profiles(ens_file):
+    reader = RtiReader(ens_file)
+    data = reader.read(start_index=1, profiles=False)
+    assert not {"vel", "vel1", "cor", "amp", "pg"} & set(data)
+    assert [t.minute for t in data.datetime] == [2, 4, 5]
+
+    bunches = RtiReader.read_segments(list(reader.get_files_read_index().items()))
+    np.testing.assert_array_equal(bunches[0].vel, RtiReader(ens_file).read(start_index=1).vel)
+
+
+def test_load_chunked(ens_file, tmp_path):
+    """The chunked profiles are read from the files and match the ones loaded in memory."""
+    pytest.importorskip("pycurrents")
+    pytest.importorskip("dask")
+    import xarray as xr
+    from magtogoek.adcp.loader import load_adcp_binary
+
+    other_file = tmp_path / "test_2.ENS"
+    other_file.write_bytes(b"".join(make_ensemble(n, minute=n) for n in range(7, 10)))
+
+    filenames = [ens_file, str(other_file)]
+    dataset = load_adcp_binary(filenames, sonar="sw", yearbase=2020, leading_index=1)
+    chunked = load_adcp_binary(filenames, sonar="sw", yearbase=2020, leading_index=1, chunk_size=4)
+
+    assert chunked.u.chunks == ((NBIN,), (4, 2))
+    assert list(chunked.data_vars) == list(dataset.data_vars)
+    xr.testing.assert_equal(chunked.compute(), dataset)